@@ -1,92 +1,184 @@
 """
 Base Agent Class - Foundation for all AI agents
 """
+import asyncio
+import hashlib
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple
 import httpx
-import structlog
+import logging
+import orjson
+from cachetools import TTLCache
 
-logger = structlog.get_logger()
+from agents.http_clients import aclose_clients, get_client
+from agents.ollama_batcher import ollama_batcher
+from agents.rag_batcher import RagBatcher
+from agents.schemas import ChatMessage, OllamaChatChunk, OllamaChatRequest
+from agents.utils import JSON_HEADERS
+
+logger = logging.getLogger(__name__)
+
+RULES_ENGINE_URL = "http://rules-engine:8001"
+RAG_CHAT_URL = "http://rag-chat:8003"
+RULES_CACHE_TTL = 60.0  # seconds
+
+# Keep the model resident between calls and use one fixed context size so
+# Ollama can reuse the loaded runner and its cached system-prompt prefix
+OLLAMA_KEEP_ALIVE = "30m"
+OLLAMA_NUM_CTX = 8192
+RAG_CACHE_SIZE = 1024
+RAG_CACHE_TTL = 300.0  # seconds
 
 
 class BaseAgent(ABC):
     """Base class for all AI agents"""
     
+    # Rules per language as (fetched_at, rules), plus the fetch in flight for each
+    _rules_cache: Dict[Optional[str], Tuple[float, List[Dict[str, Any]]]] = {}
+    _rules_inflight: Dict[Optional[str], "asyncio.Task[List[Dict[str, Any]]]"] = {}
+    
+    # Collapses RAG searches from concurrent agents into batched requests
+    _rag_batcher: Optional[RagBatcher] = None
+    
+    # Recent RAG results keyed by (project_path, max_results, query digest)
+    _rag_cache: TTLCache = TTLCache(maxsize=RAG_CACHE_SIZE, ttl=RAG_CACHE_TTL)
+    
     def __init__(self, ollama_host: str, workspace_manager, mcp_client, reasoning_engine):
         self.ollama_host = ollama_host
         self.workspace_manager = workspace_manager
         self.mcp_client = mcp_client
         self.reasoning_engine = reasoning_engine
         self.model = "qwen2.5:72b"  # Default model, can be overridden
+    
+    def _get_client(self, base_url: str, timeout: float = 5.0) -> httpx.AsyncClient:
+        """Get the shared HTTP client for a downstream service"""
+        return get_client(base_url, timeout)
+    
+    @classmethod
+    async def aclose(cls):
+        """Close all shared HTTP clients"""
+        await aclose_clients()
         
     async def call_ollama(self, prompt: str, system_prompt: Optional[str] = None, 
                          model: Optional[str] = None, temperature: float = 0.7,
                          max_tokens: int = 8192) -> str:
-        """Call Ollama API"""
-        model = model or self.model
-        url = f"{self.ollama_host}/api/generate"
+        """Call Ollama API and return the full completion"""
+        payload = self._chat_payload(prompt, system_prompt, model, temperature, max_tokens)
+        
+        async def collect() -> str:
+            chunks = []
+            async for chunk in self._stream_chat(payload):
+                chunks.append(chunk)
+            return "".join(chunks)
         
-        messages = []
+        return await ollama_batcher.submit(payload, collect)
+    
+    async def call_ollama_stream(self, prompt: str, system_prompt: Optional[str] = None,
+                                 model: Optional[str] = None, temperature: float = 0.7,
+                                 max_tokens: int = 8192) -> AsyncIterator[str]:
+        """Call Ollama API and yield response text as it is generated"""
+        payload = self._chat_payload(prompt, system_prompt, model, temperature, max_tokens)
+        async with ollama_batcher.slot():
+            async for chunk in self._stream_chat(payload):
+                yield chunk
+    
+    def _chat_payload(self, prompt: str, system_prompt: Optional[str], model: Optional[str],
+                      temperature: float, max_tokens: int) -> OllamaChatRequest:
+        """Build an Ollama /api/chat request body"""
+        messages: List[ChatMessage] = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": prompt})
         
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "system": system_prompt,
-            "stream": False,
+        return {
+            "model": model or self.model,
+            "messages": messages,
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
             "options": {
                 "temperature": temperature,
-                "num_predict": max_tokens
+                "num_predict": max_tokens,
+                "num_ctx": OLLAMA_NUM_CTX
             }
         }
-        
+    
+    async def _stream_chat(self, payload: OllamaChatRequest) -> AsyncIterator[str]:
+        """Post a chat request to Ollama and yield the streamed message content"""
         try:
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                response = await client.post(url, json=payload)
+            client = self._get_client(self.ollama_host, timeout=300.0)
+            async with client.stream("POST", "/api/chat", content=orjson.dumps(payload),
+                                     headers=JSON_HEADERS) as response:
                 response.raise_for_status()
-                result = response.json()
-                return result.get("response", "")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    result: OllamaChatChunk = orjson.loads(line)
+                    content = result.get("message", {}).get("content")
+                    if content:
+                        yield content
+                    if result.get("done"):
+                        break
         except Exception as e:
-            logger.error("Ollama API call failed", error=str(e), model=model)
+            logger.error("Ollama API call failed", extra={"error": str(e), "model": payload["model"]})
             raise
     
     async def get_rules(self, language: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get coding rules from rules engine"""
+        """Get coding rules from rules engine, cached per language for RULES_CACHE_TTL"""
+        cached = BaseAgent._rules_cache.get(language)
+        if cached and time.monotonic() - cached[0] < RULES_CACHE_TTL:
+            return cached[1]
+        
+        # Coalesce concurrent misses so a cold burst makes a single request
+        task = BaseAgent._rules_inflight.get(language)
+        if task is None:
+            task = asyncio.create_task(self._fetch_rules(language))
+            BaseAgent._rules_inflight[language] = task
+            task.add_done_callback(lambda _: BaseAgent._rules_inflight.pop(language, None))
+        return await asyncio.shield(task)
+    
+    async def _fetch_rules(self, language: Optional[str]) -> List[Dict[str, Any]]:
+        """Fetch rules from rules engine and populate the cache on success"""
         try:
-            rules_engine_url = "http://rules-engine:8001"
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{rules_engine_url}/rules",
-                    params={"language": language} if language else {}
-                )
-                response.raise_for_status()
-                return response.json().get("rules", [])
+            client = self._get_client(RULES_ENGINE_URL)
+            response = await client.get(
+                "/rules",
+                params={"language": language} if language else {}
+            )
+            response.raise_for_status()
+            rules = orjson.loads(response.content).get("rules", [])
         except Exception as e:
-            logger.warning("Failed to fetch rules", error=str(e))
+            logger.warning("Failed to fetch rules", extra={"error": str(e)})
             return []
+        
+        BaseAgent._rules_cache[language] = (time.monotonic(), rules)
+        return rules
     
     async def get_codebase_context(self, query: str, project_path: Optional[str] = None,
-                                  max_results: int = 5) -> List[Dict[str, Any]]:
+                                  max_results: int = 5,
+                                  bypass_cache: bool = False) -> List[Dict[str, Any]]:
         """Get relevant code context from Qdrant using RAG"""
+        key = (
+            project_path or "",
+            max_results,
+            hashlib.blake2b(query.encode(), digest_size=16).digest()
+        )
+        if not bypass_cache:
+            cached = BaseAgent._rag_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        if BaseAgent._rag_batcher is None:
+            BaseAgent._rag_batcher = RagBatcher(lambda: self._get_client(RAG_CHAT_URL))
+        
         try:
-            rag_chat_url = "http://rag-chat:8003"
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{rag_chat_url}/search",
-                    params={
-                        "query": query,
-                        "project_path": project_path,
-                        "limit": max_results
-                    }
-                )
-                response.raise_for_status()
-                result = response.json()
-                return result.get("results", [])
+            results = await BaseAgent._rag_batcher.search(query, project_path, max_results)
         except Exception as e:
-            logger.warning("Failed to get codebase context", error=str(e))
+            logger.warning("Failed to get codebase context", extra={"error": str(e)})
             return []
+        
+        BaseAgent._rag_cache[key] = results
+        return results
     
     @abstractmethod
     async def execute_task(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
@@ -1,13 +1,75 @@
 """
 Code Generator Agent - Generates code from natural language descriptions
 """
-from typing import Dict, Any, List, Optional
-import structlog
-import json
+import asyncio
+import io
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import logging
+import orjson
+import re
 
 from agents.base_agent import BaseAgent
 
-logger = structlog.get_logger()
+logger = logging.getLogger(__name__)
+
+CONTEXT_BUDGET = 16384  # max characters of context embedded in the prompt
+_CHUNK_HEADER = "\n--- {file_path} (lines {start_line}-{end_line}) ---\n"
+
+# Prompts must clear both bars before the extra reasoning call is made
+COMPLEX_TASK_MIN_LENGTH = 200
+COMPLEX_TASK_MIN_KEYWORDS = 2
+
+_TOKEN_RE = re.compile(r"[a-z]+")
+_COMPLEX_KEYWORDS = frozenset({"system", "architecture", "design", "framework", "multiple", "complex"})
+
+# Captures the fence tag and body of every fenced code block in one pass
+_ANY_CODE_BLOCK_RE = re.compile(r"```([\w+#-]*)[^\S\n]*\n(.*?)```", re.DOTALL)
+_OPEN_FENCE_RE = re.compile(r"```[\w+#-]*[^\S\n]*\n")
+
+_EXPLANATION_RE = re.compile(r"(?:explanation|note|description):", re.IGNORECASE)
+
+_SYSTEM_PROMPT_TEMPLATE = """You are an expert {language} developer. Generate clean, efficient, well-documented code.
+Follow best practices and coding standards for {language}.
+Always include:
+- Proper error handling
+- Type hints/annotations where applicable
+- Docstrings/comments
+- Tests if appropriate
+
+Coding Rules:
+{rules}
+"""
+
+_CODE_PROMPT_TEMPLATE = """Generate {language} code based on this description:
+
+{prompt}
+
+{context}
+
+Provide the complete code implementation. Include all necessary imports and dependencies.
+If tests are needed, include them as well.
+"""
+
+
+def _tokenize(text: str) -> frozenset:
+    """Lowercased alphabetic words of text"""
+    return frozenset(_TOKEN_RE.findall(text.lower()))
+
+
+@lru_cache(maxsize=64)
+def _format_rules_cached(rules: Tuple[Tuple[str, str, str], ...]) -> str:
+    """Format (name, description, examples) rule tuples for prompt"""
+    if not rules:
+        return "No specific rules defined."
+    
+    formatted = []
+    for name, description, examples in rules:
+        formatted.append(f"- {name}: {description}")
+        if examples:
+            formatted.append(f"  Examples: {examples}")
+    
+    return "\n".join(formatted)
 
 
 class CodeGeneratorAgent(BaseAgent):
@@ -25,18 +87,26 @@ class CodeGeneratorAgent(BaseAgent):
             context: Additional context (files, repository info, etc.)
             output_path: Where to save the generated code
         """
-        logger.info("Generating code", prompt=prompt[:100], language=language)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Generating code", extra={"prompt": prompt[:100], "language": language})
         
-        # Get coding rules for the language
-        rules = await self.get_rules(language)
-        
-        # Get relevant codebase context from Qdrant
+        # Get coding rules and relevant codebase context (Qdrant) concurrently
         project_path = context.get("project_path") if context else None
-        codebase_context = await self.get_codebase_context(
-            query=prompt,
-            project_path=project_path,
-            max_results=5
+        rules, codebase_context = await asyncio.gather(
+            self.get_rules(language),
+            self.get_codebase_context(
+                query=prompt,
+                project_path=project_path,
+                max_results=5
+            ),
+            return_exceptions=True
         )
+        if isinstance(rules, BaseException):
+            logger.warning("Failed to fetch rules", extra={"error": str(rules)})
+            rules = []
+        if isinstance(codebase_context, BaseException):
+            logger.warning("Failed to get codebase context", extra={"error": str(codebase_context)})
+            codebase_context = []
         
         # Add codebase context to context dict
         if codebase_context and context:
@@ -54,30 +124,18 @@ class CodeGeneratorAgent(BaseAgent):
                 context={"language": language, "rules": rules},
                 reasoning_type="tree_of_thought"
             )
-            prompt = f"{prompt}\n\nReasoning: {json.dumps(reasoning_result, indent=2)}"
+            prompt = f"{prompt}\n\nReasoning: {orjson.dumps(reasoning_result).decode()}"
         
         # Generate code
-        system_prompt = f"""You are an expert {language} developer. Generate clean, efficient, well-documented code.
-Follow best practices and coding standards for {language}.
-Always include:
-- Proper error handling
-- Type hints/annotations where applicable
-- Docstrings/comments
-- Tests if appropriate
-
-Coding Rules:
-{self._format_rules(rules)}
-"""
-        
-        code_prompt = f"""Generate {language} code based on this description:
-
-{prompt}
-
-{context_str}
-
-Provide the complete code implementation. Include all necessary imports and dependencies.
-If tests are needed, include them as well.
-"""
+        system_prompt = _SYSTEM_PROMPT_TEMPLATE.format_map({
+            "language": language,
+            "rules": self._format_rules(rules)
+        })
+        code_prompt = _CODE_PROMPT_TEMPLATE.format_map({
+            "language": language,
+            "prompt": prompt,
+            "context": context_str
+        })
         
         response = await self.call_ollama(
             prompt=code_prompt,
@@ -89,15 +147,10 @@ If tests are needed, include them as well.
         # Extract code from response
         code = self._extract_code(response, language)
         
-        # Save to file if path provided
-        file_path = output_path
-        if file_path:
-            await self.workspace_manager.write_file(file_path, code)
-            logger.info("Code saved", file_path=file_path)
-        else:
-            # Generate default path
-            file_path = await self._generate_file_path(language, prompt)
-            await self.workspace_manager.write_file(file_path, code)
+        # Save to the requested path, or a generated default one
+        file_path = output_path or await self._generate_file_path(language, prompt)
+        if await self.workspace_manager.write_file(file_path, code):
+            logger.info("Code saved", extra={"file_path": file_path})
         
         return {
             "code": code,
@@ -113,79 +166,79 @@ If tests are needed, include them as well.
         return await self.generate(task, language, context, output_path)
     
     def _build_context_string(self, context: Optional[Dict[str, Any]], 
-                             rules: List[Dict[str, Any]]) -> str:
-        """Build context string from context dict"""
+                             rules: List[Dict[str, Any]],
+                             budget: int = CONTEXT_BUDGET) -> str:
+        """Build context string from context dict, capped at budget characters"""
         if not context:
             return ""
         
-        parts = []
+        buf = io.StringIO()
+        for part in self._context_parts(context):
+            remaining = budget - buf.tell()
+            if buf.tell():
+                buf.write("\n")
+                remaining -= 1
+            if remaining <= 0:
+                break
+            buf.write(part[:remaining])
         
+        return buf.getvalue()
+    
+    def _context_parts(self, context: Dict[str, Any]) -> Iterator[str]:
+        """Lazily yield context sections so nothing past the budget is formatted"""
         # Add codebase context from Qdrant (RAG)
         if "codebase" in context:
-            parts.append("Relevant code from codebase:")
+            yield "Relevant code from codebase:"
             for code_chunk in context["codebase"][:5]:  # Limit to 5 chunks
-                file_path = code_chunk.get("file_path", "unknown")
-                content = code_chunk.get("content", "")
-                start_line = code_chunk.get("start_line", 0)
-                end_line = code_chunk.get("end_line", 0)
-                parts.append(f"\n--- {file_path} (lines {start_line}-{end_line}) ---\n{content[:1500]}")
+                yield _CHUNK_HEADER.format_map({
+                    "file_path": code_chunk.get("file_path", "unknown"),
+                    "start_line": code_chunk.get("start_line", 0),
+                    "end_line": code_chunk.get("end_line", 0)
+                }) + code_chunk.get("content", "")[:1500]
         
         # Add file context
         if "files" in context:
-            parts.append("Relevant files:")
+            yield "Relevant files:"
             for file_path, content in context["files"].items():
-                parts.append(f"\n--- {file_path} ---\n{content[:2000]}")
+                yield f"\n--- {file_path} ---\n{content[:2000]}"
         
         # Add repository context
         if "repository" in context:
             repo_info = context["repository"]
-            parts.append(f"\nRepository: {repo_info.get('url', 'N/A')}")
+            yield f"\nRepository: {repo_info.get('url', 'N/A')}"
             if "structure" in repo_info:
-                parts.append(f"Structure: {json.dumps(repo_info['structure'], indent=2)}")
-        
-        return "\n".join(parts)
+                yield f"Structure: {orjson.dumps(repo_info['structure']).decode()}"
     
     def _format_rules(self, rules: List[Dict[str, Any]]) -> str:
         """Format rules for prompt"""
-        if not rules:
-            return "No specific rules defined."
-        
-        formatted = []
-        for rule in rules:
-            formatted.append(f"- {rule.get('name', 'Rule')}: {rule.get('description', '')}")
-            if rule.get("examples"):
-                formatted.append(f"  Examples: {rule.get('examples')}")
-        
-        return "\n".join(formatted)
+        return _format_rules_cached(tuple(
+            (rule.get("name", "Rule"), rule.get("description", ""),
+             str(rule["examples"]) if rule.get("examples") else "")
+            for rule in rules
+        ))
     
     def _is_complex_task(self, prompt: str) -> bool:
         """Determine if task is complex enough to warrant reasoning"""
-        complex_keywords = ["system", "architecture", "design", "framework", "multiple", "complex"]
-        return any(keyword in prompt.lower() for keyword in complex_keywords)
+        # A single keyword in a short prompt ("a system tray icon") is not enough
+        if len(prompt) <= COMPLEX_TASK_MIN_LENGTH:
+            return False
+        return len(_COMPLEX_KEYWORDS & _tokenize(prompt)) >= COMPLEX_TASK_MIN_KEYWORDS
     
     def _extract_code(self, response: str, language: str) -> str:
         """Extract code from LLM response"""
-        # Look for code blocks
-        code_block_markers = [
-            f"```{language}",
-            f"```{language.lower()}",
-            "```python",
-            "```javascript",
-            "```typescript",
-            "```java",
-            "```go",
-            "```rust",
-            "```cpp",
-            "```c",
-            "```"
-        ]
-        
-        for marker in code_block_markers:
-            if marker in response:
-                start_idx = response.find(marker) + len(marker)
-                end_idx = response.find("```", start_idx)
-                if end_idx != -1:
-                    return response[start_idx:end_idx].strip()
+        matches = _ANY_CODE_BLOCK_RE.findall(response)
+        if matches:
+            # Prefer a block tagged with the requested language
+            wanted = language.lower()
+            for tag, body in matches:
+                if tag.lower() == wanted:
+                    return body.strip()
+            return matches[0][1].strip()
+        
+        # Completion was cut off before the closing fence: keep the tail after it
+        opening = _OPEN_FENCE_RE.search(response)
+        if opening:
+            return response[opening.end():].strip()
         
         # If no code block, return response as-is (might be plain code)
         return response.strip()
@@ -193,12 +246,9 @@ If tests are needed, include them as well.
     def _extract_explanation(self, response: str) -> str:
         """Extract explanation from response"""
         # Look for explanation before or after code
-        explanation_markers = ["explanation:", "note:", "description:"]
-        
-        for marker in explanation_markers:
-            idx = response.lower().find(marker)
-            if idx != -1:
-                return response[idx + len(marker):].strip()[:500]
+        match = _EXPLANATION_RE.search(response)
+        if match:
+            return response[match.end():].strip()[:500]
         
         return "Code generated successfully."
     
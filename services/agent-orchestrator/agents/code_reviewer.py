@@ -1,43 +1,23 @@
 """
 Code Reviewer Agent - Reviews code for issues and improvements
 """
+import asyncio
 from typing import Dict, Any, List, Optional
-import structlog
+import logging
+import re
 
 from agents.base_agent import BaseAgent
+from agents.schemas import ReviewResult
+from agents.utils import detect_language, find_json_object
 
-logger = structlog.get_logger()
+logger = logging.getLogger(__name__)
 
+_SCORE_RE = re.compile(r'\d+')
 
-class CodeReviewerAgent(BaseAgent):
-    """Agent specialized in code review"""
-    
-    async def review(self, file_path: str, rules: Optional[List[str]] = None) -> Dict[str, Any]:
-        """
-        Review code for issues and improvements
-        
-        Args:
-            file_path: Path to file to review
-            rules: Specific rules to check (optional)
-        """
-        logger.info("Reviewing code", file_path=file_path)
-        
-        # Read the file
-        code = await self.workspace_manager.read_file(file_path)
-        if not code:
-            raise ValueError(f"File not found: {file_path}")
-        
-        # Get language from file extension
-        language = self._detect_language(file_path)
-        
-        # Get applicable rules
-        all_rules = await self.get_rules(language)
-        applicable_rules = all_rules
-        if rules:
-            applicable_rules = [r for r in all_rules if r.get("name") in rules]
-        
-        # Perform review
-        system_prompt = f"""You are an expert code reviewer specializing in {language}.
+# Reviews run at once by review_many; matches Ollama's parallel request capacity
+REVIEW_CONCURRENCY = 4
+
+_SYSTEM_PROMPT_TEMPLATE = """You are an expert code reviewer specializing in {language}.
 Review code for:
 - Bugs and errors
 - Security vulnerabilities
@@ -49,17 +29,15 @@ Review code for:
 
 Be thorough but constructive. Provide specific, actionable feedback.
 """
-        
-        rules_text = self._format_rules(applicable_rules)
-        
-        review_prompt = f"""Review this {language} code:
+
+_REVIEW_PROMPT_TEMPLATE = """Review this {language} code:
 
 ```{language}
 {code}
 ```
 
 Coding Rules to Check:
-{rules_text}
+{rules}
 
 Provide a comprehensive review with:
 1. Critical issues (bugs, security)
@@ -73,6 +51,43 @@ Format as JSON with:
 - suggestions: array of improvement suggestions
 - score: overall code quality score (0-100)
 """
+
+
+class CodeReviewerAgent(BaseAgent):
+    """Agent specialized in code review"""
+    
+    async def review(self, file_path: str, rules: Optional[List[str]] = None) -> ReviewResult:
+        """
+        Review code for issues and improvements
+        
+        Args:
+            file_path: Path to file to review
+            rules: Specific rules to check (optional)
+        """
+        logger.info("Reviewing code", extra={"file_path": file_path})
+        
+        # Get language from file extension
+        language = self._detect_language(file_path)
+        
+        # Read the file while the applicable rules are fetched
+        code, all_rules = await asyncio.gather(
+            self.workspace_manager.read_file(file_path),
+            self.get_rules(language)
+        )
+        if not code:
+            raise ValueError(f"File not found: {file_path}")
+        
+        applicable_rules = all_rules
+        if rules:
+            applicable_rules = [r for r in all_rules if r.get("name") in rules]
+        
+        # Perform review
+        system_prompt = _SYSTEM_PROMPT_TEMPLATE.format_map({"language": language})
+        review_prompt = _REVIEW_PROMPT_TEMPLATE.format_map({
+            "language": language,
+            "code": code,
+            "rules": self._format_rules(applicable_rules)
+        })
         
         response = await self.call_ollama(
             prompt=review_prompt,
@@ -86,32 +101,49 @@ Format as JSON with:
         
         return review_result
     
+    async def review_many(self, file_paths: List[str], rules: Optional[List[str]] = None,
+                          concurrency: int = REVIEW_CONCURRENCY) -> List[Dict[str, Any]]:
+        """
+        Review several files concurrently
+        
+        Args:
+            file_paths: Paths to files to review
+            rules: Specific rules to check (optional)
+            concurrency: Maximum number of reviews in flight at once
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _review_one(file_path: str) -> ReviewResult:
+            async with semaphore:
+                return await self.review(file_path, rules)
+        
+        results = await asyncio.gather(
+            *(_review_one(file_path) for file_path in file_paths),
+            return_exceptions=True
+        )
+        
+        reviews = []
+        for file_path, result in zip(file_paths, results):
+            if isinstance(result, BaseException):
+                logger.warning("Review failed", extra={"file_path": file_path, "error": str(result)})
+                reviews.append({"file_path": file_path, "error": str(result)})
+            else:
+                reviews.append({"file_path": file_path, **result})
+        return reviews
+    
     async def execute_task(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a review task"""
-        file_path = context.get("file_path") or task
         rules = context.get("rules")
+        file_paths = context.get("file_paths")
+        if isinstance(file_paths, list):
+            return {"reviews": await self.review_many(file_paths, rules)}
+        
+        file_path = context.get("file_path") or task
         return await self.review(file_path, rules)
     
     def _detect_language(self, file_path: str) -> str:
         """Detect programming language from file extension"""
-        ext_to_lang = {
-            ".py": "python",
-            ".js": "javascript",
-            ".ts": "typescript",
-            ".java": "java",
-            ".go": "go",
-            ".rs": "rust",
-            ".cpp": "cpp",
-            ".c": "c",
-            ".rb": "ruby",
-            ".php": "php"
-        }
-        
-        for ext, lang in ext_to_lang.items():
-            if file_path.endswith(ext):
-                return lang
-        
-        return "python"  # Default
+        return detect_language(file_path)
     
     def _format_rules(self, rules: List[Dict[str, Any]]) -> str:
         """Format rules for prompt"""
@@ -120,18 +152,12 @@ Format as JSON with:
         
         return "\n".join([f"- {r.get('name')}: {r.get('description', '')}" for r in rules])
     
-    def _parse_review(self, response: str) -> Dict[str, Any]:
+    def _parse_review(self, response: str) -> ReviewResult:
         """Parse review response from LLM"""
-        import json
-        import re
-        
         # Try to extract JSON
-        json_match = re.search(r'\{.*\}', response, re.DOTALL)
-        if json_match:
-            try:
-                return json.loads(json_match.group())
-            except:
-                pass
+        result = find_json_object(response, ("issues", "suggestions"))
+        if result is not None:
+            return result
         
         # Fallback: parse structured text
         issues = []
@@ -151,7 +177,7 @@ Format as JSON with:
             elif "suggestion" in line.lower() or "improve" in line.lower():
                 suggestions.append({"description": line})
             elif "score" in line.lower():
-                score_match = re.search(r'\d+', line)
+                score_match = _SCORE_RE.search(line)
                 if score_match:
                     score = int(score_match.group())
         
@@ -1,51 +1,29 @@
 """
 Debugger Agent - Debugs code issues
 """
+import asyncio
+from functools import lru_cache
 from typing import Dict, Any, List, Optional
-import structlog
-import json
+import logging
+import orjson
 import re
 
 from agents.base_agent import BaseAgent
+from agents.schemas import DebugResult
+from agents.utils import detect_language, find_json_object
 
-logger = structlog.get_logger()
+logger = logging.getLogger(__name__)
 
+_CODE_BLOCK_RE = re.compile(r'```(?:\w+)?\n(.*?)```', re.DOTALL)
 
-class DebuggerAgent(BaseAgent):
-    """Agent specialized in debugging"""
-    
-    async def debug(self, file_path: str, error_message: Optional[str] = None,
-                   test_cases: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
-        """
-        Debug code issues
-        
-        Args:
-            file_path: Path to file with bug
-            error_message: Error message or description
-            test_cases: Failing test cases
-        """
-        logger.info("Debugging code", file_path=file_path, error=error_message)
-        
-        # Read the file
-        code = await self.workspace_manager.read_file(file_path)
-        if not code:
-            raise ValueError(f"File not found: {file_path}")
-        
-        # Use reasoning engine to analyze the problem
-        problem_description = error_message or "Code is not working as expected"
-        reasoning_result = await self.reasoning_engine.reason(
-            f"Debug this code issue: {problem_description}",
-            context={
-                "code": code[:2000],  # Limit context size
-                "test_cases": test_cases or []
-            },
-            reasoning_type="iterative"
-        )
-        
-        # Generate debug analysis
-        language = self._detect_language(file_path)
-        
-        system_prompt = f"""You are an expert debugger specializing in {language}.
+
+@lru_cache(maxsize=32)
+def _section_re(section: str) -> "re.Pattern[str]":
+    """Compiled pattern matching the body of a named response section"""
+    return re.compile(f"{re.escape(section)}[:\\s]+(.*?)(?=\\n\\n|$)", re.IGNORECASE | re.DOTALL)
+
+
+_SYSTEM_PROMPT_TEMPLATE = """You are an expert debugger specializing in {language}.
 Analyze code systematically:
 1. Understand the problem
 2. Identify root cause
@@ -53,21 +31,24 @@ Analyze code systematically:
 4. Verify the fix
 
 Be thorough and methodical.
+
+Coding Rules:
+{rules}
 """
-        
-        debug_prompt = f"""Debug this {language} code:
+
+_DEBUG_PROMPT_TEMPLATE = """Debug this {language} code:
 
 ```{language}
 {code}
 ```
 
-Problem: {problem_description}
+Problem: {problem}
 
 Reasoning Analysis:
-{json.dumps(reasoning_result, indent=2)}
+{reasoning}
 
-{"Test Cases:" if test_cases else ""}
-{json.dumps(test_cases, indent=2) if test_cases else ""}
+{test_cases_header}
+{test_cases}
 
 Provide:
 1. Root cause analysis
@@ -81,6 +62,67 @@ Format as JSON with:
 - fixed_code: complete fixed code
 - explanation: detailed explanation
 """
+
+
+class DebuggerAgent(BaseAgent):
+    """Agent specialized in debugging"""
+    
+    async def debug(self, file_path: str, error_message: Optional[str] = None,
+                   test_cases: Optional[List[Dict[str, Any]]] = None) -> DebugResult:
+        """
+        Debug code issues
+        
+        Args:
+            file_path: Path to file with bug
+            error_message: Error message or description
+            test_cases: Failing test cases
+        """
+        logger.info("Debugging code", extra={"file_path": file_path, "error": error_message})
+        
+        language = self._detect_language(file_path)
+        
+        # Fetch the rules while the file is read and reasoned about
+        rules_task = asyncio.create_task(self.get_rules(language))
+        
+        # Read the file
+        code = await self.workspace_manager.read_file(file_path)
+        if not code:
+            rules_task.cancel()
+            raise ValueError(f"File not found: {file_path}")
+        
+        # Use reasoning engine to analyze the problem
+        problem_description = error_message or "Code is not working as expected"
+        reasoning_task = asyncio.create_task(self.reasoning_engine.reason(
+            f"Debug this code issue: {problem_description}",
+            context={
+                "code": code[:2000],  # Limit context size
+                "test_cases": test_cases or []
+            },
+            reasoning_type="iterative"
+        ))
+        
+        # Prepare everything that doesn't depend on the reasoning while it runs
+        try:
+            rules = await rules_task
+            system_prompt = _SYSTEM_PROMPT_TEMPLATE.format_map({
+                "language": language,
+                "rules": self._format_rules(rules)
+            })
+            prompt_fields = {
+                "language": language,
+                "code": code,
+                "problem": problem_description,
+                "test_cases_header": "Test Cases:" if test_cases else "",
+                "test_cases": orjson.dumps(test_cases).decode() if test_cases else ""
+            }
+        except BaseException:
+            reasoning_task.cancel()
+            raise
+        
+        # Generate debug analysis
+        reasoning_result = await reasoning_task
+        prompt_fields["reasoning"] = orjson.dumps(reasoning_result).decode()
+        debug_prompt = _DEBUG_PROMPT_TEMPLATE.format_map(prompt_fields)
         
         response = await self.call_ollama(
             prompt=debug_prompt,
@@ -96,7 +138,7 @@ Format as JSON with:
         if debug_result.get("fixed_code"):
             fixed_code = debug_result["fixed_code"]
             await self.workspace_manager.write_file(file_path, fixed_code)
-            logger.info("Fixed code saved", file_path=file_path)
+            logger.info("Fixed code saved", extra={"file_path": file_path})
         
         return debug_result
     
@@ -109,38 +151,24 @@ Format as JSON with:
     
     def _detect_language(self, file_path: str) -> str:
         """Detect programming language from file extension"""
-        ext_to_lang = {
-            ".py": "python",
-            ".js": "javascript",
-            ".ts": "typescript",
-            ".java": "java",
-            ".go": "go",
-            ".rs": "rust",
-            ".cpp": "cpp",
-            ".c": "c"
-        }
-        
-        for ext, lang in ext_to_lang.items():
-            if file_path.endswith(ext):
-                return lang
+        return detect_language(file_path)
+    
+    def _format_rules(self, rules: List[Dict[str, Any]]) -> str:
+        """Format rules for prompt"""
+        if not rules:
+            return "No specific rules defined."
         
-        return "python"
+        return "\n".join([f"- {r.get('name')}: {r.get('description', '')}" for r in rules])
     
-    def _parse_debug_response(self, response: str, original_code: str) -> Dict[str, Any]:
+    def _parse_debug_response(self, response: str, original_code: str) -> DebugResult:
         """Parse debug response from LLM"""
-        import re
-        
         # Try to extract JSON
-        json_match = re.search(r'\{.*\}', response, re.DOTALL)
-        if json_match:
-            try:
-                result = json.loads(json_match.group())
-                # Ensure fixed_code is present
-                if not result.get("fixed_code"):
-                    result["fixed_code"] = self._extract_code(response)
-                return result
-            except:
-                pass
+        result = find_json_object(response, ("fixes", "explanation"))
+        if result is not None:
+            # Ensure fixed_code is present
+            if not result.get("fixed_code"):
+                result["fixed_code"] = self._extract_code(response)
+            return result
         
         # Fallback: extract code and create structured response
         fixed_code = self._extract_code(response) or original_code
@@ -154,14 +182,13 @@ Format as JSON with:
     
     def _extract_code(self, response: str) -> str:
         """Extract code from response"""
-        code_blocks = re.findall(r'```(?:\w+)?\n(.*?)```', response, re.DOTALL)
+        code_blocks = _CODE_BLOCK_RE.findall(response)
         if code_blocks:
             return code_blocks[-1].strip()
         return ""
     
     def _extract_section(self, response: str, section: str) -> str:
         """Extract a section from response"""
-        pattern = f"{section}[:\\s]+(.*?)(?=\\n\\n|$)"
-        match = re.search(pattern, response, re.IGNORECASE | re.DOTALL)
+        match = _section_re(section).search(response)
         return match.group(1).strip() if match else ""
 
@@ -0,0 +1,33 @@
+"""
+HTTP Clients - Process-wide pooled httpx clients, one per downstream host
+"""
+from typing import Dict
+
+import httpx
+
+# Shared by every agent and the reasoning engine so each host keeps one pool
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(base_url: str, timeout: float = 5.0) -> httpx.AsyncClient:
+    """Get the shared HTTP client for a downstream service, creating it on first use"""
+    client = _clients.get(base_url)
+    if client is None or client.is_closed:
+        # HTTP/2 multiplexes concurrent requests over one connection where the
+        # server negotiates it; plain-http hosts keep using HTTP/1.1 keep-alive
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            http2=True,
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=32)
+        )
+        _clients[base_url] = client
+    return client
+
+
+async def aclose_clients():
+    """Close all shared HTTP clients"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
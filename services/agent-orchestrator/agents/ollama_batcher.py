@@ -0,0 +1,59 @@
+"""
+Ollama Batcher - Shapes concurrent generations to what Ollama can batch
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Mapping
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Requests Ollama decodes together in one batch (its OLLAMA_NUM_PARALLEL);
+# anything beyond this waits here instead of queueing against the HTTP timeout
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+
+class OllamaBatcher:
+    """
+    Admission control and request coalescing for Ollama generations
+
+    Ollama has no multi-prompt generate endpoint; it batches the requests that
+    are in flight at the same time. ``submit`` therefore keeps at most
+    ``max_parallel`` generations running, so each one lands in a free batch
+    slot, and identical concurrent payloads share a single generation.
+    """
+
+    def __init__(self, max_parallel: int = OLLAMA_NUM_PARALLEL):
+        self._semaphore = asyncio.Semaphore(max_parallel)
+        self._inflight: Dict[bytes, "asyncio.Task[str]"] = {}
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one of Ollama's parallel slots, e.g. for the length of a stream"""
+        async with self._semaphore:
+            yield
+
+    async def submit(self, payload: Mapping[str, Any], run: Callable[[], Awaitable[str]]) -> str:
+        """Run ``run`` in a free slot, sharing the result with identical concurrent payloads"""
+        key = hashlib.blake2b(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(run))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.debug("Coalesced identical Ollama request")
+        # Shield so one cancelled caller doesn't cancel the generation for the others
+        return await asyncio.shield(task)
+
+    async def _run(self, run: Callable[[], Awaitable[str]]) -> str:
+        async with self._semaphore:
+            return await run()
+
+
+# One batcher per process, shared by every agent and the reasoning engine
+ollama_batcher = OllamaBatcher()
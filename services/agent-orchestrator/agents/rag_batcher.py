@@ -0,0 +1,85 @@
+"""
+RAG Batcher - Collapses concurrent codebase searches into one rag-chat request
+"""
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import httpx
+import orjson
+
+from agents.utils import JSON_HEADERS
+
+logger = logging.getLogger(__name__)
+
+BATCH_WINDOW = 0.005  # seconds to wait for more queries before flushing
+
+
+class RagBatcher:
+    """Micro-batches /search calls issued within the same short window"""
+
+    def __init__(self, get_client: Callable[[], httpx.AsyncClient], window: float = BATCH_WINDOW):
+        self._get_client = get_client
+        self._window = window
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._batch_supported = True
+
+    async def search(self, query: str, project_path: Optional[str] = None,
+                     limit: int = 5) -> List[Dict[str, Any]]:
+        """Queue a search and wait for its share of the batched response"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(({"query": query, "project_path": project_path, "limit": limit}, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+        return await future
+
+    async def _flush_after_window(self):
+        """Send everything queued during the window and resolve the waiters"""
+        await asyncio.sleep(self._window)
+        pending, self._pending = self._pending, []
+        self._flush_task = None
+
+        try:
+            results = await self._send([query for query, _ in pending])
+        except Exception as e:
+            results = [e] * len(pending)
+
+        for (_, future), result in zip(pending, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _send(self, queries: List[Dict[str, Any]]) -> List[Union[List[Dict[str, Any]], BaseException]]:
+        """Search all queries, in one /search_batch call when rag-chat supports it"""
+        client = self._get_client()
+
+        if self._batch_supported and len(queries) > 1:
+            response = await client.post(
+                "/search_batch",
+                content=orjson.dumps({"queries": queries}),
+                headers=JSON_HEADERS
+            )
+            if response.status_code == 404:
+                logger.info("rag-chat has no /search_batch, falling back to single searches")
+                self._batch_supported = False
+            else:
+                response.raise_for_status()
+                results = orjson.loads(response.content).get("results", [])
+                if len(results) != len(queries):
+                    raise ValueError("search_batch returned a mismatched number of results")
+                return results
+
+        return await asyncio.gather(
+            *(self._search_one(client, query) for query in queries),
+            return_exceptions=True
+        )
+
+    async def _search_one(self, client: httpx.AsyncClient, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Search a single query via /search"""
+        response = await client.post("/search", content=orjson.dumps(query), headers=JSON_HEADERS)
+        response.raise_for_status()
+        return orjson.loads(response.content).get("results", [])
@@ -1,12 +1,44 @@
 """
 Reasoning Engine - Advanced reasoning capabilities for agents
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import hashlib
 import httpx
-import structlog
-import json
+import logging
+import orjson
+import re
 
-logger = structlog.get_logger()
+from cachetools import LRUCache
+
+from agents.base_agent import OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX
+from agents.http_clients import get_client
+from agents.ollama_batcher import ollama_batcher
+from agents.utils import JsonObjectScanner
+
+logger = logging.getLogger(__name__)
+
+ITERATIONS = 3  # refinement rounds produced by iterative reasoning
+TOT_BRANCHES = 3  # solution approaches explored by tree-of-thought
+TOT_CONCURRENCY = 3  # branches evaluated at once
+REASON_CACHE_SIZE = 256  # memoized reason() results
+
+# Rough prompt-size estimate used to fit num_predict into the context window
+CHARS_PER_TOKEN = 4
+MIN_NUM_PREDICT = 256
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+_CONCLUSION_RE = re.compile(r"\b(?:conclusion|solution|answer|result)\s*:", re.IGNORECASE)
+
+_COT_SYSTEM_PROMPT = """You are an advanced reasoning system. Break down problems step by step.
+Think through each step carefully before proceeding to the next.
+Provide clear reasoning at each step."""
+
+_TOT_SYSTEM_PROMPT = """You are an advanced reasoning system using tree-of-thought.
+Explore multiple solution paths, evaluate each, and select the best approach."""
+
+_ITERATIVE_SYSTEM_PROMPT = """You are an advanced reasoning system using iterative refinement.
+Start with an initial solution, identify issues, and iteratively improve."""
 
 
 class ReasoningEngine:
@@ -15,6 +47,65 @@ class ReasoningEngine:
     def __init__(self, ollama_host: str):
         self.ollama_host = ollama_host
         self.model = "qwen2.5:72b"
+        self._reason_cache: LRUCache = LRUCache(maxsize=REASON_CACHE_SIZE)
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the Ollama client, shared with the agents' pool for the same host"""
+        return get_client(self.ollama_host, timeout=300.0)
+    
+    async def _call_ollama(self, prompt: str, system_prompt: str,
+                           temperature: float, num_predict: int,
+                           json_keys: Optional[Tuple[str, ...]] = None) -> str:
+        """
+        Stream one Ollama generation and return the response text
+        
+        When json_keys is set, the stream is abandoned as soon as a complete
+        JSON object holding those keys has arrived and only that object is
+        returned; braces in the reasoning prose before it are passed over.
+        num_predict is an upper bound; it is lowered to whatever the prompt
+        leaves free in the context window.
+        """
+        prompt_tokens = (len(prompt) + len(system_prompt)) // CHARS_PER_TOKEN
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "system": system_prompt,
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max(MIN_NUM_PREDICT, min(num_predict, OLLAMA_NUM_CTX - prompt_tokens)),
+                "num_ctx": OLLAMA_NUM_CTX
+            }
+        }
+        
+        return await ollama_batcher.submit(payload, lambda: self._stream_generate(payload, json_keys))
+    
+    async def _stream_generate(self, payload: Dict[str, Any],
+                               json_keys: Optional[Tuple[str, ...]]) -> str:
+        """Read a streamed /api/generate response, stopping early on complete JSON"""
+        parts: List[str] = []
+        scanner = JsonObjectScanner(json_keys) if json_keys is not None else None
+        async with self._get_client().stream("POST", "/api/generate", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                text = chunk.get("response", "")
+                if text:
+                    parts.append(text)
+                    if scanner is not None:
+                        obj = scanner.feed(text)
+                        if obj is not None:
+                            return orjson.dumps(obj).decode()
+                if chunk.get("done"):
+                    break
+        
+        # An object left inside a brace that never closed still beats the prose
+        if scanner is not None and scanner.candidate is not None:
+            return orjson.dumps(scanner.candidate).decode()
+        return "".join(parts)
     
     async def reason(self, problem: str, context: Optional[Dict[str, Any]] = None,
                     reasoning_type: str = "chain_of_thought") -> Dict[str, Any]:
@@ -26,22 +117,35 @@ class ReasoningEngine:
             context: Additional context
             reasoning_type: Type of reasoning (chain_of_thought, tree_of_thought, iterative)
         """
+        # Serialized once, compactly and with sorted keys so it doubles as a
+        # canonical cache key; every prompt built below embeds the same string
+        context_json = orjson.dumps(context or {}, option=orjson.OPT_SORT_KEYS).decode()
+        
+        key = hashlib.blake2b(
+            f"{reasoning_type}\0{problem}\0{context_json}".encode(), digest_size=16
+        ).digest()
+        cached = self._reason_cache.get(key)
+        if cached is not None:
+            return cached
+        
         if reasoning_type == "chain_of_thought":
-            return await self._chain_of_thought(problem, context)
+            result, complete = await self._chain_of_thought(problem, context_json)
         elif reasoning_type == "tree_of_thought":
-            return await self._tree_of_thought(problem, context)
+            result, complete = await self._tree_of_thought(problem, context_json)
         else:
-            return await self._iterative_reasoning(problem, context)
-    
-    async def _chain_of_thought(self, problem: str, context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
-        """Chain of Thought reasoning"""
-        system_prompt = """You are an advanced reasoning system. Break down problems step by step.
-Think through each step carefully before proceeding to the next.
-Provide clear reasoning at each step."""
+            result, complete = await self._iterative_reasoning(problem, context_json)
         
+        # A text fallback came from one sampled answer that missed the format;
+        # asking again may well do better, so only structured results are kept
+        if complete:
+            self._reason_cache[key] = result
+        return result
+    
+    async def _chain_of_thought(self, problem: str, context_json: str) -> Tuple[Dict[str, Any], bool]:
+        """Chain of Thought reasoning; also whether the answer had the requested structure"""
         prompt = f"""Problem: {problem}
 
-Context: {json.dumps(context or {}, indent=2)}
+Context: {context_json}
 
 Please solve this problem using chain-of-thought reasoning:
 1. Break down the problem into steps
@@ -56,162 +160,158 @@ Format your response as JSON with:
 - confidence: confidence level (0-1)
 """
         
-        url = f"{self.ollama_host}/api/generate"
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "system": system_prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.3,
-                "num_predict": 4096
-            }
-        }
+        response_text = await self._call_ollama(prompt, _COT_SYSTEM_PROMPT, temperature=0.3,
+                                                num_predict=4096, json_keys=("steps", "conclusion"))
         
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            response_text = result.get("response", "")
-            
-            # Try to parse JSON from response
-            try:
-                # Extract JSON from markdown code blocks if present
-                if "```json" in response_text:
-                    json_start = response_text.find("```json") + 7
-                    json_end = response_text.find("```", json_start)
-                    response_text = response_text[json_start:json_end].strip()
-                elif "```" in response_text:
-                    json_start = response_text.find("```") + 3
-                    json_end = response_text.find("```", json_start)
-                    response_text = response_text[json_start:json_end].strip()
-                
-                return json.loads(response_text)
-            except:
-                # Fallback to structured text parsing
-                return {
-                    "reasoning": response_text,
-                    "conclusion": self._extract_conclusion(response_text),
-                    "confidence": 0.7
-                }
+        result = self._parse_json(response_text)
+        if isinstance(result, dict) and isinstance(result.get("steps"), list) and "conclusion" in result:
+            return result, True
+        
+        # Fallback to structured text parsing
+        return {
+            "reasoning": response_text,
+            "conclusion": self._extract_conclusion(response_text),
+            "confidence": 0.7
+        }, False
     
-    async def _tree_of_thought(self, problem: str, context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
-        """Tree of Thought reasoning - explore multiple solution paths"""
-        system_prompt = """You are an advanced reasoning system using tree-of-thought.
-Explore multiple solution paths, evaluate each, and select the best approach."""
+    async def _tree_of_thought(self, problem: str, context_json: str) -> Tuple[Dict[str, Any], bool]:
+        """Tree of Thought reasoning - explore multiple solution paths; also whether every step parsed"""
+        # 1. Generate approach seeds with a short generation
+        seed_prompt = f"""Problem: {problem}
+
+Context: {context_json}
+
+Generate {TOT_BRANCHES} different solution approaches. Describe each in a few sentences.
+
+Format as JSON with:
+- approaches: array of approach descriptions
+"""
+        seed_text = await self._call_ollama(seed_prompt, _TOT_SYSTEM_PROMPT, temperature=0.7,
+                                            num_predict=512, json_keys=("approaches",))
+        seeds = self._parse_json(seed_text)
+        approaches = seeds.get("approaches") if isinstance(seeds, dict) else None
+        if not isinstance(approaches, list) or not approaches:
+            return {
+                "reasoning": seed_text,
+                "solution": self._extract_conclusion(seed_text)
+            }, False
+        approaches = [str(approach) for approach in approaches[:TOT_BRANCHES]]
         
-        prompt = f"""Problem: {problem}
+        # 2. Evaluate and refine every branch concurrently
+        semaphore = asyncio.Semaphore(TOT_CONCURRENCY)
+        
+        async def evaluate(approach: str) -> str:
+            eval_prompt = f"""Problem: {problem}
 
-Context: {json.dumps(context or {}, indent=2)}
+Context: {context_json}
 
-Use tree-of-thought reasoning:
-1. Generate multiple solution approaches
-2. Evaluate each approach
-3. Select the best approach
-4. Refine the selected approach
-5. Provide final solution
+Approach: {approach}
+
+Evaluate this approach (strengths, weaknesses, risks), then refine it into a concrete solution.
+"""
+            async with semaphore:
+                return await self._call_ollama(eval_prompt, _TOT_SYSTEM_PROMPT, temperature=0.7, num_predict=1024)
+        
+        evaluations = await asyncio.gather(*(evaluate(approach) for approach in approaches))
+        
+        # 3. Select the best branch
+        branches = "\n\n".join(
+            f"Approach {i + 1}: {approach}\nEvaluation: {evaluation}"
+            for i, (approach, evaluation) in enumerate(zip(approaches, evaluations))
+        )
+        select_prompt = f"""Problem: {problem}
+
+{branches}
+
+Select the best approach and provide the final solution.
 
 Format as JSON with:
-- approaches: array of different approaches considered
-- evaluations: evaluation of each approach
-- selected_approach: the chosen approach
+- selected_approach: number of the chosen approach
 - solution: final solution
 """
+        select_text = await self._call_ollama(select_prompt, _TOT_SYSTEM_PROMPT, temperature=0.3,
+                                              num_predict=1024, json_keys=("solution",))
+        selection = self._parse_json(select_text)
+        selected_parsed = isinstance(selection, dict) and "solution" in selection
+        if not selected_parsed:
+            selection = {"solution": self._extract_conclusion(select_text)}
         
-        url = f"{self.ollama_host}/api/generate"
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "system": system_prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.7,
-                "num_predict": 6144
-            }
-        }
+        # Resolve the selector's approach number back to its description
+        selected = selection.get("selected_approach")
+        if isinstance(selected, int) and 1 <= selected <= len(approaches):
+            selected = approaches[selected - 1]
         
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            response_text = result.get("response", "")
-            
-            try:
-                if "```json" in response_text:
-                    json_start = response_text.find("```json") + 7
-                    json_end = response_text.find("```", json_start)
-                    response_text = response_text[json_start:json_end].strip()
-                
-                return json.loads(response_text)
-            except:
-                return {
-                    "reasoning": response_text,
-                    "solution": self._extract_conclusion(response_text)
-                }
+        return {
+            "approaches": approaches,
+            "evaluations": evaluations,
+            "selected_approach": selected,
+            "solution": selection.get("solution", "")
+        }, selected_parsed
     
-    async def _iterative_reasoning(self, problem: str, context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
-        """Iterative reasoning - refine solution through iterations"""
-        system_prompt = """You are an advanced reasoning system using iterative refinement.
-Start with an initial solution, identify issues, and iteratively improve."""
-        
-        iterations = []
-        current_solution = None
-        
-        for i in range(3):  # 3 iterations
-            prompt = f"""Problem: {problem}
+    async def _iterative_reasoning(self, problem: str, context_json: str) -> Tuple[Dict[str, Any], bool]:
+        """Iterative reasoning - refine solution through iterations in a single generation; also whether it parsed"""
+        prompt = f"""Problem: {problem}
 
-Context: {json.dumps(context or {}, indent=2)}
+Context: {context_json}
 
-Previous iterations: {json.dumps(iterations, indent=2) if iterations else "None"}
+Solve this problem in {ITERATIONS} iterations:
+1. Analyze the problem and propose an initial solution, considering edge cases
+2. In each following iteration, identify issues with the previous solution and improve it
+3. Provide an updated solution at the end of every iteration
 
-{"Refine the solution from previous iteration" if current_solution else "Provide initial solution"}:
-1. Analyze the problem
-2. {"Identify issues with current solution" if current_solution else "Propose initial solution"}
-3. {"Improve the solution" if current_solution else "Consider edge cases"}
-4. Provide updated solution
+Format your response as JSON with:
+- iterations: array of exactly {ITERATIONS} objects, each with "reasoning" and "solution", where each entry refines the previous one
 """
-            
-            url = f"{self.ollama_host}/api/generate"
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "system": system_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.5,
-                    "num_predict": 4096
-                }
-            }
-            
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                response_text = result.get("response", "")
-                
-                iterations.append({
+        
+        response_text = await self._call_ollama(prompt, _ITERATIVE_SYSTEM_PROMPT, temperature=0.5,
+                                                num_predict=4096 * ITERATIONS, json_keys=("iterations",))
+        
+        try:
+            steps = self._parse_json(response_text)["iterations"]
+            if not isinstance(steps, list) or not steps:
+                raise TypeError("iterations is not a non-empty array")
+            iterations = [
+                {
                     "iteration": i + 1,
-                    "reasoning": response_text
-                })
-                current_solution = self._extract_conclusion(response_text)
+                    "reasoning": step.get("reasoning", ""),
+                    "solution": step.get("solution", "")
+                }
+                for i, step in enumerate(steps)
+            ]
+            current_solution = iterations[-1]["solution"]
+            complete = True
+        except (TypeError, KeyError, AttributeError):
+            # Model ignored the format - keep the whole answer as a single iteration
+            logger.debug("Iterative reasoning response was not an iterations array")
+            iterations = [{"iteration": 1, "reasoning": response_text}]
+            current_solution = self._extract_conclusion(response_text)
+            complete = False
         
         return {
             "iterations": iterations,
             "final_solution": current_solution
-        }
+        }, complete
+    
+    def _extract_json_block(self, text: str) -> str:
+        """Return the contents of the first fenced code block, or the text itself"""
+        match = _FENCE_RE.search(text)
+        return match.group(1).strip() if match else text
+    
+    def _parse_json(self, text: str) -> Optional[Any]:
+        """Parse JSON from a model response, unwrapping a fenced block if present"""
+        try:
+            return orjson.loads(self._extract_json_block(text))
+        except orjson.JSONDecodeError as e:
+            logger.debug("Reasoning response is not valid JSON", extra={"error": str(e)})
+            return None
     
     def _extract_conclusion(self, text: str) -> str:
         """Extract conclusion from reasoning text"""
-        # Simple extraction - look for conclusion markers
-        markers = ["conclusion:", "solution:", "answer:", "result:"]
-        text_lower = text.lower()
-        
-        for marker in markers:
-            idx = text_lower.find(marker)
-            if idx != -1:
-                return text[idx + len(marker):].strip()[:500]
+        # Look for the first conclusion marker in a single case-insensitive scan
+        match = _CONCLUSION_RE.search(text)
+        if match:
+            return text[match.end():match.end() + 500].strip()
         
         # Return last paragraph as conclusion
         paragraphs = text.split("\n\n")
         return paragraphs[-1].strip()[:500] if paragraphs else text[:500]
-
@@ -1,21 +1,38 @@
 """
 Refactorer Agent - Refactors code for improvement
 """
-from typing import Dict, Any, Optional
-import structlog
-import json
+from typing import Dict, Any, List, Optional
+import asyncio
+import hashlib
+import logging
 import re
 
 from agents.base_agent import BaseAgent
+from agents.utils import detect_language, find_json_object
 
-logger = structlog.get_logger()
+logger = logging.getLogger(__name__)
+
+CODE_SUMMARY_LINES = 40  # leading lines of the file shown to the reasoning engine
+
+_CODE_BLOCK_RE = re.compile(r'```(?:\w+)?\n(.*?)```', re.DOTALL)
+
+_SYSTEM_PROMPT_TEMPLATE = """You are an expert code refactoring specialist in {language}.
+Refactor code to improve:
+- Readability
+- Maintainability
+- Performance
+- Adherence to best practices
+- Code organization
+
+Preserve functionality while improving code quality.
+"""
 
 
 class RefactorerAgent(BaseAgent):
     """Agent specialized in code refactoring"""
     
     async def refactor(self, file_path: str, refactor_type: str,
-                     target: Optional[str] = None) -> Dict[str, Any]:
+                     target: Optional[str] = None, speculative: bool = False) -> Dict[str, Any]:
         """
         Refactor code
         
@@ -23,39 +40,78 @@ class RefactorerAgent(BaseAgent):
             file_path: Path to file to refactor
             refactor_type: Type of refactoring (extract, rename, simplify, optimize, etc.)
             target: Specific target for refactoring (function name, variable, etc.)
+            speculative: Run a plan-free refactor alongside reasoning and keep it
+                unless it produced no usable code
         """
-        logger.info("Refactoring code", file_path=file_path, refactor_type=refactor_type)
+        logger.info("Refactoring code", extra={"file_path": file_path, "refactor_type": refactor_type})
         
         # Read the file
         code = await self.workspace_manager.read_file(file_path)
         if not code:
             raise ValueError(f"File not found: {file_path}")
         
-        # Use reasoning engine to plan refactoring
-        reasoning_result = await self.reasoning_engine.reason(
+        language = self._detect_language(file_path)
+        
+        # Use reasoning engine to plan refactoring from an outline of the code;
+        # the full source only goes into the refactor prompt itself
+        code_id = hashlib.blake2b(code.encode(), digest_size=8).hexdigest()
+        reasoning = self.reasoning_engine.reason(
             f"Refactor code: {refactor_type}",
             context={
-                "code": code[:2000],
+                "code_id": code_id,
+                "code_summary": "\n".join(code.splitlines()[:CODE_SUMMARY_LINES]),
                 "target": target,
                 "refactor_type": refactor_type
             },
             reasoning_type="tree_of_thought"
         )
         
-        language = self._detect_language(file_path)
+        if speculative:
+            # Reasoning starts at once; only the plan-free guess waits for the rules
+            rules_task = asyncio.create_task(self.get_rules(language))
+            
+            async def guess() -> str:
+                return await self._request_refactor(code, language, refactor_type, target,
+                                                    await rules_task, code_id, None)
+            
+            reasoning_result, response = await asyncio.gather(reasoning, guess())
+            rules = rules_task.result()
+            refactor_result = self._parse_refactor_response(response, code)
+            
+            # The guess failed; redo the refactor with the actual plan
+            if refactor_result["refactored_code"] == code:
+                logger.info("Speculative refactor unusable, retrying with plan", extra={"file_path": file_path})
+                response = await self._request_refactor(code, language, refactor_type, target, rules,
+                                                        code_id, reasoning_result)
+                refactor_result = self._parse_refactor_response(response, code)
+            
+            refactor_result["reasoning_plan"] = {
+                "selected_approach": reasoning_result.get("selected_approach"),
+                "solution": reasoning_result.get("solution", "")
+            }
+        else:
+            # Plan the refactoring and fetch rules for the language concurrently
+            reasoning_result, rules = await asyncio.gather(reasoning, self.get_rules(language))
+            response = await self._request_refactor(code, language, refactor_type, target, rules,
+                                                    code_id, reasoning_result)
+            refactor_result = self._parse_refactor_response(response, code)
         
-        # Get rules for the language
-        rules = await self.get_rules(language)
+        # Save refactored code
+        if refactor_result.get("refactored_code"):
+            await self.workspace_manager.write_file(file_path, refactor_result["refactored_code"])
+            logger.info("Refactored code saved", extra={"file_path": file_path})
         
-        system_prompt = f"""You are an expert code refactoring specialist in {language}.
-Refactor code to improve:
-- Readability
-- Maintainability
-- Performance
-- Adherence to best practices
-- Code organization
-
-Preserve functionality while improving code quality.
+        return refactor_result
+    
+    async def _request_refactor(self, code: str, language: str, refactor_type: str,
+                                target: Optional[str], rules: List[Dict[str, Any]], code_id: str,
+                                reasoning_result: Optional[Dict[str, Any]]) -> str:
+        """Ask the LLM for the refactoring, following the reasoning plan when one is given"""
+        plan = ""
+        if reasoning_result is not None:
+            plan = f"""Reasoning Plan (code {code_id}):
+Approach: {reasoning_result.get("selected_approach") or "Not selected"}
+Solution: {reasoning_result.get("solution", "")}
 """
         
         refactor_prompt = f"""Refactor this {language} code:
@@ -67,9 +123,7 @@ Preserve functionality while improving code quality.
 Refactoring Type: {refactor_type}
 {"Target: " + target if target else ""}
 
-Reasoning Plan:
-{json.dumps(reasoning_result, indent=2)}
-
+{plan}
 Coding Rules:
 {self._format_rules(rules)}
 
@@ -84,71 +138,41 @@ Format as JSON with:
 - explanation: detailed explanation of improvements
 """
         
-        response = await self.call_ollama(
+        return await self.call_ollama(
             prompt=refactor_prompt,
-            system_prompt=system_prompt,
+            system_prompt=_SYSTEM_PROMPT_TEMPLATE.format_map({"language": language}),
             temperature=0.3,
             max_tokens=8192
         )
-        
-        # Parse refactoring results
-        refactor_result = self._parse_refactor_response(response, code)
-        
-        # Save refactored code
-        if refactor_result.get("refactored_code"):
-            await self.workspace_manager.write_file(file_path, refactor_result["refactored_code"])
-            logger.info("Refactored code saved", file_path=file_path)
-        
-        return refactor_result
     
     async def execute_task(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a refactoring task"""
         file_path = context.get("file_path") or task
         refactor_type = context.get("refactor_type", "improve")
         target = context.get("target")
-        return await self.refactor(file_path, refactor_type, target)
+        speculative = context.get("speculative", False)
+        return await self.refactor(file_path, refactor_type, target, speculative)
     
     def _detect_language(self, file_path: str) -> str:
         """Detect programming language from file extension"""
-        ext_to_lang = {
-            ".py": "python",
-            ".js": "javascript",
-            ".ts": "typescript",
-            ".java": "java",
-            ".go": "go",
-            ".rs": "rust",
-            ".cpp": "cpp",
-            ".c": "c"
-        }
-        
-        for ext, lang in ext_to_lang.items():
-            if file_path.endswith(ext):
-                return lang
-        
-        return "python"
+        return detect_language(file_path)
     
     def _format_rules(self, rules: list) -> str:
         """Format rules for prompt"""
         if not rules:
             return "No specific rules defined."
         
-        return "\n".join([f"- {r.get('name')}: {r.get('description', '')}" for r in rules])
+        return "\n".join(f"- {r.get('name')}: {r.get('description', '')}" for r in rules)
     
     def _parse_refactor_response(self, response: str, original_code: str) -> Dict[str, Any]:
         """Parse refactoring response from LLM"""
-        import re
-        
         # Try to extract JSON
-        json_match = re.search(r'\{.*\}', response, re.DOTALL)
-        if json_match:
-            try:
-                result = json.loads(json_match.group())
-                # Ensure refactored_code is present
-                if not result.get("refactored_code"):
-                    result["refactored_code"] = self._extract_code(response) or original_code
-                return result
-            except:
-                pass
+        result = find_json_object(response, ("changes", "explanation"))
+        if result is not None:
+            # Ensure refactored_code is present
+            if not result.get("refactored_code"):
+                result["refactored_code"] = self._extract_code(response) or original_code
+            return result
         
         # Fallback: extract code and create structured response
         refactored_code = self._extract_code(response) or original_code
@@ -161,8 +185,9 @@ Format as JSON with:
     
     def _extract_code(self, response: str) -> str:
         """Extract code from response"""
-        code_blocks = re.findall(r'```(?:\w+)?\n(.*?)```', response, re.DOTALL)
-        if code_blocks:
-            return code_blocks[-1].strip()
-        return ""
+        # Only the last block is wanted, so keep the final match instead of a list
+        last = None
+        for last in _CODE_BLOCK_RE.finditer(response):
+            pass
+        return last.group(1).strip() if last else ""
 
@@ -0,0 +1,48 @@
+"""
+Agent Schemas - Typed shapes of Ollama payloads and parsed agent results
+"""
+from typing import Any, Dict, List, TypedDict
+
+
+class OllamaOptions(TypedDict, total=False):
+    """Sampling options understood by Ollama"""
+    temperature: float
+    num_predict: int
+    num_ctx: int
+
+
+class ChatMessage(TypedDict):
+    """A single message in an Ollama chat conversation"""
+    role: str
+    content: str
+
+
+class OllamaChatRequest(TypedDict):
+    """Body of an Ollama /api/chat request"""
+    model: str
+    messages: List[ChatMessage]
+    stream: bool
+    keep_alive: str
+    options: OllamaOptions
+
+
+class OllamaChatChunk(TypedDict, total=False):
+    """One streamed line of an Ollama /api/chat response"""
+    model: str
+    message: ChatMessage
+    done: bool
+
+
+class ReviewResult(TypedDict, total=False):
+    """Parsed output of CodeReviewerAgent.review"""
+    issues: List[Dict[str, Any]]
+    suggestions: List[Dict[str, Any]]
+    score: int
+
+
+class DebugResult(TypedDict, total=False):
+    """Parsed output of DebuggerAgent.debug"""
+    root_cause: str
+    fixes: List[Dict[str, Any]]
+    fixed_code: str
+    explanation: str
@@ -0,0 +1,121 @@
+"""
+Agent Utilities - Helpers shared across agents (language detection, LLM output parsing)
+"""
+import os
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# File extension -> language name used in prompts
+EXT_TO_LANG = {
+    ".py": "python",
+    ".js": "javascript",
+    ".ts": "typescript",
+    ".java": "java",
+    ".go": "go",
+    ".rs": "rust",
+    ".cpp": "cpp",
+    ".c": "c",
+    ".rb": "ruby",
+    ".php": "php"
+}
+
+
+@lru_cache(maxsize=1024)
+def detect_language(file_path: str, default: str = "python") -> str:
+    """Detect programming language from file extension"""
+    return EXT_TO_LANG.get(os.path.splitext(file_path)[1].lower(), default)
+
+
+# Spans enclosed by more open braces than this are not decoded: the answer is
+# the outermost object, or at worst wrapped in a stray brace or two of prose,
+# so every character is decoded a bounded number of times
+MAX_ENCLOSING_BRACES = 2
+
+
+class JsonObjectScanner:
+    """
+    Incrementally find a JSON object in streamed text, in one forward pass
+
+    Offsets of open braces outside string literals are kept on a stack; each
+    span is decoded as its closing brace arrives. Only a non-empty object
+    holding ``required_keys`` counts, so braces in surrounding prose (``{}``,
+    ``${HOME}``) are passed over. An object that closes with no brace left
+    open is returned right away; one nested inside a still-open brace is
+    kept as ``candidate`` in case that brace never closes, e.g. a stray
+    ``{`` in prose or output cut off at num_predict.
+    """
+
+    def __init__(self, required_keys: Iterable[str] = ()):
+        self.required_keys = tuple(required_keys)
+        self.candidate: Optional[Dict[str, Any]] = None
+        self._candidate_start = -1
+        # Text since the outermost open brace, as chunks and their offsets
+        self._chunks: List[str] = []
+        self._offsets: List[int] = []
+        self._length = 0
+        self._open: List[int] = []
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        """Consume a chunk; return the object once it is complete and outermost"""
+        base = self._length
+        self._length += len(chunk)
+        self._chunks.append(chunk)
+        self._offsets.append(base)
+
+        for i, char in enumerate(chunk):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = bool(self._open)
+            elif char == "{":
+                self._open.append(base + i)
+            elif char == "}" and self._open:
+                start = self._open.pop()
+                if len(self._open) > MAX_ENCLOSING_BRACES:
+                    continue
+                parsed = self._decode(start, base + i + 1)
+                if parsed is not None and (self.candidate is None or start < self._candidate_start):
+                    self.candidate, self._candidate_start = parsed, start
+                if not self._open and self.candidate is not None:
+                    return self.candidate
+
+        if not self._open:
+            self._chunks.clear()
+            self._offsets.clear()
+        return None
+
+    def _decode(self, start: int, end: int) -> Optional[Dict[str, Any]]:
+        """The span [start, end) as an object with the required keys, or None"""
+        first = bisect_right(self._offsets, start) - 1
+        base = self._offsets[first]
+        span = "".join(self._chunks[first:])[start - base:end - base]
+        try:
+            parsed = orjson.loads(span)
+        except orjson.JSONDecodeError:
+            return None
+        if isinstance(parsed, dict) and parsed and all(key in parsed for key in self.required_keys):
+            return parsed
+        return None
+
+
+def find_json_object(text: str, required_keys: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    The outermost object in text holding required_keys, or None
+
+    One forward pass; braces in surrounding prose (``{}``, ``${HOME}``)
+    don't hide the object that follows them.
+    """
+    scanner = JsonObjectScanner(required_keys)
+    return scanner.feed(text) or scanner.candidate
@@ -0,0 +1,43 @@
+"""
+Logging Setup - Lightweight stdlib logging for the agent hot path
+"""
+import logging
+import os
+import sys
+
+import orjson
+
+# Attributes every LogRecord carries; anything else was passed via ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Render log records as single-line JSON, merging ``extra`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "event": record.getMessage(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "timestamp": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+def configure_logging(name: str = "agents", level: str = None):
+    """Attach a JSON stdout handler to the ``name`` logger hierarchy (once)"""
+    log = logging.getLogger(name)
+    if log.handlers:
+        return log
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JSONFormatter())
+    log.addHandler(handler)
+    log.setLevel(level or os.getenv("LOG_LEVEL", "INFO").upper())
+    log.propagate = False
+    return log
@@ -3,27 +3,44 @@ Agent Orchestrator - Main service for coordinating AI agents
 """
 import os
 import asyncio
+import logging
+import re
 from contextlib import asynccontextmanager
+from pathlib import Path
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 import structlog
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel, Field
 import httpx
+import orjson
 
+from agents.base_agent import BaseAgent
 from agents.code_generator import CodeGeneratorAgent
 from agents.code_reviewer import CodeReviewerAgent
 from agents.debugger import DebuggerAgent
 from agents.refactorer import RefactorerAgent
 from agents.reasoning_engine import ReasoningEngine
+from agents.utils import detect_language
 from mcp_client import MCPClient
 from workspace_manager import WorkspaceManager
+from response_cache import ResponseCache
+from logging_setup import configure_logging
+
+
+def _orjson_dumps(obj: Any, default=None, **kwargs) -> str:
+    """structlog serializer backed by orjson"""
+    return orjson.dumps(obj, default=default).decode()
+
 
 # Configure structured logging
+# Levels below LOG_LEVEL are dropped by the bound logger itself, before any
+# processor runs, so filter_by_level is no longer needed in the chain
 structlog.configure(
     processors=[
-        structlog.stdlib.filter_by_level,
         structlog.stdlib.add_logger_name,
         structlog.stdlib.add_log_level,
         structlog.stdlib.PositionalArgumentsFormatter(),
@@ -31,16 +48,21 @@ structlog.configure(
         structlog.processors.StackInfoRenderer(),
         structlog.processors.format_exc_info,
         structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer()
+        structlog.processors.JSONRenderer(serializer=_orjson_dumps)
     ],
     context_class=dict,
     logger_factory=structlog.stdlib.LoggerFactory(),
-    wrapper_class=structlog.stdlib.BoundLogger,
+    wrapper_class=structlog.make_filtering_bound_logger(
+        logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper())
+    ),
     cache_logger_on_first_use=True,
 )
 
 logger = structlog.get_logger()
 
+# Agents log through stdlib logging to keep per-request overhead low
+configure_logging("agents")
+
 # Configuration
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 WORKSPACE_PATH = os.getenv("WORKSPACE_PATH", "/app/workspace")
@@ -48,10 +70,20 @@ MCP_GITHUB_URL = os.getenv("MCP_GITHUB_URL", "http://mcp-github:3001")
 MCP_GITLAB_URL = os.getenv("MCP_GITLAB_URL", "http://mcp-gitlab:3002")
 RULES_ENGINE_URL = os.getenv("RULES_ENGINE_URL", "http://rules-engine:8001")
 
+# Test framework used by /generate-tests when the request doesn't name one
+DEFAULT_TEST_FRAMEWORK = {
+    "python": "pytest",
+    "javascript": "jest",
+    "typescript": "jest",
+    "java": "junit",
+    "go": "testing"
+}
+
 # Initialize components
 workspace_manager = WorkspaceManager(WORKSPACE_PATH)
 mcp_client = MCPClient(MCP_GITHUB_URL, MCP_GITLAB_URL)
 reasoning_engine = ReasoningEngine(OLLAMA_HOST)
+response_cache = ResponseCache()
 
 # Initialize agents
 code_generator = CodeGeneratorAgent(OLLAMA_HOST, workspace_manager, mcp_client, reasoning_engine)
@@ -59,21 +91,36 @@ code_reviewer = CodeReviewerAgent(OLLAMA_HOST, workspace_manager, mcp_client, re
 debugger = DebuggerAgent(OLLAMA_HOST, workspace_manager, mcp_client, reasoning_engine)
 refactorer = RefactorerAgent(OLLAMA_HOST, workspace_manager, mcp_client, reasoning_engine)
 
+# Keyword patterns for auto agent selection, checked in priority order
+AGENT_PATTERNS = [
+    ("generator", re.compile(r"generate|create|write|implement|build")),
+    ("reviewer", re.compile(r"review|check|analyze|audit")),
+    ("debugger", re.compile(r"debug|fix|error|bug|issue")),
+    ("refactorer", re.compile(r"refactor|improve|optimize|clean")),
+]
+_WHITESPACE_RE = re.compile(r"\s+")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown logic"""
     logger.info("Starting Agent Orchestrator")
     await workspace_manager.initialize()
+    await mcp_client.startup()
+    app.state.mcp_client = mcp_client
     yield
     logger.info("Shutting down Agent Orchestrator")
+    await mcp_client.aclose()
+    await BaseAgent.aclose()
+    workspace_manager.close()
 
 
 app = FastAPI(
     title="Agent Orchestrator",
     description="AI Agent Orchestration Service",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -109,6 +156,7 @@ class RefactorRequest(BaseModel):
     file_path: str = Field(..., description="Path to file to refactor")
     refactor_type: str = Field(..., description="Type of refactoring (extract, rename, simplify, etc.)")
     target: Optional[str] = Field(default=None, description="Specific target for refactoring")
+    speculative: bool = Field(default=False, description="Refactor while planning; retry with the plan only if needed")
 
 
 class ExplainRequest(BaseModel):
@@ -135,10 +183,39 @@ class AgentTaskRequest(BaseModel):
     agent_type: Optional[str] = Field(default="auto", description="Specific agent or 'auto' for selection")
 
 
+@lru_cache(maxsize=64)
+def _explain_system_prompt(language: str) -> str:
+    """System prompt for /explain, rendered once per language"""
+    return f"""You are an expert {language} developer. Explain code clearly and comprehensively.
+Explain:
+- What the code does
+- How it works
+- Key concepts and patterns
+- Potential issues or improvements
+- Usage examples if applicable"""
+
+
+@lru_cache(maxsize=64)
+def _docs_system_prompt(language: str, doc_format: str) -> str:
+    """System prompt for /generate-docs, rendered once per (language, format)"""
+    return f"""You are an expert technical writer specializing in {language} documentation.
+Generate clear, comprehensive documentation following {doc_format} format.
+Include:
+- Function/class descriptions
+- Parameter documentation
+- Return value documentation
+- Usage examples
+- Error conditions"""
+
+
+# Serialized once; probes hit this endpoint constantly
+HEALTH_PAYLOAD = orjson.dumps({"status": "healthy", "service": "agent-orchestrator"})
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "agent-orchestrator"}
+    return Response(content=HEALTH_PAYLOAD, media_type="application/json")
 
 
 @app.post("/generate")
@@ -152,11 +229,16 @@ async def generate_code(request: GenerateCodeRequest, background_tasks: Backgrou
         if request.repository_url:
             context = await mcp_client.get_repository_context(request.repository_url)
         
-        # Add file context if provided
+        # Add file context if provided, reading all files concurrently
         if request.context_files:
-            for file_path in request.context_files:
-                content = await workspace_manager.read_file(file_path)
-                context[file_path] = content
+            contents = await asyncio.gather(
+                *(workspace_manager.read_file(file_path) for file_path in request.context_files)
+            )
+            context.update(
+                (file_path, content)
+                for file_path, content in zip(request.context_files, contents)
+                if content is not None
+            )
         
         # Generate code
         result = await code_generator.generate(
@@ -231,7 +313,8 @@ async def refactor_code(request: RefactorRequest):
         result = await refactorer.refactor(
             file_path=request.file_path,
             refactor_type=request.refactor_type,
-            target=request.target
+            target=request.target,
+            speculative=request.speculative
         )
         
         return {
@@ -275,13 +358,7 @@ async def explain_code(request: ExplainRequest):
     try:
         logger.info("Code explanation requested", language=request.language)
         
-        system_prompt = f"""You are an expert {request.language} developer. Explain code clearly and comprehensively.
-Explain:
-- What the code does
-- How it works
-- Key concepts and patterns
-- Potential issues or improvements
-- Usage examples if applicable"""
+        system_prompt = _explain_system_prompt(request.language)
         
         prompt = f"""Explain this {request.language} code in detail:
 
@@ -291,12 +368,15 @@ Explain:
 
 Provide a comprehensive explanation."""
         
-        response = await code_generator.call_ollama(
+        # The prompt depends only on the request, so repeats reuse the stored answer
+        cache_key = response_cache.key("explain", language=request.language, code=request.code,
+                                       system=system_prompt, temperature=0.2)
+        response = await response_cache.get_or_compute(cache_key, lambda: code_generator.call_ollama(
             prompt=prompt,
             system_prompt=system_prompt,
             temperature=0.2,
             max_tokens=2048
-        )
+        ))
         
         return {
             "success": True,
@@ -320,23 +400,9 @@ async def generate_tests(request: GenerateTestsRequest):
             raise ValueError(f"File not found: {request.file_path}")
         
         # Detect language from file extension
-        ext_to_lang = {
-            '.py': 'python', '.js': 'javascript', '.ts': 'typescript',
-            '.java': 'java', '.go': 'go', '.rs': 'rust', '.cpp': 'cpp', '.c': 'c'
-        }
-        language = 'python'  # default
-        for ext, lang in ext_to_lang.items():
-            if request.file_path.endswith(ext):
-                language = lang
-                break
-        
-        test_framework = request.test_framework or {
-            "python": "pytest",
-            "javascript": "jest",
-            "typescript": "jest",
-            "java": "junit",
-            "go": "testing"
-        }.get(language, "pytest")
+        language = detect_language(request.file_path)
+        
+        test_framework = request.test_framework or DEFAULT_TEST_FRAMEWORK.get(language, "pytest")
         
         # Get codebase context for better tests
         codebase_context = await code_generator.get_codebase_context(
@@ -364,7 +430,7 @@ Code to test:
             prompt=prompt,
             language=language,
             context=context,
-            output_path=request.file_path.replace(f".{language}", f"_test.{language}")
+            output_path=str(Path(request.file_path).with_stem(Path(request.file_path).stem + "_test"))
         )
         
         return {
@@ -391,28 +457,13 @@ async def generate_docs(request: GenerateDocsRequest):
             raise ValueError(f"File not found: {request.file_path}")
         
         # Detect language from file extension
-        ext_to_lang = {
-            '.py': 'python', '.js': 'javascript', '.ts': 'typescript',
-            '.java': 'java', '.go': 'go', '.rs': 'rust', '.cpp': 'cpp', '.c': 'c'
-        }
-        language = 'python'  # default
-        for ext, lang in ext_to_lang.items():
-            if request.file_path.endswith(ext):
-                language = lang
-                break
+        language = detect_language(request.file_path)
         
         doc_format = request.doc_format
         if language == "python" and doc_format == "docstring":
             doc_format = "google"  # Google-style docstrings for Python
         
-        system_prompt = f"""You are an expert technical writer specializing in {language} documentation.
-Generate clear, comprehensive documentation following {doc_format} format.
-Include:
-- Function/class descriptions
-- Parameter documentation
-- Return value documentation
-- Usage examples
-- Error conditions"""
+        system_prompt = _docs_system_prompt(language, doc_format)
         
         prompt = f"""Generate {doc_format} documentation for this {language} code:
 
@@ -424,12 +475,13 @@ Include:
 
 Provide complete documentation."""
         
-        response = await code_generator.call_ollama(
+        cache_key = response_cache.key("generate-docs", prompt=prompt, system=system_prompt, temperature=0.2)
+        response = await response_cache.get_or_compute(cache_key, lambda: code_generator.call_ollama(
             prompt=prompt,
             system_prompt=system_prompt,
             temperature=0.2,
             max_tokens=4096
-        )
+        ))
         
         return {
             "success": True,
@@ -442,21 +494,21 @@ Provide complete documentation."""
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@lru_cache(maxsize=4096)
+def _select_agent_type(task: str) -> str:
+    """Map a normalized task description to an agent type name"""
+    for agent_type, pattern in AGENT_PATTERNS:
+        if pattern.search(task):
+            return agent_type
+    
+    # Default to code generator for general tasks
+    return "generator"
+
+
 async def select_agent(task: str) -> Any:
     """Select appropriate agent based on task description"""
-    task_lower = task.lower()
-    
-    if any(word in task_lower for word in ["generate", "create", "write", "implement", "build"]):
-        return code_generator
-    elif any(word in task_lower for word in ["review", "check", "analyze", "audit"]):
-        return code_reviewer
-    elif any(word in task_lower for word in ["debug", "fix", "error", "bug", "issue"]):
-        return debugger
-    elif any(word in task_lower for word in ["refactor", "improve", "optimize", "clean"]):
-        return refactorer
-    else:
-        # Default to code generator for general tasks
-        return code_generator
+    # Normalize so repeated tasks hit the selection cache
+    return get_agent_by_type(_select_agent_type(_WHITESPACE_RE.sub(" ", task.strip().lower())))
 
 
 def get_agent_by_type(agent_type: str) -> Any:
@@ -472,5 +524,13 @@ def get_agent_by_type(agent_type: str) -> Any:
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop and httptools ship with uvicorn[standard]; multiple workers need the import string
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
 
@@ -1,12 +1,49 @@
 """
 MCP Client - Client for communicating with MCP servers
 """
+import asyncio
+from functools import lru_cache
 import httpx
 from typing import Dict, Any, Optional, List
+from urllib.parse import urlsplit
 import structlog
 
 logger = structlog.get_logger()
 
+_PROVIDER_NAMES = {"github": "GitHub", "gitlab": "GitLab"}
+
+
+@lru_cache(maxsize=1024)
+def _provider(repo_url: str) -> Optional[str]:
+    """Return which MCP provider serves a repository URL, or None if unknown"""
+    if "github.com" in repo_url or "github.io" in repo_url:
+        return "github"
+    if "gitlab" in repo_url:
+        return "gitlab"
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _parse_repo_url(repo_url: str) -> str:
+    """Parse repository URL to get owner/repo path"""
+    parts = urlsplit(repo_url if "://" in repo_url else "https://" + repo_url)
+    path = parts.path.strip("/")
+    if path.endswith(".git"):
+        path = path[:-4]
+    
+    host = parts.hostname or ""
+    if host.startswith("www."):
+        host = host[4:]
+    
+    # GitHub paths may continue past owner/repo (/tree/main, ...); GitLab
+    # keeps the full path so nested groups survive
+    if host == "github.com":
+        return "/".join(path.split("/", 2)[:2])
+    if host == "gitlab.com":
+        return path
+    
+    return f"{parts.netloc}/{path}" if path else parts.netloc
+
 
 class MCPClient:
     """Client for MCP (Model Context Protocol) servers"""
@@ -14,6 +51,26 @@ class MCPClient:
     def __init__(self, github_url: str, gitlab_url: str):
         self.github_url = github_url
         self.gitlab_url = gitlab_url
+        self._base_urls = {"github": github_url, "gitlab": gitlab_url}
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    async def startup(self):
+        """Create the pooled HTTP client shared by all MCP calls"""
+        if self._client is None:
+            # HTTP/2 lets concurrent file fetches share a connection where the
+            # MCP server negotiates it; retries cover connect failures only
+            transport = httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+                retries=2
+            )
+            self._client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(30.0, connect=5.0))
+    
+    async def aclose(self):
+        """Close the pooled HTTP client"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     async def get_repository_context(self, repo_url: str, 
                                     include_files: Optional[List[str]] = None) -> Dict[str, Any]:
@@ -24,193 +81,96 @@ class MCPClient:
             repo_url: Repository URL
             include_files: Specific files to include (optional)
         """
-        if "github.com" in repo_url or "github.io" in repo_url:
-            return await self._get_github_context(repo_url, include_files)
-        elif "gitlab.com" in repo_url or "gitlab" in repo_url:
-            return await self._get_gitlab_context(repo_url, include_files)
-        else:
+        provider = _provider(repo_url)
+        if provider is None:
             logger.warning("Unknown repository host", url=repo_url)
             return {}
-    
-    async def _get_github_context(self, repo_url: str, 
-                                 include_files: Optional[List[str]]) -> Dict[str, Any]:
-        """Get context from GitHub repository"""
+        
         try:
-            async with httpx.AsyncClient() as client:
-                # Parse repo URL
-                repo_path = self._parse_repo_url(repo_url)
-                
-                # Get repository info
-                response = await client.get(
-                    f"{self.github_url}/api/repo/info",
-                    params={"repo": repo_path}
-                )
-                response.raise_for_status()
-                repo_info = response.json()
-                
-                # Get file contents if specified
-                files = {}
-                if include_files:
-                    for file_path in include_files:
-                        file_response = await client.get(
-                            f"{self.github_url}/api/repo/file",
-                            params={"repo": repo_path, "path": file_path}
-                        )
-                        if file_response.status_code == 200:
-                            files[file_path] = file_response.json().get("content", "")
-                
-                return {
-                    "repository": repo_info,
-                    "files": files,
-                    "url": repo_url
-                }
+            base_url = self._base_urls[provider]
+            
+            # Parse repo URL
+            repo_path = _parse_repo_url(repo_url)
+            
+            # Get repository info
+            response = await self._client.get(
+                f"{base_url}/api/repo/info",
+                params={"repo": repo_path}
+            )
+            response.raise_for_status()
+            repo_info = response.json()
+            
+            # Get file contents if specified
+            files = {}
+            if include_files:
+                files = await self._fetch_files(base_url, repo_path, include_files)
+            
+            return {
+                "repository": repo_info,
+                "files": files,
+                "url": repo_url
+            }
         except Exception as e:
-            logger.error("Failed to get GitHub context", error=str(e))
+            logger.error(f"Failed to get {_PROVIDER_NAMES[provider]} context", error=str(e))
             return {}
     
-    async def _get_gitlab_context(self, repo_url: str,
-                                 include_files: Optional[List[str]]) -> Dict[str, Any]:
-        """Get context from GitLab repository"""
-        try:
-            async with httpx.AsyncClient() as client:
-                # Parse repo URL
-                repo_path = self._parse_repo_url(repo_url)
-                
-                # Get repository info
-                response = await client.get(
-                    f"{self.gitlab_url}/api/repo/info",
-                    params={"repo": repo_path}
-                )
-                response.raise_for_status()
-                repo_info = response.json()
-                
-                # Get file contents if specified
-                files = {}
-                if include_files:
-                    for file_path in include_files:
-                        file_response = await client.get(
-                            f"{self.gitlab_url}/api/repo/file",
-                            params={"repo": repo_path, "path": file_path}
-                        )
-                        if file_response.status_code == 200:
-                            files[file_path] = file_response.json().get("content", "")
-                
-                return {
-                    "repository": repo_info,
-                    "files": files,
-                    "url": repo_url
-                }
-        except Exception as e:
-            logger.error("Failed to get GitLab context", error=str(e))
-            return {}
-    
-    def _parse_repo_url(self, repo_url: str) -> str:
-        """Parse repository URL to get owner/repo path"""
-        # Remove protocol
-        repo_url = repo_url.replace("https://", "").replace("http://", "")
-        
-        # Remove .git suffix
-        if repo_url.endswith(".git"):
-            repo_url = repo_url[:-4]
+    async def _fetch_files(self, base_url: str, repo_path: str,
+                           include_files: List[str]) -> Dict[str, str]:
+        """Fetch file contents concurrently, skipping files that could not be read"""
+        responses = await asyncio.gather(
+            *(
+                self._client.get(f"{base_url}/api/repo/file", params={"repo": repo_path, "path": file_path})
+                for file_path in include_files
+            ),
+            return_exceptions=True
+        )
         
-        # Extract owner/repo
-        if "github.com" in repo_url:
-            parts = repo_url.split("github.com/")
-            if len(parts) > 1:
-                return parts[1].split("/")[0] + "/" + parts[1].split("/")[1]
-        elif "gitlab.com" in repo_url:
-            parts = repo_url.split("gitlab.com/")
-            if len(parts) > 1:
-                return parts[1]
-        
-        return repo_url
+        files = {}
+        for file_path, file_response in zip(include_files, responses):
+            if isinstance(file_response, Exception):
+                logger.warning("Failed to fetch repository file", path=file_path, error=str(file_response))
+            elif file_response.status_code == 200:
+                files[file_path] = file_response.json().get("content", "")
+        return files
     
     async def push_to_repo(self, repo_url: str, branch: str, 
                           files: Dict[str, str], commit_message: str) -> bool:
         """Push changes to repository"""
-        if "github.com" in repo_url:
-            return await self._push_to_github(repo_url, branch, files, commit_message)
-        elif "gitlab.com" in repo_url or "gitlab" in repo_url:
-            return await self._push_to_gitlab(repo_url, branch, files, commit_message)
-        return False
-    
-    async def _push_to_github(self, repo_url: str, branch: str,
-                             files: Dict[str, str], commit_message: str) -> bool:
-        """Push to GitHub"""
-        try:
-            async with httpx.AsyncClient() as client:
-                repo_path = self._parse_repo_url(repo_url)
-                response = await client.post(
-                    f"{self.github_url}/api/repo/push",
-                    json={
-                        "repo": repo_path,
-                        "branch": branch,
-                        "files": files,
-                        "commit_message": commit_message
-                    }
-                )
-                response.raise_for_status()
-                return True
-        except Exception as e:
-            logger.error("Failed to push to GitHub", error=str(e))
+        provider = _provider(repo_url)
+        if provider is None:
             return False
-    
-    async def _push_to_gitlab(self, repo_url: str, branch: str,
-                             files: Dict[str, str], commit_message: str) -> bool:
-        """Push to GitLab"""
+        
         try:
-            async with httpx.AsyncClient() as client:
-                repo_path = self._parse_repo_url(repo_url)
-                response = await client.post(
-                    f"{self.gitlab_url}/api/repo/push",
-                    json={
-                        "repo": repo_path,
-                        "branch": branch,
-                        "files": files,
-                        "commit_message": commit_message
-                    }
-                )
-                response.raise_for_status()
-                return True
+            repo_path = _parse_repo_url(repo_url)
+            response = await self._client.post(
+                f"{self._base_urls[provider]}/api/repo/push",
+                json={
+                    "repo": repo_path,
+                    "branch": branch,
+                    "files": files,
+                    "commit_message": commit_message
+                }
+            )
+            response.raise_for_status()
+            return True
         except Exception as e:
-            logger.error("Failed to push to GitLab", error=str(e))
+            logger.error(f"Failed to push to {_PROVIDER_NAMES[provider]}", error=str(e))
             return False
     
     async def pull_from_repo(self, repo_url: str, branch: str = "main") -> Dict[str, Any]:
         """Pull from repository"""
-        if "github.com" in repo_url:
-            return await self._pull_from_github(repo_url, branch)
-        elif "gitlab.com" in repo_url or "gitlab" in repo_url:
-            return await self._pull_from_gitlab(repo_url, branch)
-        return {}
-    
-    async def _pull_from_github(self, repo_url: str, branch: str) -> Dict[str, Any]:
-        """Pull from GitHub"""
-        try:
-            async with httpx.AsyncClient() as client:
-                repo_path = self._parse_repo_url(repo_url)
-                response = await client.get(
-                    f"{self.github_url}/api/repo/pull",
-                    params={"repo": repo_path, "branch": branch}
-                )
-                response.raise_for_status()
-                return response.json()
-        except Exception as e:
-            logger.error("Failed to pull from GitHub", error=str(e))
+        provider = _provider(repo_url)
+        if provider is None:
             return {}
-    
-    async def _pull_from_gitlab(self, repo_url: str, branch: str) -> Dict[str, Any]:
-        """Pull from GitLab"""
+        
         try:
-            async with httpx.AsyncClient() as client:
-                repo_path = self._parse_repo_url(repo_url)
-                response = await client.get(
-                    f"{self.gitlab_url}/api/repo/pull",
-                    params={"repo": repo_path, "branch": branch}
-                )
-                response.raise_for_status()
-                return response.json()
+            repo_path = _parse_repo_url(repo_url)
+            response = await self._client.get(
+                f"{self._base_urls[provider]}/api/repo/pull",
+                params={"repo": repo_path, "branch": branch}
+            )
+            response.raise_for_status()
+            return response.json()
         except Exception as e:
-            logger.error("Failed to pull from GitLab", error=str(e))
+            logger.error(f"Failed to pull from {_PROVIDER_NAMES[provider]}", error=str(e))
             return {}
-
@@ -0,0 +1,50 @@
+"""
+Response Cache - Reuses LLM answers for prompts that fully determine them
+"""
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict
+
+import orjson
+from cachetools import TTLCache
+
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL = 24 * 3600  # seconds
+
+
+class ResponseCache:
+    """In-process TTL cache of LLM responses keyed by everything that shapes the prompt"""
+    
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[str, "asyncio.Task[str]"] = {}
+    
+    @staticmethod
+    def key(endpoint: str, **parts: Any) -> str:
+        """Build a stable cache key from the endpoint name and prompt inputs"""
+        payload = orjson.dumps({"ep": endpoint, **parts}, option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+    
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        Return the cached response for key, or compute and store it
+        
+        Concurrent misses for the same key share one computation instead of
+        each running their own.
+        """
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._compute(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one cancelled caller doesn't cancel the shared computation
+        return await asyncio.shield(task)
+    
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        response = await compute()
+        self._cache[key] = response
+        return response
@@ -2,13 +2,36 @@
 Workspace Manager - Manages file operations in the workspace
 """
 import os
-import aiofiles
+import asyncio
+import stat
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, TypeVar
 import structlog
+from cachetools import TTLCache
 
 logger = structlog.get_logger()
 
+READ_CACHE_SIZE = 512
+READ_CACHE_TTL = 60.0  # seconds
+READ_MAX_CHARS = 1_048_576  # caps how much of a file ends up in an LLM prompt
+FILE_IO_WORKERS = 16
+
+T = TypeVar("T")
+
+
+def _read_text(path: Path, max_chars: int) -> str:
+    """Read up to max_chars characters of a UTF-8 file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read(max_chars)
+
+
+def _write_text(path: Path, content: str):
+    """Write a UTF-8 file, creating parent directories as needed"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
 
 class WorkspaceManager:
     """Manages workspace file operations"""
@@ -16,41 +39,84 @@ class WorkspaceManager:
     def __init__(self, workspace_path: str):
         self.workspace_path = Path(workspace_path)
         self.workspace_path.mkdir(parents=True, exist_ok=True)
+        # Resolved once; every requested path must stay beneath it
+        self._root = self.workspace_path.resolve()
+        # File contents keyed by (path, mtime_ns, size, max_chars)
+        self._cache: TTLCache = TTLCache(maxsize=READ_CACHE_SIZE, ttl=READ_CACHE_TTL)
+        # Dedicated pool so file fan-out can't exhaust the loop's default executor
+        self._io_executor = ThreadPoolExecutor(max_workers=FILE_IO_WORKERS, thread_name_prefix="workspace-io")
+    
+    async def _run_io(self, func: Callable[..., T], *args: Any) -> T:
+        """Run blocking file I/O on the workspace thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._io_executor, func, *args)
+    
+    def close(self):
+        """Shut down the file I/O thread pool"""
+        self._io_executor.shutdown(wait=False)
+    
+    def _resolve(self, file_path: str) -> Optional[Path]:
+        """Resolve a workspace-relative path, or None if it escapes the workspace"""
+        full_path = (self._root / file_path.lstrip("/")).resolve()
+        if not full_path.is_relative_to(self._root):
+            logger.warning("Path escapes workspace", path=file_path)
+            return None
+        return full_path
+    
+    def _invalidate(self, full_path: Path):
+        """Drop cached contents for a path and anything beneath it"""
+        prefix = str(full_path)
+        for key in [k for k in self._cache.keys() if k[0] == prefix or k[0].startswith(prefix + os.sep)]:
+            self._cache.pop(key, None)
     
     async def initialize(self):
         """Initialize workspace"""
         logger.info("Initializing workspace", path=str(self.workspace_path))
         self.workspace_path.mkdir(parents=True, exist_ok=True)
     
-    async def read_file(self, file_path: str) -> Optional[str]:
-        """Read a file from workspace"""
-        full_path = self.workspace_path / file_path.lstrip("/")
+    async def read_file(self, file_path: str, max_chars: int = READ_MAX_CHARS) -> Optional[str]:
+        """Read a file from workspace, truncated to at most max_chars characters"""
+        full_path = self._resolve(file_path)
+        if full_path is None:
+            return None
         
-        if not full_path.exists():
+        try:
+            file_stat = full_path.stat()
+        except FileNotFoundError:
             logger.warning("File not found", path=str(full_path))
             return None
         
-        if not full_path.is_file():
+        if not stat.S_ISREG(file_stat.st_mode):
             logger.warning("Path is not a file", path=str(full_path))
             return None
         
+        # A changed mtime or size yields a new key, so stale content is never served
+        key = (str(full_path), file_stat.st_mtime_ns, file_stat.st_size, max_chars)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        
+        # Every character takes at least one byte, so smaller files are read whole
+        if file_stat.st_size > max_chars:
+            logger.warning("File exceeds read limit, truncating", path=str(full_path),
+                           size=file_stat.st_size, max_chars=max_chars)
+        
         try:
-            async with aiofiles.open(full_path, 'r', encoding='utf-8') as f:
-                return await f.read()
+            content = await self._run_io(_read_text, full_path, max_chars)
+            self._cache[key] = content
+            return content
         except Exception as e:
             logger.error("Failed to read file", path=str(full_path), error=str(e))
             return None
     
     async def write_file(self, file_path: str, content: str) -> bool:
         """Write a file to workspace"""
-        full_path = self.workspace_path / file_path.lstrip("/")
-        
-        # Create parent directories
-        full_path.parent.mkdir(parents=True, exist_ok=True)
+        full_path = self._resolve(file_path)
+        if full_path is None:
+            return False
         
         try:
-            async with aiofiles.open(full_path, 'w', encoding='utf-8') as f:
-                await f.write(content)
+            await self._run_io(_write_text, full_path, content)
+            self._invalidate(full_path)
             logger.info("File written", path=str(full_path))
             return True
         except Exception as e:
@@ -59,26 +125,31 @@ class WorkspaceManager:
     
     async def list_files(self, directory: str = "", recursive: bool = False) -> List[str]:
         """List files in workspace"""
-        dir_path = self.workspace_path / directory.lstrip("/")
-        
-        if not dir_path.exists():
+        dir_path = self._resolve(directory)
+        if dir_path is None or not dir_path.exists():
             return []
         
-        files = []
-        if recursive:
-            for file_path in dir_path.rglob("*"):
-                if file_path.is_file():
-                    files.append(str(file_path.relative_to(self.workspace_path)))
-        else:
-            for file_path in dir_path.iterdir():
-                if file_path.is_file():
-                    files.append(str(file_path.relative_to(self.workspace_path)))
+        return await self._run_io(self._list_files_sync, str(dir_path), recursive)
+    
+    def _list_files_sync(self, directory: str, recursive: bool) -> List[str]:
+        """Walk a directory with os.scandir, whose entries answer is_file/is_dir without extra stats"""
+        root = str(self._root)
+        
+        def walk(path: str):
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        yield entry.path
+                    elif recursive and entry.is_dir(follow_symlinks=False):
+                        yield from walk(entry.path)
         
-        return files
+        return [os.path.relpath(path, root) for path in walk(directory)]
     
     async def get_file_info(self, file_path: str) -> Optional[Dict[str, Any]]:
         """Get file information"""
-        full_path = self.workspace_path / file_path.lstrip("/")
+        full_path = self._resolve(file_path)
+        if full_path is None:
+            return None
         
         if not full_path.exists():
             return None
@@ -94,7 +165,9 @@ class WorkspaceManager:
     
     async def delete_file(self, file_path: str) -> bool:
         """Delete a file"""
-        full_path = self.workspace_path / file_path.lstrip("/")
+        full_path = self._resolve(file_path)
+        if full_path is None or full_path == self._root:
+            return False
         
         if not full_path.exists():
             return False
@@ -106,6 +179,7 @@ class WorkspaceManager:
                 # For directories, use shutil
                 import shutil
                 shutil.rmtree(full_path)
+            self._invalidate(full_path)
             logger.info("File deleted", path=str(full_path))
             return True
         except Exception as e:
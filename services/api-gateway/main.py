@@ -1,14 +1,22 @@
 """
 API Gateway - Unified API interface for all services
 """
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional
 import structlog
 import httpx
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+from starlette.background import BackgroundTask
+
+from response_cache import CachedBody, ResponseCache
 
 # Configure structured logging
 structlog.configure(
@@ -43,12 +51,86 @@ QDRANT_URL = os.getenv("QDRANT_URL", "http://qdrant:6333")
 VSCODE_EXTENSION_URL = os.getenv("VSCODE_EXTENSION_URL", "http://vscode-extension-server:3003")
 TERMINAL_AI_URL = os.getenv("TERMINAL_AI_URL", "http://terminal-ai:8004")
 
+# Timeouts for upstream calls that don't set their own
+DEFAULT_TIMEOUT = 5.0
+HEALTH_TIMEOUT = 5.0
+
+# Upstream headers forwarded with proxied bodies; the raw bytes are passed
+# through still encoded, so Content-Encoding has to travel with them, and
+# X-Accel-Buffering keeps nginx from holding back streamed answers
+PASSTHROUGH_HEADERS = frozenset({
+    "content-type", "content-length", "content-encoding", "cache-control", "x-accel-buffering"
+})
+
+# Per-client rate limits. Counters live in process memory unless a shared
+# store (e.g. redis://redis:6379) is configured for multi-worker deployments
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+LLM_RATE_LIMIT = os.getenv("LLM_RATE_LIMIT", "5/minute")
+CHEAP_RATE_LIMIT = os.getenv("CHEAP_RATE_LIMIT", "60/second")
+
+# In-flight request caps per upstream, on top of the rate limits. A request
+# that can't get a slot within UPSTREAM_QUEUE_TIMEOUT is answered with a 503.
+UPSTREAM_LIMITS = {
+    "agent": asyncio.Semaphore(int(os.getenv("AGENT_CONCURRENCY", "8"))),
+    "vscode": asyncio.Semaphore(int(os.getenv("VSCODE_CONCURRENCY", "32"))),
+    # Pulls saturate the same disk and link, so they run one at a time
+    "ollama_pull": asyncio.Semaphore(1),
+}
+UPSTREAM_QUEUE_TIMEOUT = 30.0
+
+# Freshness windows (seconds) for cached read-only upstream GETs
+RULES_CACHE_TTL = 30
+MODELS_CACHE_TTL = 30
+INDEX_STATUS_CACHE_TTL = 5
+
+rules_cache = ResponseCache(ttl=RULES_CACHE_TTL)
+models_cache = ResponseCache(ttl=MODELS_CACHE_TTL)
+index_status_cache = ResponseCache(ttl=INDEX_STATUS_CACHE_TTL)
+
+# (service name, probe URL) pairs checked by /health
+HEALTH_TARGETS = [
+    ("agent-orchestrator", f"{AGENT_ORCHESTRATOR_URL}/health"),
+    ("rules-engine", f"{RULES_ENGINE_URL}/health"),
+    ("mcp-github", f"{MCP_GITHUB_URL}/health"),
+    ("mcp-gitlab", f"{MCP_GITLAB_URL}/health"),
+    ("ollama", f"{OLLAMA_URL}/api/tags"),
+    ("code-indexer", f"{CODE_INDEXER_URL}/health"),
+    ("rag-chat", f"{RAG_CHAT_URL}/health"),
+    ("qdrant", f"{QDRANT_URL}/"),
+    ("vscode-extension", f"{VSCODE_EXTENSION_URL}/health"),
+    ("terminal-ai", f"{TERMINAL_AI_URL}/health"),
+]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open one pooled upstream client for the process and close it on shutdown"""
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+        timeout=httpx.Timeout(300.0, connect=5.0)
+    )
+    logger.info("API Gateway started")
+    yield
+    await app.state.http.aclose()
+
+
 app = FastAPI(
     title="Dev Stack API Gateway",
     description="Unified API Gateway for AI Development Stack",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+def client_address(request: Request) -> str:
+    """Rate-limit key: the client address Nginx forwards, else the peer address"""
+    return request.headers.get("x-real-ip") or get_remote_address(request)
+
+
+limiter = Limiter(key_func=client_address, storage_uri=RATE_LIMIT_STORAGE_URI)
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -60,21 +142,17 @@ app.add_middleware(
 
 @app.get("/health")
 @app.get("/api/health")
-async def health_check():
+@limiter.limit(CHEAP_RATE_LIMIT)
+async def health_check(request: Request):
     """Health check for all services"""
-    services = {
-        "api-gateway": "healthy",
-        "agent-orchestrator": await check_service(f"{AGENT_ORCHESTRATOR_URL}/health"),
-        "rules-engine": await check_service(f"{RULES_ENGINE_URL}/health"),
-        "mcp-github": await check_service(f"{MCP_GITHUB_URL}/health"),
-        "mcp-gitlab": await check_service(f"{MCP_GITLAB_URL}/health"),
-        "ollama": await check_service(f"{OLLAMA_URL}/api/tags"),
-        "code-indexer": await check_service(f"{CODE_INDEXER_URL}/health"),
-        "rag-chat": await check_service(f"{RAG_CHAT_URL}/health"),
-        "qdrant": await check_service(f"{QDRANT_URL}/"),
-        "vscode-extension": await check_service(f"{VSCODE_EXTENSION_URL}/health"),
-        "terminal-ai": await check_service(f"{TERMINAL_AI_URL}/health"),
-    }
+    # Probe every service at once so the check takes the slowest probe, not the sum
+    statuses = await asyncio.gather(
+        *(check_service(url) for _, url in HEALTH_TARGETS),
+        return_exceptions=True
+    )
+    services = {"api-gateway": "healthy"}
+    for (name, _), status in zip(HEALTH_TARGETS, statuses):
+        services[name] = "unreachable" if isinstance(status, BaseException) else status
     
     all_healthy = all(status == "healthy" for status in services.values())
     
@@ -87,127 +165,195 @@ async def health_check():
 async def check_service(url: str) -> str:
     """Check if a service is healthy"""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(url)
-            # Accept 200-299 status codes as healthy
-            if 200 <= response.status_code < 300:
-                return "healthy"
-            return "unhealthy"
+        response = await app.state.http.get(url, timeout=HEALTH_TIMEOUT)
+        # Accept 200-299 status codes as healthy
+        if 200 <= response.status_code < 300:
+            return "healthy"
+        return "unhealthy"
     except Exception as e:
         # Log the error for debugging (but don't fail the health check)
         logger.debug(f"Service check failed for {url}: {str(e)}")
         return "unreachable"
 
 
+async def proxy(method: str, url: str, limit: Optional[str] = None, **kwargs: Any) -> StreamingResponse:
+    """
+    Forward a request upstream and stream the reply back without decoding it
+    
+    With limit set, the request holds a slot of that UPSTREAM_LIMITS semaphore
+    until the upstream response has been fully relayed.
+    """
+    semaphore = UPSTREAM_LIMITS[limit] if limit else None
+    if semaphore is not None:
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=UPSTREAM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Upstream saturated, shedding request", upstream=limit, url=url)
+            raise HTTPException(status_code=503, detail=f"{limit} upstream is busy", headers={"Retry-After": "5"})
+    
+    client = app.state.http
+    try:
+        upstream = await client.send(client.build_request(method, url, **kwargs), stream=True)
+    except BaseException:
+        if semaphore is not None:
+            semaphore.release()
+        raise
+    
+    finished = False
+    
+    async def finish():
+        # Runs from the background task, or from the body if relaying failed
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        try:
+            await upstream.aclose()
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+    
+    async def body():
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        except BaseException:
+            await finish()
+            raise
+    
+    return StreamingResponse(
+        body(),
+        status_code=upstream.status_code,
+        headers={k: v for k, v in upstream.headers.items() if k.lower() in PASSTHROUGH_HEADERS},
+        background=BackgroundTask(finish)
+    )
+
+
+def relay_encoding(request: Request) -> Dict[str, str]:
+    """
+    The client's Accept-Encoding, so an upstream only compresses for clients that can decode it
+    
+    proxy relays bodies and their Content-Encoding as they arrive, so the
+    upstream must not be offered encodings the client never asked for.
+    """
+    return {"accept-encoding": request.headers.get("accept-encoding", "identity")}
+
+
+async def relay_body(request: Request) -> Dict[str, Any]:
+    """Request arguments that forward the client's body bytes and content type untouched"""
+    return {
+        "content": await request.body(),
+        "headers": {
+            "content-type": request.headers.get("content-type", "application/json"),
+            **relay_encoding(request)
+        }
+    }
+
+
+async def cached_get(cache: ResponseCache, url: str, params: Dict[str, str]) -> Response:
+    """GET an idempotent upstream resource through a response cache"""
+    async def fetch() -> CachedBody:
+        response = await app.state.http.get(url, params=params, timeout=DEFAULT_TIMEOUT)
+        return CachedBody(
+            response.content,
+            response.status_code,
+            response.headers.get("content-type", "application/json")
+        )
+    
+    body, stale = await cache.get_or_fetch(tuple(sorted(params.items())), fetch)
+    return Response(
+        content=body.content,
+        status_code=body.status_code,
+        media_type=body.media_type,
+        headers={"X-Cache": "stale"} if stale else None
+    )
+
+
 # Proxy endpoints for agent orchestrator
 @app.post("/api/generate")
+@limiter.limit(LLM_RATE_LIMIT)
 async def generate_code(request: Request):
     """Proxy to agent orchestrator generate endpoint"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{AGENT_ORCHESTRATOR_URL}/generate",
-            json=body,
-            timeout=300.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{AGENT_ORCHESTRATOR_URL}/generate",
+        limit="agent",
+        timeout=300.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/review")
 async def review_code(request: Request):
     """Proxy to agent orchestrator review endpoint"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{AGENT_ORCHESTRATOR_URL}/review",
-            json=body,
-            timeout=120.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{AGENT_ORCHESTRATOR_URL}/review",
+        limit="agent",
+        timeout=120.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/debug")
 async def debug_code(request: Request):
     """Proxy to agent orchestrator debug endpoint"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{AGENT_ORCHESTRATOR_URL}/debug",
-            json=body,
-            timeout=300.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{AGENT_ORCHESTRATOR_URL}/debug",
+        limit="agent",
+        timeout=300.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/refactor")
+@limiter.limit(LLM_RATE_LIMIT)
 async def refactor_code(request: Request):
     """Proxy to agent orchestrator refactor endpoint"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{AGENT_ORCHESTRATOR_URL}/refactor",
-            json=body,
-            timeout=300.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{AGENT_ORCHESTRATOR_URL}/refactor",
+        limit="agent",
+        timeout=300.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/task")
+@limiter.limit(LLM_RATE_LIMIT)
 async def execute_task(request: Request):
     """Proxy to agent orchestrator task endpoint"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{AGENT_ORCHESTRATOR_URL}/task",
-            json=body,
-            timeout=300.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{AGENT_ORCHESTRATOR_URL}/task",
+        limit="agent",
+        timeout=300.0,
+        **await relay_body(request)
+    )
 
 
 # Rules engine endpoints
 @app.get("/api/rules")
 async def get_rules(language: Optional[str] = None):
     """Get coding rules"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{RULES_ENGINE_URL}/rules",
-            params={"language": language} if language else {}
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await cached_get(
+        rules_cache,
+        f"{RULES_ENGINE_URL}/rules",
+        {"language": language} if language else {}
+    )
 
 
 # Ollama endpoints
 @app.get("/api/models")
-async def list_models():
+@limiter.limit(CHEAP_RATE_LIMIT)
+async def list_models(request: Request):
     """List available Ollama models"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{OLLAMA_URL}/api/tags")
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await cached_get(models_cache, f"{OLLAMA_URL}/api/tags", {})
 
 
 @app.post("/api/models/pull")
+@limiter.limit(LLM_RATE_LIMIT)
 async def pull_model(request: Request):
     """Pull an Ollama model"""
     body = await request.json()
@@ -215,75 +361,53 @@ async def pull_model(request: Request):
     if not model_name:
         raise HTTPException(status_code=400, detail="model parameter required")
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{OLLAMA_URL}/api/pull",
-            json={"name": model_name},
-            timeout=3600.0  # Model pulls can take a long time
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{OLLAMA_URL}/api/pull",
+        limit="ollama_pull",
+        json={"name": model_name},
+        timeout=3600.0  # Model pulls can take a long time
+    )
 
 
 # Code Indexing endpoints
 @app.post("/api/index")
 async def index_codebase(request: Request):
     """Index codebase into Qdrant"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{CODE_INDEXER_URL}/index",
-            json=body,
-            timeout=300.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{CODE_INDEXER_URL}/index",
+        timeout=300.0,
+        **await relay_body(request)
+    )
 
 
 @app.get("/api/index/status")
 async def get_index_status(project_path: Optional[str] = None):
     """Get indexing status"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{CODE_INDEXER_URL}/index/status",
-            params={"project_path": project_path} if project_path else {}
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await cached_get(
+        index_status_cache,
+        f"{CODE_INDEXER_URL}/index/status",
+        {"project_path": project_path} if project_path else {}
+    )
 
 
 @app.delete("/api/index")
 async def clear_index():
     """Clear codebase index"""
-    async with httpx.AsyncClient() as client:
-        response = await client.delete(f"{CODE_INDEXER_URL}/index")
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy("DELETE", f"{CODE_INDEXER_URL}/index", timeout=DEFAULT_TIMEOUT)
 
 
 # RAG Chat endpoints
 @app.post("/api/chat")
 async def rag_chat(request: Request):
     """Chat with codebase using RAG"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{RAG_CHAT_URL}/chat",
-            json=body,
-            timeout=300.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{RAG_CHAT_URL}/chat",
+        timeout=300.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/search")
@@ -294,168 +418,125 @@ async def search_codebase(request: Request):
     if not query:
         raise HTTPException(status_code=400, detail="query parameter required")
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{RAG_CHAT_URL}/search",
-            json=body
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{RAG_CHAT_URL}/search",
+        timeout=DEFAULT_TIMEOUT,
+        # Already validated; relay the original bytes rather than re-encoding
+        **await relay_body(request)
+    )
 
 
 # Code explanation endpoints
 @app.post("/api/explain")
 async def explain_code(request: Request):
     """Explain code in detail"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{AGENT_ORCHESTRATOR_URL}/explain",
-            json=body,
-            timeout=120.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{AGENT_ORCHESTRATOR_URL}/explain",
+        limit="agent",
+        timeout=120.0,
+        **await relay_body(request)
+    )
 
 
 # Test generation endpoints
 @app.post("/api/generate-tests")
+@limiter.limit(LLM_RATE_LIMIT)
 async def generate_tests(request: Request):
     """Generate unit tests for code"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{AGENT_ORCHESTRATOR_URL}/generate-tests",
-            json=body,
-            timeout=300.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{AGENT_ORCHESTRATOR_URL}/generate-tests",
+        limit="agent",
+        timeout=300.0,
+        **await relay_body(request)
+    )
 
 
 # Documentation generation endpoints
 @app.post("/api/generate-docs")
+@limiter.limit(LLM_RATE_LIMIT)
 async def generate_docs(request: Request):
     """Generate documentation for code"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{AGENT_ORCHESTRATOR_URL}/generate-docs",
-            json=body,
-            timeout=300.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{AGENT_ORCHESTRATOR_URL}/generate-docs",
+        limit="agent",
+        timeout=300.0,
+        **await relay_body(request)
+    )
 
 
 # VS Code Extension endpoints
 @app.post("/api/completion")
 async def code_completion(request: Request):
     """Get code completion suggestions"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{VSCODE_EXTENSION_URL}/api/completion",
-            json=body,
-            timeout=30.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{VSCODE_EXTENSION_URL}/api/completion",
+        limit="vscode",
+        timeout=30.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/inline-edit")
 async def inline_edit(request: Request):
     """Inline code editing"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{VSCODE_EXTENSION_URL}/api/inline-edit",
-            json=body,
-            timeout=120.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{VSCODE_EXTENSION_URL}/api/inline-edit",
+        limit="vscode",
+        timeout=120.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/explain-error")
 async def explain_error(request: Request):
     """Explain error messages"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{VSCODE_EXTENSION_URL}/api/explain-error",
-            json=body,
-            timeout=120.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{VSCODE_EXTENSION_URL}/api/explain-error",
+        limit="vscode",
+        timeout=120.0,
+        **await relay_body(request)
+    )
 
 
 # Terminal AI endpoints
 @app.post("/api/terminal/command")
 async def suggest_command(request: Request):
     """Suggest terminal command"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{TERMINAL_AI_URL}/api/command",
-            json=body,
-            timeout=30.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{TERMINAL_AI_URL}/api/command",
+        timeout=30.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/terminal/explain")
 async def explain_command(request: Request):
     """Explain terminal command"""
-    body = await request.json()
-    command = body.get("command")
-    if not command:
-        raise HTTPException(status_code=400, detail="command parameter required")
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{TERMINAL_AI_URL}/api/explain-command",
-            params={"command": command},
-            timeout=30.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{TERMINAL_AI_URL}/api/explain-command",
+        timeout=30.0,
+        **await relay_body(request)
+    )
 
 
 @app.post("/api/terminal/fix")
 async def fix_command(request: Request):
     """Fix failed command"""
-    body = await request.json()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{TERMINAL_AI_URL}/api/fix-command",
-            json=body,
-            timeout=30.0
-        )
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+    return await proxy(
+        "POST",
+        f"{TERMINAL_AI_URL}/api/fix-command",
+        timeout=30.0,
+        **await relay_body(request)
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+"""
+Response Cache - Short-lived cache of idempotent upstream GET responses
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, NamedTuple, Tuple
+
+import httpx
+import structlog
+from cachetools import LRUCache, TTLCache
+
+logger = structlog.get_logger()
+
+RESPONSE_CACHE_SIZE = 256
+
+
+class CachedBody(NamedTuple):
+    """Raw upstream reply, replayed as-is on a cache hit"""
+    content: bytes
+    status_code: int
+    media_type: str
+
+
+class ResponseCache:
+    """
+    TTL cache of upstream bodies with a stale fallback
+
+    Fresh entries expire after ``ttl`` seconds. The last successful body for
+    each key is kept separately so it can still be served, marked stale,
+    when the upstream is failing.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = RESPONSE_CACHE_SIZE):
+        self._fresh: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._last_good: LRUCache = LRUCache(maxsize=maxsize)
+        self._inflight: Dict[Hashable, "asyncio.Task[Tuple[CachedBody, bool]]"] = {}
+
+    async def get_or_fetch(self, key: Hashable,
+                           fetch: Callable[[], Awaitable[CachedBody]]) -> Tuple[CachedBody, bool]:
+        """
+        Return (body, stale) for key, fetching on a miss
+
+        Concurrent misses for the same key share one upstream request.
+        """
+        cached = self._fresh.get(key)
+        if cached is not None:
+            return cached, False
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one cancelled caller doesn't cancel the shared fetch
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Hashable,
+                     fetch: Callable[[], Awaitable[CachedBody]]) -> Tuple[CachedBody, bool]:
+        try:
+            body = await fetch()
+        except httpx.HTTPError as e:
+            stale = self._last_good.get(key)
+            if stale is None:
+                raise
+            logger.warning("Upstream unreachable, serving stale response", error=str(e))
+            return stale, True
+
+        if 200 <= body.status_code < 300:
+            self._fresh[key] = body
+            self._last_good[key] = body
+            return body, False
+
+        stale = self._last_good.get(key) if body.status_code >= 500 else None
+        if stale is not None:
+            logger.warning("Upstream failed, serving stale response", status_code=body.status_code)
+            return stale, True
+        return body, False
@@ -1,45 +1,163 @@
 """
 Code Parser - Parses code files into chunks for indexing
 """
+import os
+import re
+from bisect import bisect_right
 from pathlib import Path
-from typing import List, Dict, Any, Iterator
+from typing import List, Dict, Any, Iterator, Optional
 import structlog
+import tiktoken
+import tree_sitter_javascript
+import tree_sitter_python
+import tree_sitter_typescript
+from tree_sitter import Language, Node, Parser
 
 logger = structlog.get_logger()
 
+# Language by file extension
+_EXT_TO_LANG = {
+    '.py': 'python',
+    '.js': 'javascript',
+    '.jsx': 'javascript',
+    '.ts': 'typescript',
+    '.tsx': 'typescript',
+    '.java': 'java',
+    '.go': 'go',
+    '.rs': 'rust',
+    '.cpp': 'cpp',
+    '.c': 'c',
+    '.h': 'c',
+    '.hpp': 'cpp',
+    '.cs': 'csharp',
+    '.rb': 'ruby',
+    '.php': 'php',
+    '.swift': 'swift',
+    '.kt': 'kotlin',
+    '.scala': 'scala',
+    '.clj': 'clojure',
+    '.sh': 'bash',
+    '.bash': 'bash',
+    '.zsh': 'bash',
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.json': 'json',
+    '.toml': 'toml',
+    '.md': 'markdown',
+    '.rst': 'rst'
+}
+
+# Chunk sizes in tokens: small neighbouring chunks are packed up to the target,
+# and any chunk over the max is split at blank lines with a small overlap
+TARGET_CHUNK_TOKENS = 768
+MAX_CHUNK_TOKENS = 1024
+CHUNK_OVERLAP_TOKENS = 64
+TOKEN_ENCODING = "cl100k_base"
+
+# Grammar loaders by name; TSX needs its own grammar on top of TypeScript
+_GRAMMARS = {
+    'python': tree_sitter_python.language,
+    'javascript': tree_sitter_javascript.language,
+    'typescript': tree_sitter_typescript.language_typescript,
+    'tsx': tree_sitter_typescript.language_tsx,
+}
+
+# Syntax node types emitted as chunks, mapped to the chunk type stored with them
+_JS_CHUNK_NODE_TYPES = {
+    'function_declaration': 'function',
+    'generator_function_declaration': 'function',
+    'class_declaration': 'class',
+    'lexical_declaration': 'variable',
+    'variable_declaration': 'variable',
+}
+
+_CHUNK_NODE_TYPES = {
+    'python': {
+        'function_definition': 'function',
+        'class_definition': 'class',
+    },
+    'javascript': _JS_CHUNK_NODE_TYPES,
+    'typescript': {
+        **_JS_CHUNK_NODE_TYPES,
+        'abstract_class_declaration': 'class',
+        'interface_declaration': 'type',
+        'type_alias_declaration': 'type',
+        'enum_declaration': 'type',
+    },
+}
+
+# Fallback chunking when a grammar can't be loaded: one chunk per top-level
+# definition, found with a single regex scan. Python decorators stay attached.
+_DEF_RES = {
+    'python': re.compile(r'^(?:@.*\n)*(?P<kind>(?:async[ \t]+)?def|class)\b', re.M),
+    'javascript': re.compile(
+        r'^(?:export[ \t]+(?:default[ \t]+)?)?(?:async[ \t]+)?(?P<kind>function|class|const|let|var)\b', re.M
+    ),
+}
+_DEF_RES['typescript'] = _DEF_RES['javascript']
+
+_DEF_KIND_TYPES = {
+    'function': 'function', 'def': 'function', 'class': 'class',
+    'const': 'variable', 'let': 'variable', 'var': 'variable',
+}
+
+# Nodes that wrap a definition, and the field holding the wrapped node
+_WRAPPER_FIELDS = {
+    'decorated_definition': 'definition',
+    'export_statement': 'declaration',
+}
+
 
 class CodeParser:
     """Parses code files into semantic chunks"""
     
     # Supported file extensions
-    CODE_EXTENSIONS = {
+    CODE_EXTENSIONS = frozenset({
         '.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.go', '.rs',
         '.cpp', '.c', '.h', '.hpp', '.cs', '.rb', '.php', '.swift',
         '.kt', '.scala', '.clj', '.sh', '.bash', '.zsh', '.yaml', '.yml',
         '.json', '.toml', '.ini', '.cfg', '.conf', '.md', '.rst'
-    }
+    })
     
-    # Files/directories to ignore
-    IGNORE_PATTERNS = {
+    # Directories never descended into
+    IGNORE_DIRS = frozenset({
         '.git', '.svn', '.hg', '__pycache__', 'node_modules', '.venv',
         'venv', 'env', '.env', 'dist', 'build', '.pytest_cache',
         '.mypy_cache', '.ruff_cache', 'target', 'bin', 'obj', '.idea',
-        '.vscode', '.vs', '*.pyc', '*.pyo', '*.pyd', '*.so', '*.egg'
-    }
+        '.vscode', '.vs'
+    })
+    
+    def __init__(self):
+        self._parsers: Dict[str, Optional[Parser]] = {}
+        self._encoding: Optional[tiktoken.Encoding] = None
     
     def find_code_files(self, root: Path) -> Iterator[Path]:
         """Find all code files in directory"""
         if not root.exists() or not root.is_dir():
             return
         
-        for item in root.rglob('*'):
-            # Skip ignored patterns
-            if any(pattern in str(item) for pattern in self.IGNORE_PATTERNS):
+        # Walk with scandir so ignored directories are pruned before they are
+        # entered and the DirEntry type info spares a stat per file
+        ignore_dirs = self.IGNORE_DIRS
+        code_extensions = self.CODE_EXTENSIONS
+        pending = [str(root)]
+        while pending:
+            try:
+                entries = os.scandir(pending.pop())
+            except OSError as e:
+                logger.debug("Skipping unreadable directory", error=str(e))
                 continue
             
-            # Check if it's a code file
-            if item.is_file() and item.suffix in self.CODE_EXTENSIONS:
-                yield item
+            with entries:
+                for entry in entries:
+                    name = entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if name not in ignore_dirs:
+                            pending.append(entry.path)
+                    elif entry.is_file():
+                        dot = name.rfind('.')
+                        if dot > 0 and name[dot:] in code_extensions:
+                            yield Path(entry.path)
     
     def parse_file(self, file_path: Path) -> List[Dict[str, Any]]:
         """Parse a code file into chunks"""
@@ -49,18 +167,20 @@ class CodeParser:
             
             # Parse based on language
             if language == 'python':
-                return self._parse_python(content, file_path)
+                chunks = self._parse_python(content, file_path)
             elif language in ['javascript', 'typescript']:
-                return self._parse_javascript(content, file_path, language)
+                chunks = self._parse_javascript(content, file_path, language)
             elif language == 'java':
-                return self._parse_java(content, file_path)
+                chunks = self._parse_java(content, file_path)
             elif language == 'go':
-                return self._parse_go(content, file_path)
+                chunks = self._parse_go(content, file_path)
             elif language == 'rust':
-                return self._parse_rust(content, file_path)
+                chunks = self._parse_rust(content, file_path)
             else:
                 # Generic parsing for other languages
-                return self._parse_generic(content, file_path, language)
+                chunks = self._parse_generic(content, file_path, language)
+            
+            return self._size_chunks(chunks)
         
         except Exception as e:
             logger.warning("Failed to parse file", file=str(file_path), error=str(e))
@@ -68,167 +188,190 @@ class CodeParser:
     
     def _detect_language(self, file_path: Path) -> str:
         """Detect programming language from file extension"""
-        ext_to_lang = {
-            '.py': 'python',
-            '.js': 'javascript',
-            '.jsx': 'javascript',
-            '.ts': 'typescript',
-            '.tsx': 'typescript',
-            '.java': 'java',
-            '.go': 'go',
-            '.rs': 'rust',
-            '.cpp': 'cpp',
-            '.c': 'c',
-            '.h': 'c',
-            '.hpp': 'cpp',
-            '.cs': 'csharp',
-            '.rb': 'ruby',
-            '.php': 'php',
-            '.swift': 'swift',
-            '.kt': 'kotlin',
-            '.scala': 'scala',
-            '.clj': 'clojure',
-            '.sh': 'bash',
-            '.bash': 'bash',
-            '.zsh': 'bash',
-            '.yaml': 'yaml',
-            '.yml': 'yaml',
-            '.json': 'json',
-            '.toml': 'toml',
-            '.md': 'markdown',
-            '.rst': 'rst'
-        }
-        return ext_to_lang.get(file_path.suffix, 'unknown')
+        return _EXT_TO_LANG.get(file_path.suffix, 'unknown')
     
     def _parse_python(self, content: str, file_path: Path) -> List[Dict[str, Any]]:
-        """Parse Python file into functions, classes, and modules"""
-        chunks = []
-        lines = content.split('\n')
+        """Parse Python file into functions and classes"""
+        return self._parse_tree(content, 'python', 'python')
+    
+    def _parse_javascript(self, content: str, file_path: Path, language: str) -> List[Dict[str, Any]]:
+        """Parse JavaScript/TypeScript file"""
+        grammar = 'tsx' if file_path.suffix == '.tsx' else language
+        return self._parse_tree(content, language, grammar)
+    
+    def _parse_tree(self, content: str, language: str, grammar: str) -> List[Dict[str, Any]]:
+        """Chunk a file into its outermost definitions using a tree-sitter parse"""
+        parser = self._get_parser(grammar)
+        if parser is None:
+            return self._parse_definitions(content, language)
         
-        current_chunk = None
-        current_indent = 0
-        chunk_start = 0
+        source = content.encode('utf-8')
+        tree = parser.parse(source)
+        node_types = _CHUNK_NODE_TYPES[language]
         
-        for i, line in enumerate(lines, 1):
-            stripped = line.lstrip()
-            if not stripped or stripped.startswith('#'):
+        chunks = []
+        # Depth-first in source order; a matched definition is emitted whole
+        # and not descended into, so nested functions and methods stay with it
+        stack = list(reversed(tree.root_node.children))
+        while stack:
+            node = stack.pop()
+            chunk_type = self._chunk_type(node, node_types)
+            if chunk_type is None:
+                stack.extend(reversed(node.children))
                 continue
-            
-            indent = len(line) - len(stripped)
-            
-            # Function or class definition
-            if stripped.startswith(('def ', 'class ', 'async def ')):
-                # Save previous chunk
-                if current_chunk:
-                    chunks.append({
-                        'content': '\n'.join(lines[chunk_start-1:i-1]),
-                        'start_line': chunk_start,
-                        'end_line': i-1,
-                        'type': current_chunk,
-                        'language': 'python'
-                    })
-                
-                # Start new chunk
-                current_chunk = 'function' if 'def' in stripped else 'class'
-                chunk_start = i
-                current_indent = indent
-            
-            # End of chunk (dedent)
-            elif current_chunk and indent <= current_indent and stripped:
-                if current_chunk:
-                    chunks.append({
-                        'content': '\n'.join(lines[chunk_start-1:i]),
-                        'start_line': chunk_start,
-                        'end_line': i,
-                        'type': current_chunk,
-                        'language': 'python'
-                    })
-                current_chunk = None
-        
-        # Add remaining chunk
-        if current_chunk:
             chunks.append({
-                'content': '\n'.join(lines[chunk_start-1:]),
-                'start_line': chunk_start,
-                'end_line': len(lines),
-                'type': current_chunk,
-                'language': 'python'
+                'content': source[node.start_byte:node.end_byte].decode('utf-8', errors='ignore'),
+                'start_line': node.start_point[0] + 1,
+                'end_line': node.end_point[0] + 1,
+                'type': chunk_type,
+                'language': language
             })
         
         # If no chunks found, add entire file
-        if not chunks:
+        return chunks or [self._file_chunk(content, language)]
+    
+    def _parse_definitions(self, content: str, language: str) -> List[Dict[str, Any]]:
+        """Chunk a file at its top-level definitions with a regex scan, without a parse tree"""
+        matches = list(_DEF_RES[language].finditer(content))
+        if not matches:
+            return [self._file_chunk(content, language)]
+        
+        newlines = [m.start() for m in re.finditer('\n', content)]
+        ends = [m.start() for m in matches[1:]] + [len(content)]
+        chunks = []
+        for match, end in zip(matches, ends):
+            text = content[match.start():end].rstrip()
+            kind = match.group('kind').split()[-1]
             chunks.append({
-                'content': content,
-                'start_line': 1,
-                'end_line': len(lines),
-                'type': 'file',
-                'language': 'python'
+                'content': text,
+                'start_line': bisect_right(newlines, match.start()) + 1,
+                'end_line': bisect_right(newlines, match.start() + len(text) - 1) + 1,
+                'type': _DEF_KIND_TYPES[kind],
+                'language': language
             })
-        
         return chunks
     
-    def _parse_javascript(self, content: str, file_path: Path, language: str) -> List[Dict[str, Any]]:
-        """Parse JavaScript/TypeScript file"""
-        chunks = []
-        lines = content.split('\n')
+    def _file_chunk(self, content: str, language: str) -> Dict[str, Any]:
+        """A single chunk holding the whole file"""
+        return {
+            'content': content,
+            'start_line': 1,
+            'end_line': content.count('\n') + 1,
+            'type': 'file',
+            'language': language
+        }
+    
+    def _chunk_type(self, node: Node, node_types: Dict[str, str]) -> Optional[str]:
+        """Chunk type for a definition node, or None if the node isn't one"""
+        field = _WRAPPER_FIELDS.get(node.type)
+        if field is not None:
+            # Decorators and export keywords belong to the chunk they wrap
+            inner = node.child_by_field_name(field)
+            return node_types.get(inner.type) if inner is not None else None
+        return node_types.get(node.type)
+    
+    def _size_chunks(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Pack small consecutive chunks and split oversized ones, recording token_count"""
+        encoding = self._get_encoding()
+        counts = [len(tokens) for tokens in encoding.encode_ordinary_batch([c['content'] for c in chunks])]
         
-        # Simple parsing: look for function/class definitions
-        current_chunk = None
-        chunk_start = 0
-        brace_count = 0
+        sized = []
+        packed = None
+        for chunk, count in zip(chunks, counts):
+            if count > MAX_CHUNK_TOKENS:
+                if packed:
+                    sized.append(packed)
+                    packed = None
+                sized.extend(self._split_chunk(chunk))
+            elif packed and packed['token_count'] + count <= TARGET_CHUNK_TOKENS:
+                packed['content'] += '\n\n' + chunk['content']
+                packed['end_line'] = chunk['end_line']
+                packed['token_count'] += count
+                if packed['type'] != chunk['type']:
+                    packed['type'] = 'code'
+            else:
+                if packed:
+                    sized.append(packed)
+                packed = {**chunk, 'token_count': count}
+        if packed:
+            sized.append(packed)
+        
+        return sized
+    
+    def _split_chunk(self, chunk: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Split an oversized chunk into overlapping pieces, cutting at blank lines where possible"""
+        encoding = self._get_encoding()
+        lines = chunk['content'].split('\n')
+        # +1 for the newline each line loses in the split
+        counts = [len(tokens) + 1 for tokens in encoding.encode_ordinary_batch(lines)]
+        first_line = chunk['start_line']
         
-        for i, line in enumerate(lines, 1):
-            stripped = line.strip()
+        pieces = []
+        start = 0
+        while start < len(lines):
+            total = 0
+            end = start
+            last_blank = None
+            while end < len(lines) and total + counts[end] <= MAX_CHUNK_TOKENS:
+                total += counts[end]
+                if not lines[end].strip():
+                    last_blank = end
+                end += 1
             
-            # Function or class definition
-            if any(keyword in stripped for keyword in ['function ', 'class ', 'const ', 'let ', 'export ', 'async function']):
-                if current_chunk:
-                    chunks.append({
-                        'content': '\n'.join(lines[chunk_start-1:i-1]),
-                        'start_line': chunk_start,
-                        'end_line': i-1,
-                        'type': current_chunk,
-                        'language': language
+            if end == start:
+                # A single line over the budget (minified code): split it by tokens
+                tokens = encoding.encode_ordinary(lines[start])
+                step = MAX_CHUNK_TOKENS - CHUNK_OVERLAP_TOKENS
+                for i in range(0, len(tokens), step):
+                    window = tokens[i:i + MAX_CHUNK_TOKENS]
+                    pieces.append({
+                        **chunk,
+                        'content': encoding.decode(window),
+                        'start_line': first_line + start,
+                        'end_line': first_line + start,
+                        'token_count': len(window)
                     })
-                
-                current_chunk = 'function' if 'function' in stripped else 'class' if 'class' in stripped else 'variable'
-                chunk_start = i
-                brace_count = stripped.count('{') - stripped.count('}')
-            
-            # Track braces
-            brace_count += line.count('{') - line.count('}')
+                start += 1
+                continue
             
-            # End of chunk
-            if current_chunk and brace_count == 0 and '{' in line:
-                chunks.append({
-                    'content': '\n'.join(lines[chunk_start-1:i]),
-                    'start_line': chunk_start,
-                    'end_line': i,
-                    'type': current_chunk,
-                    'language': language
-                })
-                current_chunk = None
-        
-        # Add remaining
-        if current_chunk:
-            chunks.append({
-                'content': '\n'.join(lines[chunk_start-1:]),
-                'start_line': chunk_start,
-                'end_line': len(lines),
-                'type': current_chunk,
-                'language': language
-            })
-        
-        if not chunks:
-            chunks.append({
-                'content': content,
-                'start_line': 1,
-                'end_line': len(lines),
-                'type': 'file',
-                'language': language
+            if end < len(lines) and last_blank is not None and last_blank > start:
+                end = last_blank + 1
+            pieces.append({
+                **chunk,
+                'content': '\n'.join(lines[start:end]),
+                'start_line': first_line + start,
+                'end_line': first_line + end - 1,
+                'token_count': sum(counts[start:end])
             })
+            if end >= len(lines):
+                break
+            
+            # Start the next piece on the trailing lines of this one
+            back = end
+            overlap = 0
+            while back > start + 1 and overlap + counts[back - 1] <= CHUNK_OVERLAP_TOKENS:
+                back -= 1
+                overlap += counts[back]
+            start = back
         
-        return chunks
+        return pieces
+    
+    def _get_encoding(self) -> tiktoken.Encoding:
+        """Get the tokenizer used for chunk sizing, loading it on first use"""
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        return self._encoding
+    
+    def _get_parser(self, grammar: str) -> Optional[Parser]:
+        """Get the tree-sitter parser for a grammar, or None if it can't be loaded"""
+        if grammar not in self._parsers:
+            try:
+                self._parsers[grammar] = Parser(Language(_GRAMMARS[grammar]()))
+            except ValueError as e:
+                # e.g. a grammar built for an incompatible tree-sitter ABI
+                logger.warning("Failed to load grammar, using regex chunking", grammar=grammar, error=str(e))
+                self._parsers[grammar] = None
+        return self._parsers[grammar]
     
     def _parse_java(self, content: str, file_path: Path) -> List[Dict[str, Any]]:
         """Parse Java file"""
@@ -244,21 +387,43 @@ class CodeParser:
     
     def _parse_generic(self, content: str, file_path: Path, language: str) -> List[Dict[str, Any]]:
         """Generic parsing for any language"""
-        # Split into chunks by functions/classes if possible
-        # Otherwise, split by lines with a max chunk size
-        lines = content.split('\n')
+        # Split by lines with a max chunk size, slicing the content between
+        # newline offsets instead of splitting it into lines and re-joining
         max_chunk_size = 100  # lines per chunk
         
         chunks = []
-        for i in range(0, len(lines), max_chunk_size):
-            chunk_lines = lines[i:i+max_chunk_size]
+        start = 0
+        start_line = 1
+        while True:
+            end = start - 1
+            line_count = 0
+            while line_count < max_chunk_size:
+                end = content.find('\n', end + 1)
+                line_count += 1
+                if end < 0:
+                    break
+            
             chunks.append({
-                'content': '\n'.join(chunk_lines),
-                'start_line': i + 1,
-                'end_line': min(i + max_chunk_size, len(lines)),
+                'content': content[start:end] if end >= 0 else content[start:],
+                'start_line': start_line,
+                'end_line': start_line + line_count - 1,
                 'type': 'code',
                 'language': language
             })
+            if end < 0:
+                break
+            start = end + 1
+            start_line += line_count
         
         return chunks
 
+
+_worker_parser: Optional[CodeParser] = None
+
+
+def parse_file(file_path: Path) -> List[Dict[str, Any]]:
+    """Parse a file with this process's own CodeParser; the entry point for parse worker processes"""
+    global _worker_parser
+    if _worker_parser is None:
+        _worker_parser = CodeParser()
+    return _worker_parser.parse_file(file_path)
@@ -0,0 +1,54 @@
+"""
+Embedding Cache - Content-addressed SQLite store of computed embeddings
+"""
+import hashlib
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+# Vectors are kept at half precision; cosine ranking is unaffected at this scale
+VECTOR_DTYPE = np.float16
+
+# Keys per SELECT ... IN (...), kept under SQLite's bound-parameter limit
+LOOKUP_CHUNK = 500
+
+
+class EmbeddingCache:
+    """Maps (model, text) to its embedding so unchanged chunks are never re-embedded"""
+
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS emb16(k BLOB PRIMARY KEY, v BLOB) WITHOUT ROWID")
+
+    @staticmethod
+    def key(model: str, text: str) -> bytes:
+        """Content hash of the exact input sent to the model"""
+        return hashlib.blake2b(f"{model}\0{text}".encode(), digest_size=16).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Return the cached embeddings among keys"""
+        found: Dict[bytes, List[float]] = {}
+        for i in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[i:i + LOOKUP_CHUNK]
+            rows = self._conn.execute(
+                f"SELECT k, v FROM emb16 WHERE k IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for k, v in rows:
+                found[k] = np.frombuffer(v, dtype=VECTOR_DTYPE).tolist()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, List[float]]]):
+        """Store embeddings in a single transaction"""
+        rows = [(k, np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()) for k, vector in items]
+        if not rows:
+            return
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO emb16(k, v) VALUES (?, ?)", rows)
+
+    def close(self):
+        """Close the database"""
+        self._conn.close()
@@ -1,46 +1,175 @@
 """
 Embedding Generator - Generates embeddings using Ollama
 """
+import asyncio
+import os
 import httpx
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
 import structlog
 
+from embedding_cache import EmbeddingCache
+
 logger = structlog.get_logger()
 
+EMBEDDING_DIM = 768  # nomic-embed-text
+MAX_EMBED_CHARS = 8192  # texts are truncated to this before embedding
+EMBED_BATCH_SIZE = 64  # texts per /api/embed request
+# Batch requests in flight at once; match Ollama's OLLAMA_NUM_PARALLEL
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
 
 class EmbeddingGenerator:
     """Generates embeddings for code chunks using Ollama"""
     
-    def __init__(self, ollama_host: str):
+    def __init__(self, ollama_host: str, cache_path: str = ":memory:"):
         self.ollama_host = ollama_host
         self.embedding_model = "nomic-embed-text"  # Good for code embeddings
+        self._client = httpx.AsyncClient(
+            base_url=ollama_host,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=EMBED_CONCURRENCY * 2, max_keepalive_connections=EMBED_CONCURRENCY * 2)
+        )
+        # Cleared the first time the server turns out to predate /api/embed
+        self._batch_supported = True
+        self._cache = EmbeddingCache(cache_path)
+        # SQLite calls run on one dedicated thread: off the event loop, and
+        # never on the connection from two threads at once
+        self._cache_io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache")
+        # Texts being embedded right now, so concurrent duplicates share one request
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+        # Running totals of texts asked for and texts actually sent to the model
+        self.texts_requested = 0
+        self.texts_embedded = 0
+    
+    async def aclose(self):
+        """Close the pooled Ollama client and the embedding cache"""
+        await self._client.aclose()
+        await self._run_cache(self._cache.close)
+        self._cache_io.shutdown()
+    
+    async def _run_cache(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run an embedding cache call on the cache thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._cache_io, fn, *args)
+    
+    async def generate_embedding(self, text: str) -> Optional[List[float]]:
+        """Generate embedding for text, or None if that failed"""
+        return (await self.generate_embeddings_batch([text]))[0]
+    
+    async def generate_embeddings_batch(self, texts: List[str], batch_size: int = EMBED_BATCH_SIZE,
+                                        concurrency: int = EMBED_CONCURRENCY) -> List[Optional[List[float]]]:
+        """
+        Generate embeddings for multiple texts, many per request and several requests at once
+        
+        Texts are compared with leading and trailing whitespace stripped;
+        each distinct text is embedded once, texts already cached are not
+        sent, and a text that is being embedded by a concurrent call waits
+        for that result instead of being sent again. A text that could not be
+        embedded comes back as None rather than a placeholder vector.
+        """
+        texts = [text.strip()[:MAX_EMBED_CHARS] for text in texts]
+        keys = [self._cache.key(self.embedding_model, text) for text in texts]
+        cached = await self._run_cache(self._cache.get_many, keys)
+        
+        loop = asyncio.get_running_loop()
+        waiting: Dict[bytes, asyncio.Future] = {}
+        owned: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key in cached or key in waiting:
+                continue
+            future = self._inflight.get(key)
+            if future is None:
+                future = loop.create_future()
+                self._inflight[key] = future
+                owned[key] = text
+            waiting[key] = future
+        
+        self.texts_requested += len(texts)
+        self.texts_embedded += len(owned)
+        if owned:
+            # Shield so one cancelled caller doesn't cancel work others wait on
+            await asyncio.shield(self._embed_owned(owned, batch_size, concurrency))
+        computed = {key: await asyncio.shield(future) for key, future in waiting.items()}
+        
+        return [cached.get(key) or computed.get(key) for key in keys]
     
-    async def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for text"""
+    async def _embed_owned(self, owned: Dict[bytes, str], batch_size: int, concurrency: int):
+        """Embed texts this call registered as in flight and resolve their futures"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def embed(batch: List[str]) -> List[Optional[List[float]]]:
+            async with semaphore:
+                return await self._embed_batch(batch)
+        
+        # Longest first, so each batch holds texts of similar length and the
+        # model pads short inputs as little as possible
+        keys = sorted(owned, key=lambda key: len(owned[key]), reverse=True)
+        texts = [owned[key] for key in keys]
+        embeddings: Dict[bytes, Optional[List[float]]] = {}
+        error: Optional[BaseException] = None
+        try:
+            batches = await asyncio.gather(
+                *(embed(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size))
+            )
+            embeddings = dict(zip(keys, (embedding for batch in batches for embedding in batch)))
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # Every owned key is resolved and dropped, or later calls for the
+            # same text would wait on a future nobody completes
+            for key in owned:
+                future = self._inflight.pop(key)
+                if error is None:
+                    future.set_result(embeddings.get(key))
+                elif isinstance(error, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(error)
+                    # Marked retrieved: this call re-raises it even if nobody else waits
+                    future.exception()
+        
+        try:
+            await self._run_cache(
+                self._cache.put_many,
+                [(key, embedding) for key, embedding in embeddings.items() if embedding is not None]
+            )
+        except Exception as e:
+            logger.warning("Failed to cache embeddings", error=str(e))
+    
+    async def _embed_one(self, text: str) -> Optional[List[float]]:
+        """Embed a single text via /api/embeddings, or None if that failed"""
         try:
-            url = f"{self.ollama_host}/api/embeddings"
-            
-            payload = {
-                "model": self.embedding_model,
-                "prompt": text[:8192]  # Limit text length
-            }
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                return result.get("embedding", [])
+            response = await self._client.post(
+                "/api/embeddings",
+                json={"model": self.embedding_model, "prompt": text}
+            )
+            response.raise_for_status()
+            return response.json().get("embedding") or None
         
         except Exception as e:
             logger.error("Failed to generate embedding", error=str(e))
-            # Fallback: return zero vector (shouldn't happen in production)
-            return [0.0] * 768
-    
-    async def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts"""
-        embeddings = []
-        for text in texts:
-            embedding = await self.generate_embedding(text)
-            embeddings.append(embedding)
-        return embeddings
-
+            return None
+    
+    async def _embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed one batch via /api/embed, falling back to one /api/embeddings call per text"""
+        if self._batch_supported:
+            try:
+                response = await self._client.post(
+                    "/api/embed",
+                    json={"model": self.embedding_model, "input": texts},
+                    timeout=120.0
+                )
+                if response.status_code in (404, 405):
+                    logger.info("Ollama has no /api/embed, falling back to single embeddings")
+                    self._batch_supported = False
+                else:
+                    response.raise_for_status()
+                    embeddings = response.json().get("embeddings", [])
+                    if len(embeddings) != len(texts):
+                        raise ValueError("embed returned a mismatched number of embeddings")
+                    return embeddings
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning("Batch embedding failed, embedding texts one by one", error=str(e))
+        
+        return [await self._embed_one(text) for text in texts]
@@ -0,0 +1,110 @@
+"""
+Index Manifest - Persistent record of which file contents are already indexed
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+# (mtime_ns, size, content digest) of a file as it was last indexed
+Fingerprint = Tuple[int, int, bytes]
+
+
+def content_digest(path: Path) -> bytes:
+    """Hash of the file's bytes"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).digest()
+
+
+class IndexManifest:
+    """
+    Maps (project, relative file path) to the fingerprint it was indexed at
+
+    A file whose mtime and size are unchanged is skipped without being read;
+    one whose mtime moved but whose content hashes the same only has its
+    stat refreshed.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files("
+            "project TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, digest BLOB, "
+            "PRIMARY KEY(project, path)) WITHOUT ROWID"
+        )
+        # Calls arrive from worker threads; one at a time on the connection
+        self._lock = threading.Lock()
+
+    def scan(self, project: str, root: Path, files: Iterable[Path],
+             force: bool = False) -> Tuple[Dict[str, Fingerprint], List[str]]:
+        """
+        Compare files against the manifest
+
+        Returns (changed, removed): fingerprints of new or modified files keyed
+        by path relative to root, and known paths that are no longer present.
+        With force, every file counts as changed.
+        """
+        with self._lock:
+            known: Dict[str, Fingerprint] = {
+                path: (mtime_ns, size, digest)
+                for path, mtime_ns, size, digest in self._conn.execute(
+                    "SELECT path, mtime_ns, size, digest FROM files WHERE project = ?", (project,)
+                )
+            }
+
+        changed: Dict[str, Fingerprint] = {}
+        touched: Dict[str, Fingerprint] = {}
+        seen = set()
+        for file_path in files:
+            rel = str(file_path.relative_to(root))
+            seen.add(rel)
+            try:
+                st = os.stat(file_path)
+                previous = None if force else known.get(rel)
+                if previous is not None and previous[:2] == (st.st_mtime_ns, st.st_size):
+                    continue
+                fingerprint = (st.st_mtime_ns, st.st_size, content_digest(file_path))
+            except OSError:
+                continue
+            if previous is not None and previous[2] == fingerprint[2]:
+                touched[rel] = fingerprint
+            else:
+                changed[rel] = fingerprint
+
+        self.record(project, touched)
+        return changed, [path for path in known if path not in seen]
+
+    def record(self, project: str, fingerprints: Dict[str, Fingerprint]):
+        """Mark files as indexed at the given fingerprints"""
+        if not fingerprints:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files(project, path, mtime_ns, size, digest) VALUES (?, ?, ?, ?, ?)",
+                [(project, path, *fingerprint) for path, fingerprint in fingerprints.items()]
+            )
+
+    def forget(self, project: str, paths: List[str]):
+        """Drop files from the manifest"""
+        if not paths:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "DELETE FROM files WHERE project = ? AND path = ?", [(project, path) for path in paths]
+            )
+
+    def clear(self):
+        """Forget every file, so the next run indexes everything"""
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self._conn.close()
@@ -3,16 +3,23 @@ Code Indexer - Indexes codebase into Qdrant for RAG
 """
 import os
 import asyncio
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional, Set, Tuple
 import structlog
 import httpx
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-import hashlib
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    Batch, Distance, VectorParams, ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    FieldCondition, Filter, FilterSelector, MatchAny, MatchValue
+)
+import xxhash
 
-from code_parser import CodeParser
-from embedding_generator import EmbeddingGenerator
+from code_parser import CodeParser, parse_file
+from embedding_generator import EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EmbeddingGenerator
+from index_manifest import IndexManifest
 
 # Configure structured logging
 structlog.configure(
@@ -39,23 +46,56 @@ logger = structlog.get_logger()
 QDRANT_HOST = os.getenv("QDRANT_HOST", "http://localhost:6333")
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 WORKSPACE_PATH = os.getenv("WORKSPACE_PATH", "/app/workspace")
+CACHE_DIR = os.getenv("CACHE_DIR", "/app/.cache")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
 COLLECTION_NAME = "codebase"
 
+# Parsing is CPU-bound, so it runs in worker processes, one per core
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_AHEAD = PARSE_WORKERS * 2  # files parsed ahead of the embedding loop
+
+# Chunks buffered between parsing and embedding, and how they are batched
+CHUNK_QUEUE_SIZE = 1024
+INDEX_BATCH_SIZE = EMBED_BATCH_SIZE * EMBED_CONCURRENCY  # enough to keep every embed slot busy
+EMBED_FLUSH_INTERVAL = 0.05  # seconds to wait for a fuller batch
+
+# Points per Qdrant upsert and upserts in flight at once
+UPSERT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", "64"))
+UPSERT_CONCURRENCY = int(os.getenv("QDRANT_UPSERT_CONCURRENCY", "4"))
+
+# File paths per delete-by-filter request when dropping stale points
+DELETE_BATCH_SIZE = 256
+
+# Characters of each chunk kept in its payload; rag-chat reads the full
+# lines back from the workspace by file path and line span
+PREVIEW_CHARS = 200
+
+# /index/status re-walks a workspace to count its files at most this often
+STATUS_COUNT_TTL = 10.0
+
 # Initialize components
 qdrant_host = QDRANT_HOST.replace("http://", "").split(":")[0]
 qdrant_port = int(QDRANT_HOST.split(":")[-1]) if ":" in QDRANT_HOST and ":" in QDRANT_HOST.replace("http://", "") else 6333
-qdrant_client = QdrantClient(host=qdrant_host, port=qdrant_port)
+# Points carry whole code chunks; gRPC sends them as protobuf instead of escaped JSON
+qdrant_client = AsyncQdrantClient(host=qdrant_host, port=qdrant_port, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=True)
 code_parser = CodeParser()
-embedding_generator = EmbeddingGenerator(OLLAMA_HOST)
+parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+os.makedirs(CACHE_DIR, exist_ok=True)
+embedding_generator = EmbeddingGenerator(OLLAMA_HOST, os.path.join(CACHE_DIR, "embeddings.db"))
+index_manifest = IndexManifest(os.path.join(CACHE_DIR, "index_manifest.db"))
+# workspace -> (monotonic time counted, code file count)
+status_file_counts: Dict[str, Tuple[float, int]] = {}
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 
 app = FastAPI(
     title="Code Indexer",
     description="Codebase Indexing Service for RAG",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -79,21 +119,30 @@ class IndexStatus(BaseModel):
     project_name: str
 
 
+async def create_collection():
+    """Create the codebase collection with int8-quantized vectors"""
+    # 768 dimensions for the nomic-embed-text model; adjust for other embedding models.
+    # Search runs on the int8 copy held in RAM (a quarter of the float32 size)
+    # and rescores the top hits against the original vectors, which stay on disk.
+    await qdrant_client.create_collection(
+        collection_name=COLLECTION_NAME,
+        vectors_config=VectorParams(size=768, distance=Distance.COSINE, on_disk=True),
+        quantization_config=ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    )
+
+
 @app.on_event("startup")
 async def startup():
     """Initialize Qdrant collection on startup"""
     try:
         # Check if collection exists
-        collections = qdrant_client.get_collections().collections
+        collections = (await qdrant_client.get_collections()).collections
         collection_names = [c.name for c in collections]
         
         if COLLECTION_NAME not in collection_names:
-            # Create collection with 768 dimensions (for nomic-embed-text model)
-            # Adjust based on your embedding model
-            qdrant_client.create_collection(
-                collection_name=COLLECTION_NAME,
-                vectors_config=VectorParams(size=768, distance=Distance.COSINE)
-            )
+            await create_collection()
             logger.info("Created Qdrant collection", collection=COLLECTION_NAME)
         else:
             logger.info("Qdrant collection already exists", collection=COLLECTION_NAME)
@@ -101,11 +150,20 @@ async def startup():
         logger.error("Failed to initialize Qdrant", error=str(e))
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Close pooled upstream clients and the parse workers"""
+    await embedding_generator.aclose()
+    await qdrant_client.close()
+    parse_executor.shutdown(wait=False, cancel_futures=True)
+    index_manifest.close()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
-        collections = qdrant_client.get_collections()
+        collections = await qdrant_client.get_collections()
         return {
             "status": "healthy",
             "service": "code-indexer",
@@ -152,12 +210,11 @@ async def get_index_status(project_path: Optional[str] = None):
             workspace = workspace / project_path
         
         # Count files
-        code_files = list(code_parser.find_code_files(workspace))
-        total_files = len(code_files)
+        total_files = await count_code_files(workspace)
         
         # Count indexed files (simplified - in production, track this properly)
         # For now, return collection info
-        collection_info = qdrant_client.get_collection(COLLECTION_NAME)
+        collection_info = await qdrant_client.get_collection(COLLECTION_NAME)
         indexed_count = collection_info.points_count if collection_info else 0
         
         return {
@@ -175,18 +232,57 @@ async def get_index_status(project_path: Optional[str] = None):
 async def clear_index():
     """Clear all indexed code"""
     try:
-        qdrant_client.delete_collection(COLLECTION_NAME)
+        await qdrant_client.delete_collection(COLLECTION_NAME)
         # Recreate collection
-        qdrant_client.create_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=768, distance=Distance.COSINE)
-        )
+        await create_collection()
+        await asyncio.to_thread(index_manifest.clear)
         return {"success": True, "message": "Index cleared"}
     except Exception as e:
         logger.error("Failed to clear index", error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def find_code_files(root: Path) -> List[Path]:
+    """Walk the tree for code files in a thread, off the event loop"""
+    return await asyncio.to_thread(lambda: list(code_parser.find_code_files(root)))
+
+
+async def count_code_files(root: Path) -> int:
+    """Number of code files under root, re-counted at most every STATUS_COUNT_TTL seconds"""
+    cached = status_file_counts.get(str(root))
+    if cached and time.monotonic() - cached[0] < STATUS_COUNT_TTL:
+        return cached[1]
+    count = len(await find_code_files(root))
+    status_file_counts[str(root)] = (time.monotonic(), count)
+    return count
+
+
+async def parse_files(paths: List[Path]) -> AsyncIterator[Tuple[Path, List[Dict[str, Any]]]]:
+    """
+    Parse files in the worker processes, yielding (path, chunks) in order
+    
+    Up to PARSE_AHEAD files are in flight at once, so parsing overlaps with
+    whatever the caller does with each result without running unboundedly ahead.
+    """
+    loop = asyncio.get_running_loop()
+    pending: deque = deque()
+    
+    async def next_result() -> Tuple[Path, List[Dict[str, Any]]]:
+        path, future = pending.popleft()
+        try:
+            return path, await future
+        except Exception as e:
+            logger.warning("Failed to parse file", file=str(path), error=str(e))
+            return path, []
+    
+    for path in paths:
+        pending.append((path, loop.run_in_executor(parse_executor, parse_file, path)))
+        if len(pending) >= PARSE_AHEAD:
+            yield await next_result()
+    while pending:
+        yield await next_result()
+
+
 async def perform_indexing(project_path: Optional[str] = None, force_reindex: bool = False):
     """Perform the actual indexing"""
     try:
@@ -201,64 +297,205 @@ async def perform_indexing(project_path: Optional[str] = None, force_reindex: bo
         logger.info("Starting indexing", workspace=str(workspace))
         
         # Find all code files
-        code_files = list(code_parser.find_code_files(workspace))
-        logger.info("Found code files", count=len(code_files))
+        code_files = await find_code_files(workspace)
+        project = str(workspace.relative_to(Path(WORKSPACE_PATH))) if project_path else "workspace"
+        
+        # Only new or modified files are parsed and embedded; their old points,
+        # and those of files that have gone, are dropped first
+        changed, removed = await asyncio.to_thread(
+            index_manifest.scan, project, workspace, code_files, force_reindex
+        )
+        logger.info("Found code files", count=len(code_files), changed=len(changed), removed=len(removed))
+        await delete_file_points(project, [*changed, *removed])
+        await asyncio.to_thread(index_manifest.forget, project, removed)
+        if not changed:
+            logger.info("Index is up to date", total_files=len(code_files))
+            return
+        index_files = [workspace / rel for rel in changed]
         
-        # Process files in batches
-        batch_size = 10
-        points = []
+        # Parsing feeds chunks into a bounded queue while the embedder drains
+        # it in batches, so parse, embed and upsert all overlap
+        queue: asyncio.Queue = asyncio.Queue(maxsize=CHUNK_QUEUE_SIZE)
         
-        for i, file_path in enumerate(code_files):
+        async def produce():
             try:
-                # Parse code file
-                chunks = code_parser.parse_file(file_path)
-                
-                for chunk in chunks:
-                    # Generate embedding
-                    embedding = await embedding_generator.generate_embedding(chunk["content"])
-                    
-                    # Create point ID from file path and chunk index
-                    point_id = int(hashlib.md5(
-                        f"{file_path}:{chunk['start_line']}:{chunk['end_line']}".encode()
-                    ).hexdigest()[:8], 16)
-                    
-                    # Create point
-                    point = PointStruct(
-                        id=point_id,
-                        vector=embedding,
-                        payload={
-                            "file_path": str(file_path.relative_to(workspace)),
-                            "content": chunk["content"],
-                            "start_line": chunk["start_line"],
-                            "end_line": chunk["end_line"],
-                            "language": chunk.get("language", "unknown"),
-                            "chunk_type": chunk.get("type", "code"),
-                            "project_path": str(workspace.relative_to(Path(WORKSPACE_PATH))) if project_path else "workspace"
-                        }
-                    )
-                    points.append(point)
-                    
-                    # Batch insert
-                    if len(points) >= batch_size:
-                        qdrant_client.upsert(collection_name=COLLECTION_NAME, points=points)
-                        points = []
-                        logger.info("Indexed batch", total=i+1, files=len(code_files))
-                
-            except Exception as e:
-                logger.warning("Failed to index file", file=str(file_path), error=str(e))
-                continue
+                async for file_path, chunks in parse_files(index_files):
+                    for chunk in chunks:
+                        await queue.put((file_path, chunk))
+            except Exception:
+                await queue.put(None)
+                raise
+            await queue.put(None)
         
-        # Insert remaining points
-        if points:
-            qdrant_client.upsert(collection_name=COLLECTION_NAME, points=points)
+        upserter = Upserter()
+        failed = set()
+        requested, embedded = embedding_generator.texts_requested, embedding_generator.texts_embedded
+        producer = asyncio.create_task(produce())
+        try:
+            indexed_chunks = 0
+            done = False
+            while not done:
+                batch, done = await next_chunk_batch(queue)
+                if not batch:
+                    continue
+                try:
+                    ids, vectors, payloads, unembedded = await embed_chunks(batch, workspace, project)
+                    failed |= unembedded
+                    await upserter.submit(ids, vectors, payloads)
+                    indexed_chunks += len(ids)
+                    logger.info("Indexed batch", chunks=indexed_chunks, files=len(index_files))
+                except Exception as e:
+                    logger.warning("Failed to index batch", size=len(batch), error=str(e))
+                    failed.update(str(file_path.relative_to(workspace)) for file_path, _ in batch)
+        except BaseException:
+            producer.cancel()
+            raise
+        # The producer has sent its sentinel; this re-raises a parse-stage failure
+        await producer
+        await upserter.drain()
         
-        logger.info("Indexing complete", total_files=len(code_files))
+        # Files with a failed batch stay out of the manifest and are retried next run
+        failed |= upserter.failed
+        await asyncio.to_thread(
+            index_manifest.record, project,
+            {rel: fingerprint for rel, fingerprint in changed.items() if rel not in failed}
+        )
+        
+        # Share of chunks whose vector came from the cache or a duplicate chunk
+        requested = embedding_generator.texts_requested - requested
+        embedded = embedding_generator.texts_embedded - embedded
+        logger.info(
+            "Indexing complete", total_files=len(code_files), indexed_files=len(changed) - len(failed),
+            cache_hit_rate=round(1 - embedded / requested, 3) if requested else None
+        )
         
     except Exception as e:
         logger.error("Indexing failed", error=str(e), exc_info=True)
 
 
+async def delete_file_points(project: str, paths: List[str]):
+    """Delete every point of the given project-relative files"""
+    for i in range(0, len(paths), DELETE_BATCH_SIZE):
+        await qdrant_client.delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=FilterSelector(filter=Filter(must=[
+                FieldCondition(key="project_path", match=MatchValue(value=project)),
+                FieldCondition(key="file_path", match=MatchAny(any=paths[i:i + DELETE_BATCH_SIZE]))
+            ]))
+        )
+
+
+async def next_chunk_batch(queue: asyncio.Queue) -> Tuple[List[Tuple[Path, Dict[str, Any]]], bool]:
+    """
+    Take up to INDEX_BATCH_SIZE chunks from the queue
+    
+    Waits for the first chunk, then at most EMBED_FLUSH_INTERVAL for more.
+    Also reports whether the producer has finished.
+    """
+    first = await queue.get()
+    if first is None:
+        return [], True
+    
+    batch = [first]
+    deadline = asyncio.get_running_loop().time() + EMBED_FLUSH_INTERVAL
+    while len(batch) < INDEX_BATCH_SIZE:
+        remaining = deadline - asyncio.get_running_loop().time()
+        try:
+            item = queue.get_nowait() if remaining <= 0 else await asyncio.wait_for(queue.get(), remaining)
+        except (asyncio.QueueEmpty, asyncio.TimeoutError):
+            break
+        if item is None:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+async def embed_chunks(batch: List[Tuple[Path, Dict[str, Any]]], workspace: Path,
+                       project: str) -> Tuple[List[int], List[List[float]], List[Dict[str, Any]], Set[str]]:
+    """
+    Embed a batch of chunks into parallel lists of point ids, vectors and payloads
+    
+    Also returns the files, relative to workspace, with a chunk that could
+    not be embedded; none of their chunks in the batch become points, so the
+    caller can leave them out of the manifest and retry them next run.
+    """
+    batch = [(file_path, chunk) for file_path, chunk in batch if chunk["content"].strip()]
+    embeddings = await embedding_generator.generate_embeddings_batch([chunk["content"] for _, chunk in batch])
+    unembedded = {
+        str(file_path.relative_to(workspace))
+        for (file_path, _), vector in zip(batch, embeddings) if vector is None
+    }
+    
+    ids = []
+    vectors = []
+    payloads = []
+    for (file_path, chunk), vector in zip(batch, embeddings):
+        rel = str(file_path.relative_to(workspace))
+        if rel in unembedded:
+            continue
+        vectors.append(vector)
+        # Point ID: 64-bit hash of the project, file path and chunk span, so
+        # indexing the workspace doesn't overwrite a project's own points
+        ids.append(xxhash.xxh3_64_intdigest(f"{project}:{rel}:{chunk['start_line']}:{chunk['end_line']}"))
+        payloads.append({
+            "file_path": rel,
+            "preview": chunk["content"][:PREVIEW_CHARS],
+            "start_line": chunk["start_line"],
+            "end_line": chunk["end_line"],
+            "language": chunk.get("language", "unknown"),
+            "chunk_type": chunk.get("type", "code"),
+            "project_path": project
+        })
+    
+    return ids, vectors, payloads, unembedded
+
+
+class Upserter:
+    """Writes points to Qdrant in the background, a bounded number of upserts at a time"""
+    
+    def __init__(self):
+        self._slots = asyncio.Semaphore(UPSERT_CONCURRENCY)
+        self._pending: set = set()
+        # Files that lost points to a failed upsert
+        self.failed: set = set()
+    
+    async def submit(self, ids: List[int], vectors: List[List[float]], payloads: List[Dict[str, Any]]):
+        """Queue points for upsert, waiting only while every upsert slot is busy"""
+        for i in range(0, len(ids), UPSERT_BATCH_SIZE):
+            await self._slots.acquire()
+            # One columnar Batch per request rather than a validated PointStruct per point
+            task = asyncio.create_task(self._upsert(Batch(
+                ids=ids[i:i + UPSERT_BATCH_SIZE],
+                vectors=vectors[i:i + UPSERT_BATCH_SIZE],
+                payloads=payloads[i:i + UPSERT_BATCH_SIZE]
+            )))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+    
+    async def drain(self):
+        """Wait for every queued upsert to finish"""
+        while self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+    
+    async def _upsert(self, batch: Batch):
+        try:
+            await qdrant_client.upsert(collection_name=COLLECTION_NAME, points=batch)
+        except Exception as e:
+            logger.warning("Failed to upsert points", error=str(e))
+            self.failed.update(payload["file_path"] for payload in batch.payloads)
+        finally:
+            self._slots.release()
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    # uvloop and httptools ship with uvicorn[standard]; multiple workers need the import string
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8002,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
 
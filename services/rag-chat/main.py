@@ -2,14 +2,25 @@
 RAG Chat Service - Codebase-aware chat with Retrieval Augmented Generation
 """
 import os
-from typing import List, Dict, Any, Optional
+import asyncio
+import hashlib
+from functools import lru_cache
+from typing import AsyncIterator, List, Dict, Any, Optional
 import structlog
 import httpx
+import orjson
+from cachetools import TTLCache
 from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    FieldCondition, Filter, MatchValue, QuantizationSearchParams, SearchParams, SearchRequest
+)
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+from source_lines import SourceReader
 
 # Configure structured logging
 structlog.configure(
@@ -35,17 +46,45 @@ logger = structlog.get_logger()
 # Configuration
 QDRANT_HOST = os.getenv("QDRANT_HOST", "http://localhost:6333")
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+WORKSPACE_PATH = os.getenv("WORKSPACE_PATH", "/app/workspace")
 COLLECTION_NAME = "codebase"
 
+# Query embeddings are reused for repeated questions for this long
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+QUERY_EMBEDDING_TTL = 3600.0
+
+# Candidates are ranked on the int8 vectors, then twice the limit is
+# rescored against the originals to recover recall
+SEARCH_PARAMS = SearchParams(quantization=QuantizationSearchParams(rescore=True, oversampling=2.0))
+
+# Tokens have to reach the client as they arrive, so proxies must not buffer
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
 # Initialize Qdrant client
 qdrant_host = QDRANT_HOST.replace("http://", "").split(":")[0]
 qdrant_port = int(QDRANT_HOST.split(":")[-1]) if ":" in QDRANT_HOST else 6333
 qdrant_client = QdrantClient(host=qdrant_host, port=qdrant_port)
 
+# Pooled Ollama client shared by every request; HTTP/2 applies when OLLAMA_HOST is https
+ollama_client = httpx.AsyncClient(
+    base_url=OLLAMA_HOST,
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=5.0),
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+)
+
+# Points store a short preview; hits are read back from the indexed files
+source_reader = SourceReader(WORKSPACE_PATH)
+
+query_embeddings: TTLCache = TTLCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE, ttl=QUERY_EMBEDDING_TTL)
+query_embedding_tasks: Dict[bytes, "asyncio.Task[List[float]]"] = {}
+query_embedding_stats = {"hits": 0, "misses": 0}
+
 app = FastAPI(
     title="RAG Chat",
     description="Codebase-aware Chat with RAG",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -63,6 +102,7 @@ class ChatRequest(BaseModel):
     max_results: int = Field(default=5, description="Maximum number of code chunks to retrieve")
     temperature: float = Field(default=0.7, description="LLM temperature")
     model: Optional[str] = Field(default=None, description="Ollama model to use")
+    stream: bool = Field(default=False, description="Stream the answer as server-sent events")
 
 
 class ChatResponse(BaseModel):
@@ -71,6 +111,22 @@ class ChatResponse(BaseModel):
     context_used: bool
 
 
+class SearchQuery(BaseModel):
+    query: str = Field(..., min_length=1, description="Search query")
+    limit: int = Field(default=10, ge=1, description="Maximum number of code chunks to return")
+    project_path: Optional[str] = Field(default=None, description="Specific project to search")
+
+
+class SearchBatchRequest(BaseModel):
+    queries: Optional[List[SearchQuery]] = Field(default=None, description="Queries to search for")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the pooled Ollama client"""
+    await ollama_client.aclose()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -103,24 +159,28 @@ async def chat(request: ChatRequest):
             collection_name=COLLECTION_NAME,
             query_vector=query_embedding,
             limit=request.max_results,
-            query_filter={"must": [{"key": "project_path", "match": {"value": request.project_path}}]} if request.project_path else None
+            query_filter=project_filter(request.project_path),
+            search_params=SEARCH_PARAMS
         )
         
         # Build context from search results
         context_chunks = []
         sources = []
         
-        for result in search_results:
+        for result, content in zip(search_results, await chunk_contents(search_results)):
             payload = result.payload
+            file_path = payload.get("file_path", "unknown")
+            start_line = payload.get("start_line", 0)
+            end_line = payload.get("end_line", 0)
             context_chunks.append({
-                "file": payload.get("file_path", "unknown"),
-                "content": payload.get("content", ""),
-                "lines": f"{payload.get('start_line', 0)}-{payload.get('end_line', 0)}"
+                "file": file_path,
+                "content": content,
+                "lines": f"{start_line}-{end_line}"
             })
             sources.append({
-                "file_path": payload.get("file_path", "unknown"),
-                "start_line": payload.get("start_line", 0),
-                "end_line": payload.get("end_line", 0),
+                "file_path": file_path,
+                "start_line": start_line,
+                "end_line": end_line,
                 "language": payload.get("language", "unknown"),
                 "score": result.score
             })
@@ -146,6 +206,13 @@ Provide a helpful answer based on the codebase context."""
         
         # Call Ollama for response
         model = request.model or "qwen2.5:72b"
+        if request.stream:
+            return StreamingResponse(
+                chat_events(sources, user_prompt, system_prompt, model, request.temperature),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+        
         response_text = await call_ollama(
             prompt=user_prompt,
             system_prompt=system_prompt,
@@ -164,17 +231,43 @@ Provide a helpful answer based on the codebase context."""
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def chat_events(sources: List[Dict[str, Any]], prompt: str, system_prompt: str,
+                      model: str, temperature: float) -> AsyncIterator[bytes]:
+    """
+    Server-sent events for a streamed chat answer
+    
+    A ``sources`` event comes first, then one unnamed event per generated
+    piece of text, then ``done``, or ``error`` if generation failed midway.
+    """
+    yield sse_event({"sources": sources, "context_used": len(sources) > 0}, "sources")
+    try:
+        async for text in stream_ollama(prompt, system_prompt, model, temperature):
+            yield sse_event({"response": text})
+    except Exception as e:
+        yield sse_event({"error": str(e)}, "error")
+        return
+    yield sse_event({}, "done")
+
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    """Encode one server-sent event"""
+    prefix = f"event: {event}\n".encode() if event else b""
+    return prefix + b"data: " + orjson.dumps(data) + b"\n\n"
+
+
 @app.post("/search")
 async def search_code(request: Request):
     """Search codebase for relevant code"""
     try:
         body = await request.json()
-        query = body.get("query")
-        project_path = body.get("project_path")
-        limit = int(body.get("limit", 10))
-        
-        if not query:
+        if not isinstance(body, dict) or not body.get("query"):
             raise HTTPException(status_code=400, detail="query parameter required")
+        query = body["query"]
+        project_path = body.get("project_path")
+        try:
+            limit = int(body.get("limit", 10))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="limit must be an integer")
         
         # Generate embedding for query
         query_embedding = await generate_query_embedding(query)
@@ -184,20 +277,14 @@ async def search_code(request: Request):
             collection_name=COLLECTION_NAME,
             query_vector=query_embedding,
             limit=limit,
-            query_filter={"must": [{"key": "project_path", "match": {"value": project_path}}]} if project_path else None
+            query_filter=project_filter(project_path),
+            search_params=SEARCH_PARAMS
         )
         
-        results = []
-        for result in search_results:
-            payload = result.payload
-            results.append({
-                "file_path": payload.get("file_path", "unknown"),
-                "content": payload.get("content", ""),
-                "start_line": payload.get("start_line", 0),
-                "end_line": payload.get("end_line", 0),
-                "language": payload.get("language", "unknown"),
-                "score": result.score
-            })
+        results = [
+            format_search_result(result, content)
+            for result, content in zip(search_results, await chunk_contents(search_results))
+        ]
         
         return {"results": results, "count": len(results)}
     
@@ -208,45 +295,178 @@ async def search_code(request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/search_batch")
+async def search_code_batch(request: Request):
+    """Search codebase for several queries in one round trip"""
+    try:
+        try:
+            queries = SearchBatchRequest.model_validate(await request.json()).queries or []
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=e.errors(include_url=False))
+        
+        # Embed all queries concurrently, then run the vector searches as one batch
+        embeddings = await asyncio.gather(
+            *(generate_query_embedding(q.query) for q in queries)
+        )
+        
+        batch_results = qdrant_client.search_batch(
+            collection_name=COLLECTION_NAME,
+            requests=[
+                SearchRequest(
+                    vector=embedding,
+                    limit=q.limit,
+                    filter=project_filter(q.project_path),
+                    params=SEARCH_PARAMS,
+                    with_payload=True
+                )
+                for q, embedding in zip(queries, embeddings)
+            ]
+        ) if queries else []
+        
+        # Read every hit's lines in one pass, so files shared by queries open once
+        contents = iter(await chunk_contents([result for search_results in batch_results for result in search_results]))
+        results = [
+            [format_search_result(result, next(contents)) for result in search_results]
+            for search_results in batch_results
+        ]
+        
+        return {"results": results, "count": len(results)}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Batch search failed", error=str(e), exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@lru_cache(maxsize=256)
+def project_filter(project_path: Optional[str]) -> Optional[Filter]:
+    """Filter restricting a search to one project, built once per project"""
+    if not project_path:
+        return None
+    return Filter(must=[FieldCondition(key="project_path", match=MatchValue(value=project_path))])
+
+
+async def chunk_contents(results) -> List[str]:
+    """
+    Code text of each Qdrant hit
+    
+    Points indexed with their full content use it as-is; otherwise the
+    chunk's lines are read from the workspace, falling back to the stored
+    preview if the file can no longer be read.
+    """
+    missing = [result.payload for result in results if "content" not in result.payload]
+    texts = iter(await asyncio.to_thread(source_reader.read_ranges, [
+        (workspace_file(payload), payload.get("start_line", 0), payload.get("end_line", 0))
+        for payload in missing
+    ]) if missing else [])
+    
+    contents = []
+    for result in results:
+        payload = result.payload
+        if "content" in payload:
+            contents.append(payload["content"])
+        else:
+            contents.append(next(texts) or payload.get("preview", ""))
+    return contents
+
+
+def workspace_file(payload: Dict[str, Any]) -> str:
+    """A hit's file path relative to WORKSPACE_PATH; the indexer stores it relative to the project"""
+    project = payload.get("project_path")
+    file_path = payload.get("file_path", "")
+    return f"{project}/{file_path}" if project and project != "workspace" else file_path
+
+
+def format_search_result(result, content: str) -> Dict[str, Any]:
+    """Convert a Qdrant hit into the search API result shape"""
+    payload = result.payload
+    return {
+        "file_path": payload.get("file_path", "unknown"),
+        "content": content,
+        "start_line": payload.get("start_line", 0),
+        "end_line": payload.get("end_line", 0),
+        "language": payload.get("language", "unknown"),
+        "score": result.score
+    }
+
+
 async def generate_query_embedding(text: str) -> List[float]:
+    """
+    Embed query text, reusing the embedding of an identical recent query
+    
+    Queries are compared after trimming and collapsing whitespace; concurrent
+    misses for the same query share one Ollama request.
+    """
+    text = " ".join(text.split())
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    
+    embedding = query_embeddings.get(key)
+    if embedding is not None:
+        query_embedding_stats["hits"] += 1
+        logger.debug("Query embedding cache hit", **query_embedding_stats)
+        return embedding
+    
+    task = query_embedding_tasks.get(key)
+    if task is None:
+        query_embedding_stats["misses"] += 1
+        logger.debug("Query embedding cache miss", **query_embedding_stats)
+        task = asyncio.create_task(embed_query(text))
+        query_embedding_tasks[key] = task
+        task.add_done_callback(lambda _: query_embedding_tasks.pop(key, None))
+    # Shield so one cancelled caller doesn't cancel the shared request
+    embedding = await asyncio.shield(task)
+    if embedding:
+        query_embeddings[key] = embedding
+    return embedding
+
+
+async def embed_query(text: str) -> List[float]:
     """Generate embedding for query text"""
     try:
-        url = f"{OLLAMA_HOST}/api/embeddings"
         payload = {
             "model": "nomic-embed-text",
             "prompt": text[:8192]
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            return result.get("embedding", [])
+        response = await ollama_client.post("/api/embeddings", json=payload)
+        response.raise_for_status()
+        result = response.json()
+        return result.get("embedding", [])
     except Exception as e:
         logger.error("Failed to generate query embedding", error=str(e))
         raise
 
 
 async def call_ollama(prompt: str, system_prompt: str, model: str, temperature: float = 0.7) -> str:
-    """Call Ollama API"""
+    """Call Ollama API and return the whole answer"""
+    return "".join([text async for text in stream_ollama(prompt, system_prompt, model, temperature)])
+
+
+async def stream_ollama(prompt: str, system_prompt: str, model: str, temperature: float = 0.7) -> AsyncIterator[str]:
+    """Call Ollama API, yielding the answer as it is generated"""
     try:
-        url = f"{OLLAMA_HOST}/api/generate"
         payload = {
             "model": model,
             "prompt": prompt,
             "system": system_prompt,
-            "stream": False,
+            "stream": True,
             "options": {
                 "temperature": temperature,
                 "num_predict": 4096
             }
         }
         
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.post(url, json=payload)
+        async with ollama_client.stream("POST", "/api/generate", json=payload, timeout=300.0) as response:
             response.raise_for_status()
-            result = response.json()
-            return result.get("response", "")
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                result = orjson.loads(line)
+                if result.get("response"):
+                    yield result["response"]
+                if result.get("done"):
+                    break
     except Exception as e:
         logger.error("Ollama API call failed", error=str(e))
         raise
@@ -254,5 +474,13 @@ async def call_ollama(prompt: str, system_prompt: str, model: str, temperature:
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8003)
+    # uvloop and httptools ship with uvicorn[standard]; multiple workers need the import string
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8003,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
 
@@ -0,0 +1,78 @@
+"""
+Source Lines - Reads indexed line ranges back out of the workspace
+"""
+import mmap
+import os
+import re
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+LINE_INDEX_CACHE_SIZE = 1024
+MAX_RANGE_CHARS = 8192  # matches the indexer's embedding input limit
+
+_NEWLINE = re.compile(b"\n")
+
+
+class SourceReader:
+    """
+    Slices line ranges out of files under a root directory
+
+    The byte offset of every line start is kept per file, keyed by its
+    mtime and size, so repeated hits in the same file cost one mmap and
+    a slice rather than a rescan.
+    """
+
+    def __init__(self, root: str, maxsize: int = LINE_INDEX_CACHE_SIZE):
+        self.root = Path(root).resolve()
+        self._line_starts: LRUCache = LRUCache(maxsize=maxsize)
+
+    def read_ranges(self, ranges: List[Tuple[str, int, int]]) -> List[Optional[str]]:
+        """
+        Text of each (path relative to root, start_line, end_line), 1-based and inclusive
+
+        Each file is opened once however many ranges fall in it. A range whose
+        file is missing or outside the root comes back as None.
+        """
+        by_file: Dict[str, List[int]] = {}
+        for i, (path, _, _) in enumerate(ranges):
+            by_file.setdefault(path, []).append(i)
+
+        texts: List[Optional[str]] = [None] * len(ranges)
+        for path, indexes in by_file.items():
+            full_path = (self.root / path).resolve()
+            if not full_path.is_relative_to(self.root):
+                continue
+            try:
+                with open(full_path, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    if st.st_size == 0:
+                        for i in indexes:
+                            texts[i] = ""
+                        continue
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        line_starts = self._get_line_starts(str(full_path), st, data)
+                        for i in indexes:
+                            _, start_line, end_line = ranges[i]
+                            texts[i] = self._slice(data, line_starts, start_line, end_line)
+            except (OSError, ValueError):
+                continue
+        return texts
+
+    def _get_line_starts(self, path: str, st: os.stat_result, data: mmap.mmap) -> array:
+        key = (path, st.st_mtime_ns, st.st_size)
+        line_starts = self._line_starts.get(key)
+        if line_starts is None:
+            line_starts = array("q", [0])
+            line_starts.extend(m.end() for m in _NEWLINE.finditer(data))
+            self._line_starts[key] = line_starts
+        return line_starts
+
+    @staticmethod
+    def _slice(data: mmap.mmap, line_starts: array, start_line: int, end_line: int) -> str:
+        size = len(data)
+        start = line_starts[start_line - 1] if 0 < start_line <= len(line_starts) else size
+        end = line_starts[end_line] if 0 <= end_line < len(line_starts) else size
+        return data[start:max(start, end)].decode("utf-8", errors="ignore").rstrip("\n")[:MAX_RANGE_CHARS]
@@ -3,12 +3,14 @@ Rules Engine - Manages coding standards and rules
 """
 import os
 import yaml
+import orjson
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import structlog
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 # Configure structured logging
@@ -34,11 +36,21 @@ logger = structlog.get_logger()
 
 # Configuration
 RULES_PATH = os.getenv("RULES_PATH", "/app/rules")
+CACHE_DIR = os.getenv("CACHE_DIR", "/app/.cache")
+
+# Parsed rule files, reused while their mtime and size are unchanged;
+# bump the version whenever Rule changes shape
+RULES_CACHE_FILE = os.path.join(CACHE_DIR, "rules.cache.json")
+RULES_CACHE_VERSION = 1
+
+# libyaml-backed safe loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 app = FastAPI(
     title="Rules Engine",
     description="Coding Standards and Rules Management",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -63,74 +75,151 @@ class Rule(BaseModel):
 class RulesManager:
     """Manages coding rules"""
     
-    def __init__(self, rules_path: str):
+    def __init__(self, rules_path: str, cache_file: Optional[str] = None):
         self.rules_path = Path(rules_path)
         self.rules_path.mkdir(parents=True, exist_ok=True)
         self.rules: Dict[str, List[Rule]] = {}
+        # Serialized enabled rules per language, plus None for all of them
+        self._dict_cache: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        # (same key as _dict_cache, rule name) -> first such rule in that list
+        self._by_name: Dict[Tuple[Optional[str], str], Dict[str, Any]] = {}
+        # Rule file path -> stat and already-validated rules, persisted to cache_file
+        self.cache_file = Path(cache_file) if cache_file else None
+        self._file_cache: Dict[str, Dict[str, Any]] = self._read_file_cache()
         self._load_rules()
     
     def _load_rules(self):
         """Load rules from YAML files"""
         logger.info("Loading rules", path=str(self.rules_path))
+        loaded_files = set()
+        parsed_files = 0
         
         # Load default rules
         default_rules_file = self.rules_path / "default.yaml"
-        if default_rules_file.exists():
-            self._load_rules_file(default_rules_file)
+        rule_files = [(default_rules_file, None)] if default_rules_file.exists() else []
         
         # Load language-specific rules
         for rule_file in self.rules_path.glob("*.yaml"):
             if rule_file.name != "default.yaml":
-                self._load_rules_file(rule_file)
+                rule_files.append((rule_file, None))
         
         # Load language-specific rules from subdirectories
         for lang_dir in self.rules_path.iterdir():
             if lang_dir.is_dir():
                 for rule_file in lang_dir.glob("*.yaml"):
-                    self._load_rules_file(rule_file, language=lang_dir.name)
+                    rule_files.append((rule_file, lang_dir.name))
+        
+        for rule_file, language in rule_files:
+            try:
+                parsed_files += self._load_rules_file(rule_file, language=language)
+                loaded_files.add(str(rule_file))
+            except Exception as e:
+                logger.error("Failed to load rules file", file=str(rule_file), error=str(e))
+        
+        stale_files = self._file_cache.keys() - loaded_files
+        for path in stale_files:
+            del self._file_cache[path]
+        if parsed_files or stale_files:
+            self._write_file_cache()
+        
+        self._build_dict_cache()
     
-    def _load_rules_file(self, rule_file: Path, language: Optional[str] = None):
-        """Load rules from a YAML file"""
-        try:
-            with open(rule_file, 'r') as f:
-                data = yaml.safe_load(f)
-            
-            if not isinstance(data, dict):
-                return
-            
-            rules_list = data.get("rules", [])
-            if not rules_list:
-                return
-            
-            # Determine language
-            file_language = language or data.get("language") or "general"
-            
-            if file_language not in self.rules:
-                self.rules[file_language] = []
-            
-            for rule_data in rules_list:
-                rule = Rule(**rule_data)
-                rule.language = rule.language or file_language
-                self.rules[file_language].append(rule)
-            
-            logger.info("Loaded rules", file=str(rule_file), count=len(rules_list), language=file_language)
-        except Exception as e:
-            logger.error("Failed to load rules file", file=str(rule_file), error=str(e))
+    def _build_dict_cache(self):
+        """Serialize the enabled rules once, grouped the way get_rules returns them"""
+        dumped = {
+            language: [rule.model_dump() for rule in rules if rule.enabled]
+            for language, rules in self.rules.items()
+        }
+        general = dumped.get("general", [])
+        self._dict_cache = {
+            language: rules + general if language != "general" else rules
+            for language, rules in dumped.items()
+        }
+        self._dict_cache[None] = [rule for rules in dumped.values() for rule in rules]
+        self._by_name = {}
+        for language, rules in self._dict_cache.items():
+            for rule in rules:
+                self._by_name.setdefault((language, rule["name"]), rule)
     
-    def get_rules(self, language: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get rules for a language"""
-        if language:
-            rules = self.rules.get(language, []) + self.rules.get("general", [])
+    def _load_rules_file(self, rule_file: Path, language: Optional[str] = None) -> bool:
+        """Load rules from a YAML file, or from the cache if it is unchanged; returns whether it was parsed"""
+        st = rule_file.stat()
+        entry = self._file_cache.get(str(rule_file))
+        parsed = not entry or (entry["mtime_ns"], entry["size"]) != (st.st_mtime_ns, st.st_size)
+        if parsed:
+            file_language, rules = self._parse_rules_file(rule_file, language)
+            self._file_cache[str(rule_file)] = {
+                "mtime_ns": st.st_mtime_ns,
+                "size": st.st_size,
+                "language": file_language,
+                "rules": [rule.model_dump() for rule in rules]
+            }
         else:
-            # Return all rules
-            rules = []
-            for lang_rules in self.rules.values():
-                rules.extend(lang_rules)
+            # Validated when the file was parsed
+            file_language = entry["language"]
+            rules = [Rule.model_construct(**rule_data) for rule_data in entry["rules"]]
+        
+        if rules:
+            self.rules.setdefault(file_language, []).extend(rules)
+            logger.info("Loaded rules", file=str(rule_file), count=len(rules), language=file_language,
+                        cached=not parsed)
+        return parsed
+    
+    def _parse_rules_file(self, rule_file: Path, language: Optional[str] = None) -> Tuple[str, List[Rule]]:
+        """Parse and validate the rules in a YAML file"""
+        with open(rule_file, 'r') as f:
+            data = yaml.load(f, Loader=YAML_LOADER)
+        
+        if not isinstance(data, dict):
+            return "general", []
         
-        # Filter enabled rules
-        enabled_rules = [r for r in rules if r.enabled]
+        # Determine language
+        file_language = language or data.get("language") or "general"
         
-        return [rule.dict() for rule in enabled_rules]
+        rules = []
+        for rule_data in data.get("rules") or []:
+            rule = Rule(**rule_data)
+            rule.language = rule.language or file_language
+            rules.append(rule)
+        return file_language, rules
+    
+    def _read_file_cache(self) -> Dict[str, Dict[str, Any]]:
+        """Load the persisted rule file cache, or start empty"""
+        if not self.cache_file or not self.cache_file.exists():
+            return {}
+        try:
+            data = orjson.loads(self.cache_file.read_bytes())
+            if data.get("version") == RULES_CACHE_VERSION:
+                return data["files"]
+        except Exception as e:
+            logger.warning("Ignoring unreadable rules cache", file=str(self.cache_file), error=str(e))
+        return {}
+    
+    def _write_file_cache(self):
+        """Persist the rule file cache, replacing the old file atomically"""
+        if not self.cache_file:
+            return
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_file.with_suffix(".tmp")
+            tmp.write_bytes(orjson.dumps({"version": RULES_CACHE_VERSION, "files": self._file_cache}))
+            os.replace(tmp, self.cache_file)
+        except Exception as e:
+            logger.warning("Failed to write rules cache", file=str(self.cache_file), error=str(e))
+    
+    def get_rules(self, language: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get enabled rules for a language, or all of them; the lists are shared, don't mutate them"""
+        return self._dict_cache.get(self._cache_key(language), [])
+    
+    def get_rule(self, name: str, language: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Get the first enabled rule with this name among get_rules(language)"""
+        return self._by_name.get((self._cache_key(language), name))
+    
+    def _cache_key(self, language: Optional[str]) -> Optional[str]:
+        if not language:
+            return None
+        # Languages without rules of their own still get the general ones
+        return language if self._dict_cache.get(language) else "general"
     
     def add_rule(self, rule: Rule):
         """Add a new rule"""
@@ -139,6 +228,7 @@ class RulesManager:
             self.rules[language] = []
         
         self.rules[language].append(rule)
+        self._build_dict_cache()
         logger.info("Rule added", name=rule.name, language=language)
     
     def reload_rules(self):
@@ -148,7 +238,7 @@ class RulesManager:
 
 
 # Initialize rules manager
-rules_manager = RulesManager(RULES_PATH)
+rules_manager = RulesManager(RULES_PATH, RULES_CACHE_FILE)
 
 
 @app.get("/health")
@@ -168,7 +258,7 @@ async def get_rules(language: Optional[str] = None):
 async def add_rule(rule: Rule):
     """Add a new rule"""
     rules_manager.add_rule(rule)
-    return {"success": True, "rule": rule.dict()}
+    return {"success": True, "rule": rule.model_dump()}
 
 
 @app.post("/rules/reload")
@@ -181,15 +271,21 @@ async def reload_rules():
 @app.get("/rules/{rule_name}")
 async def get_rule(rule_name: str, language: Optional[str] = None):
     """Get a specific rule"""
-    rules = rules_manager.get_rules(language)
-    for rule in rules:
-        if rule["name"] == rule_name:
-            return rule
-    
-    raise HTTPException(status_code=404, detail="Rule not found")
+    rule = rules_manager.get_rule(rule_name, language)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    return rule
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # uvloop and httptools ship with uvicorn[standard]; multiple workers need the import string
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8001,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
 
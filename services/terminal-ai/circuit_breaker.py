@@ -0,0 +1,75 @@
+"""
+Circuit Breaker - Stops calling a backend that keeps failing
+"""
+import functools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Tuple, Type
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after ``fail_max`` consecutive failures
+
+    While open, calls raise CircuitOpenError without reaching the backend.
+    After ``reset_timeout`` seconds one trial call is let through: if it
+    succeeds the circuit closes, if it fails the circuit opens again. Only
+    exceptions in ``failure_types`` count as failures.
+    """
+
+    def __init__(self, fail_max: int, reset_timeout: float,
+                 failure_types: Tuple[Type[BaseException], ...] = (Exception,)):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failure_types = failure_types
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """Run the enclosed call through the breaker"""
+        trial = self._admit()
+        try:
+            yield
+        except self.failure_types:
+            self._failures += 1
+            if trial or self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+            if trial:
+                self._trial = False
+            raise
+        except BaseException:
+            # Cancelled or otherwise inconclusive; let the next call be the trial
+            if trial:
+                self._trial = False
+            raise
+        else:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def __call__(self, fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """Decorate a coroutine function so every call goes through the breaker"""
+        @functools.wraps(fn)
+        async def guarded(*args: Any, **kwargs: Any) -> Any:
+            async with self.guard():
+                return await fn(*args, **kwargs)
+        return guarded
+
+    def _admit(self) -> bool:
+        """Raise if the call may not proceed; True if it is the half-open trial"""
+        if self._opened_at is None:
+            return False
+        if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+            raise CircuitOpenError("circuit open")
+        self._trial = True
+        return True
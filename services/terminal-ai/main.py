@@ -2,13 +2,24 @@
 Terminal AI Assistant - AI assistance in terminal/command line
 """
 import os
-from typing import Dict, Any, Optional
+import asyncio
+import hashlib
+from contextlib import aclosing
+from typing import Annotated, AsyncIterator, Awaitable, Callable, Dict, Any, List, Optional
 import structlog
 import httpx
+import orjson
+from cachetools import LRUCache, TTLCache
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, ValidationError
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from semantic_cache import SemanticCache
 
 # Configure structured logging
 structlog.configure(
@@ -21,7 +32,8 @@ structlog.configure(
         structlog.processors.StackInfoRenderer(),
         structlog.processors.format_exc_info,
         structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer()
+        # orjson encodes the event dict; stdlib handlers still take a str
+        structlog.processors.JSONRenderer(serializer=lambda event, **kw: orjson.dumps(event, **kw).decode())
     ],
     context_class=dict,
     logger_factory=structlog.stdlib.LoggerFactory(),
@@ -34,11 +46,127 @@ logger = structlog.get_logger()
 # Configuration
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://host.docker.internal:11434")
 AGENT_ORCHESTRATOR_URL = os.getenv("AGENT_ORCHESTRATOR_URL", "http://agent-orchestrator:8000")
+# Shell commands need a small instruction model, not a 70B-class one
+MODEL = os.getenv("TERMINAL_AI_MODEL", "qwen2.5-coder:7b")
+
+# Answers to identical requests are reused for an hour. Only low-temperature
+# generations are cached, since those would come out (nearly) the same again.
+RESPONSE_CACHE_SIZE = 2048
+RESPONSE_CACHE_TTL = 3600.0
+CACHEABLE_MAX_TEMPERATURE = 0.3
+
+# Intents embedded this close to a cached one reuse its suggestion
+EMBEDDING_MODEL = "nomic-embed-text"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+# Keep the model resident with one fixed context size so Ollama reuses the
+# loaded runner and its cached prefix; prompts and answers here are short
+OLLAMA_KEEP_ALIVE = "30m"
+OLLAMA_NUM_CTX = 4096
+# Models are loaded at startup and touched this often (seconds), well inside
+# keep_alive, so an idle spell never leaves the next request to load them
+KEEP_WARM_INTERVAL = 20 * 60
+MODEL_LOAD_TIMEOUT = 120.0
+# A run of blank lines means the model has moved past the answer
+JSON_ANSWER_STOP = ["\n\n\n"]
+# Generations Ollama decodes together in one batch (its OLLAMA_NUM_PARALLEL);
+# more than this wait here rather than queueing inside Ollama against the timeout
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+# Transient Ollama errors are retried with backoff; after this many failed
+# generations in a row Ollama is left alone for a while and cached answers,
+# however old, are served instead
+OLLAMA_RETRY_ATTEMPTS = 3
+OLLAMA_BREAKER_FAIL_MAX = 10
+OLLAMA_BREAKER_RESET_TIMEOUT = 30.0
+
+# Instructions go in the system field, byte-identical on every request, so
+# Ollama only has to prefill the per-request prompt that follows them
+COMMAND_SYSTEM_PROMPT = """You are a helpful terminal assistant.
+
+Provide a safe, appropriate command for what the user wants to do. Consider:
+- Safety (avoid destructive commands unless explicitly requested)
+- Best practices
+- Cross-platform compatibility (Linux/Unix)
+
+Respond in JSON format:
+{
+  "command": "the command to run",
+  "explanation": "brief explanation",
+  "alternatives": ["alternative commands if applicable"],
+  "safety_warning": "warning if command is potentially destructive"
+}"""
+
+EXPLAIN_SYSTEM_PROMPT = """Explain in detail what the given command does.
+
+Include:
+- What it does
+- Each flag/option
+- Common use cases
+- Safety considerations"""
+
+FIX_SYSTEM_PROMPT = """The user ran a command and got an error.
+
+Provide:
+1. The corrected command
+2. Explanation of what was wrong
+3. Alternative solutions if applicable
+
+Format as JSON:
+{
+  "fixed_command": "corrected command",
+  "explanation": "what was wrong",
+  "alternatives": ["alternative solutions"]
+}"""
+
+# Request bodies minus the prompt, built once; handlers only add the prompt.
+# Never mutate these or their options in place.
+COMMAND_PAYLOAD = {
+    "model": MODEL,
+    "system": COMMAND_SYSTEM_PROMPT,
+    "stream": True,
+    # Constrains the answer to JSON, so prose never precedes the object
+    "format": "json",
+    "keep_alive": OLLAMA_KEEP_ALIVE,
+    "options": {
+        "temperature": 0.3,
+        "num_predict": 200,
+        "num_ctx": OLLAMA_NUM_CTX,
+        "stop": JSON_ANSWER_STOP
+    }
+}
+
+EXPLAIN_PAYLOAD = {
+    "model": MODEL,
+    "system": EXPLAIN_SYSTEM_PROMPT,
+    "stream": False,
+    "keep_alive": OLLAMA_KEEP_ALIVE,
+    "options": {
+        "temperature": 0.2,
+        "num_predict": 1000,
+        "num_ctx": OLLAMA_NUM_CTX
+    }
+}
+
+FIX_PAYLOAD = {
+    "model": MODEL,
+    "system": FIX_SYSTEM_PROMPT,
+    "stream": True,
+    "format": "json",
+    "keep_alive": OLLAMA_KEEP_ALIVE,
+    "options": {
+        "temperature": 0.3,
+        "num_predict": 500,
+        "num_ctx": OLLAMA_NUM_CTX,
+        "stop": JSON_ANSWER_STOP
+    }
+}
 
 app = FastAPI(
     title="Terminal AI Assistant",
     description="AI assistance for terminal/command line operations",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -48,12 +176,27 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Explanations run to a few KB; short answers and health checks stay uncompressed
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+
+# Longest request fields accepted; everything here ends up in the prompt
+MAX_INTENT_CHARS = 2000
+MAX_PATH_CHARS = 4096
+MAX_COMMAND_CHARS = 4096
+MAX_ERROR_CHARS = 8000
 
 
 class CommandRequest(BaseModel):
-    user_intent: str = Field(..., description="What the user wants to do")
-    current_directory: Optional[str] = Field(default=None, description="Current working directory")
-    command_history: Optional[list] = Field(default=None, description="Recent command history")
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True, extra="ignore")
+    
+    user_intent: Annotated[str, StringConstraints(max_length=MAX_INTENT_CHARS)] = Field(
+        ..., description="What the user wants to do"
+    )
+    current_directory: Optional[Annotated[str, StringConstraints(max_length=MAX_PATH_CHARS)]] = Field(
+        default=None, description="Current working directory"
+    )
+    command_history: Optional[List[str]] = Field(default=None, description="Recent command history")
     error_message: Optional[str] = Field(default=None, description="Error message if command failed")
 
 
@@ -64,164 +207,495 @@ class CommandResponse(BaseModel):
     safety_warning: Optional[str] = None
 
 
+class ExplainRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True, extra="ignore")
+    
+    command: Annotated[str, StringConstraints(min_length=1, max_length=MAX_COMMAND_CHARS)] = Field(
+        ..., description="Command to explain"
+    )
+    stream: bool = Field(default=False, description="Stream the explanation as server-sent events")
+
+
+class ExplainResponse(BaseModel):
+    command: str
+    explanation: str
+
+
+class FixRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True, extra="ignore")
+    
+    command: Annotated[str, StringConstraints(min_length=1, max_length=MAX_COMMAND_CHARS)] = Field(
+        ..., description="Command that failed"
+    )
+    error_message: Annotated[str, StringConstraints(max_length=MAX_ERROR_CHARS)] = Field(
+        ..., description="Error the command printed"
+    )
+
+
+class FixResponse(BaseModel):
+    fixed_command: str
+    explanation: str
+    alternatives: Optional[list] = None
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Tokens have to reach the client as they arrive, so proxies must not buffer;
+# an explicit encoding also keeps GZipMiddleware from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Content-Encoding": "identity"}
+# Polled constantly by the gateway and load balancers, so encoded once
+HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "terminal-ai"})
+
+# Pooled Ollama client shared by every request; HTTP/2 applies when OLLAMA_HOST is https
+ollama_client = httpx.AsyncClient(
+    base_url=OLLAMA_HOST,
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=2.0, write=5.0, pool=1.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60.0)
+)
+
+response_cache: TTLCache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+# The same answers without expiry, served only while Ollama is unreachable
+stale_responses: LRUCache = LRUCache(maxsize=RESPONSE_CACHE_SIZE)
+# Ollama calls running right now, by cache key, so identical requests share one
+inflight: Dict[str, "asyncio.Task[Any]"] = {}
+intent_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+# Ollama has no multi-prompt generate endpoint; it batches whatever is in
+# flight at once, so keep exactly its batch width running
+generation_slots = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+ollama_breaker = CircuitBreaker(
+    fail_max=OLLAMA_BREAKER_FAIL_MAX,
+    reset_timeout=OLLAMA_BREAKER_RESET_TIMEOUT,
+    failure_types=(httpx.HTTPError,)
+)
+ollama_retry = retry(
+    stop=stop_after_attempt(OLLAMA_RETRY_ATTEMPTS),
+    wait=wait_exponential_jitter(initial=0.1, max=2.0),
+    retry=retry_if_exception_type((httpx.TimeoutException, httpx.RemoteProtocolError)),
+    before_sleep=lambda state: logger.warning(
+        "Retrying Ollama request", attempt=state.attempt_number, error=str(state.outcome.exception())
+    ),
+    reraise=True
+)
+
+
+def cache_key(*fields: Any) -> str:
+    """Digest of the request fields that shape a prompt"""
+    return hashlib.blake2b("\0".join(str(field) for field in fields).encode(), digest_size=16).hexdigest()
+
+
+async def single_flight(key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Run call, or wait for the identical one already running under key"""
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(call())
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    # Shield so one cancelled caller doesn't cancel the call others wait on
+    return await asyncio.shield(task)
+
+
+def remember(key: str, value: Any, temperature: float) -> Any:
+    """Cache a parsed answer if it was generated at a cacheable temperature, and return it"""
+    if temperature <= CACHEABLE_MAX_TEMPERATURE:
+        response_cache[key] = value
+        stale_responses[key] = value
+    return value
+
+
+def serve_stale(key: str) -> Any:
+    """The last answer cached under key, for when Ollama's circuit is open"""
+    stale = stale_responses.get(key)
+    if stale is None:
+        raise HTTPException(status_code=503, detail="Ollama is unavailable", headers={"Retry-After": "30"})
+    logger.warning("Ollama circuit open, serving stale answer")
+    return stale
+
+
+async def post_ollama(path: str, payload: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+    """POST an orjson-encoded payload to Ollama and decode the JSON reply"""
+    response = await ollama_client.post(path, content=orjson.dumps(payload), headers=JSON_HEADERS, **kwargs)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+
+@ollama_breaker
+@ollama_retry
+async def generate_ollama(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a non-streaming generate request in a free batch slot"""
+    async with generation_slots:
+        return await post_ollama("/api/generate", payload)
+
+
+async def stream_ollama(payload: Dict[str, Any]) -> AsyncIterator[str]:
+    """Stream a generate request, yielding the answer as it is produced"""
+    # The slot is held for the whole stream, since Ollama decodes it until the end
+    async with generation_slots, ollama_client.stream(
+        "POST", "/api/generate", content=orjson.dumps(payload), headers=JSON_HEADERS
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            result = orjson.loads(line)
+            if result.get("response"):
+                yield result["response"]
+            if result.get("done"):
+                break
+
+
+@ollama_breaker
+@ollama_retry
+async def generate_json_answer(payload: Dict[str, Any]) -> str:
+    """
+    Stream a generate request until the answer's first JSON object is complete
+    
+    Whatever the model would write after the object is never parsed, so
+    the stream is dropped there rather than generated to num_predict.
+    """
+    text: List[str] = []
+    scanner = JsonAnswerScanner()
+    async with aclosing(stream_ollama(payload)) as pieces:
+        async for piece in pieces:
+            text.append(piece)
+            if scanner.feed(piece) is not None:
+                break
+    return "".join(text)
+
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    """Encode one server-sent event"""
+    prefix = f"event: {event}\n".encode() if event else b""
+    return prefix + b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+def extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    The JSON object in a model answer, or None
+    
+    The answer is tried as-is first; otherwise each balanced {...} span,
+    skipping braces inside string literals, is tried in order until one
+    decodes to a non-empty object.
+    """
+    try:
+        parsed = orjson.loads(text)
+        if isinstance(parsed, dict):
+            return parsed
+    except orjson.JSONDecodeError:
+        pass
+    
+    start = text.find("{")
+    while start != -1:
+        end = object_end(text, start)
+        if end is not None:
+            try:
+                parsed = orjson.loads(text[start:end])
+                if parsed:
+                    return parsed
+            except orjson.JSONDecodeError:
+                pass
+        start = text.find("{", start + 1)
+    return None
+
+
+def object_end(text: str, start: int) -> Optional[int]:
+    """Index just past the } closing the { at start, or None if it isn't closed yet"""
+    depth = 0
+    in_string = escaped = False
+    for end in range(start, len(text)):
+        char = text[end]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return end + 1
+    return None
+
+
+class JsonAnswerScanner:
+    """
+    Finds the first JSON object in an answer as it streams in
+
+    Each chunk is scanned once, tracking nesting and string literals. A
+    balanced span that doesn't decode to a non-empty object, such as
+    ``${HOME}`` or ``{}`` in prose, is dropped and scanning resumes after it.
+    """
+    
+    def __init__(self):
+        self._span: List[str] = []
+        self._depth = 0
+        self._in_string = self._escaped = False
+    
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        """Consume a chunk; return the object once it is complete"""
+        begin = 0
+        if not self._depth:
+            begin = chunk.find("{")
+            if begin == -1:
+                return None
+        
+        i = begin
+        while i < len(chunk):
+            char = chunk[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._depth:
+                self._in_string = True
+            elif char == "{":
+                if not self._depth:
+                    begin = i
+                self._depth += 1
+            elif char == "}" and self._depth:
+                self._depth -= 1
+                if not self._depth:
+                    self._span.append(chunk[begin:i + 1])
+                    try:
+                        parsed = orjson.loads("".join(self._span))
+                    except orjson.JSONDecodeError:
+                        parsed = None
+                    self._span = []
+                    if parsed and isinstance(parsed, dict):
+                        return parsed
+                    begin = i + 1
+            i += 1
+        
+        if self._depth:
+            self._span.append(chunk[begin:])
+        return None
+
+
+async def embed_text(text: str) -> Optional[list]:
+    """Embed text with Ollama, or None if that failed"""
+    try:
+        result = await post_ollama(
+            "/api/embeddings",
+            {"model": EMBEDDING_MODEL, "prompt": text, "keep_alive": OLLAMA_KEEP_ALIVE},
+            timeout=10.0
+        )
+        return result.get("embedding") or None
+    except Exception as e:
+        logger.warning("Failed to embed text for the semantic cache", error=str(e))
+        return None
+
+
+async def keep_models_warm():
+    """Load the generation and embedding models, then keep them from being unloaded"""
+    while True:
+        try:
+            # An empty prompt only loads the model; num_ctx must match the
+            # requests' or Ollama would reload the runner for the first one
+            await post_ollama(
+                "/api/generate",
+                {"model": MODEL, "keep_alive": OLLAMA_KEEP_ALIVE, "options": {"num_ctx": OLLAMA_NUM_CTX}},
+                timeout=MODEL_LOAD_TIMEOUT
+            )
+            await post_ollama(
+                "/api/embeddings",
+                {"model": EMBEDDING_MODEL, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=MODEL_LOAD_TIMEOUT
+            )
+            logger.info("Ollama models warm", model=MODEL, embedding_model=EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning("Failed to warm Ollama models", error=str(e))
+        await asyncio.sleep(KEEP_WARM_INTERVAL)
+
+
+@app.on_event("startup")
+async def startup():
+    """Start keeping the models loaded"""
+    app.state.keep_warm = asyncio.create_task(keep_models_warm())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the keep-warm task and close the pooled Ollama client"""
+    app.state.keep_warm.cancel()
+    await ollama_client.aclose()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "terminal-ai"}
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 
 @app.post("/api/command", response_model=CommandResponse)
-async def suggest_command(request: CommandRequest):
-    """Suggest command based on user intent"""
+async def suggest_command(request: CommandRequest, no_cache: bool = False):
+    """Suggest command based on user intent; no_cache skips the response cache"""
     try:
         logger.info("Command suggestion requested", intent=request.user_intent)
         
+        key = cache_key(
+            "command", MODEL, request.user_intent, request.current_directory, request.error_message,
+            *(request.command_history or [])[-5:]
+        )
+        cached = None if no_cache else response_cache.get(key)
+        if cached is not None:
+            logger.info("Command suggestion served from cache")
+            return cached
+        
+        # Reworded intents reuse a suggestion made in the same directory, but
+        # an error message makes the answer depend on state, so skip those
+        intent_vector = None
+        if not request.error_message:
+            intent_vector = await embed_text(request.user_intent)
+            similar = None
+            if intent_vector and not no_cache:
+                similar = intent_cache.get(intent_vector, request.current_directory or "")
+            if similar is not None:
+                logger.info("Command suggestion served from semantic cache")
+                return similar
+        
         # Build context
-        context = f"User wants to: {request.user_intent}"
+        parts = [f"User wants to: {request.user_intent}"]
         if request.current_directory:
-            context += f"\nCurrent directory: {request.current_directory}"
+            parts.append(f"Current directory: {request.current_directory}")
         if request.command_history:
-            context += f"\nRecent commands: {', '.join(request.command_history[-5:])}"
+            parts.append("Recent commands: " + ", ".join(request.command_history[-5:]))
         if request.error_message:
-            context += f"\nError: {request.error_message}"
+            parts.append(f"Error: {request.error_message}")
+        context = "\n".join(parts)
         
         # Call Ollama for command suggestion
-        url = f"{OLLAMA_HOST}/api/generate"
-        payload = {
-            "model": "qwen2.5:72b",
-            "prompt": f"""You are a helpful terminal assistant. The user wants to: {request.user_intent}
-
-{context}
-
-Provide a safe, appropriate command. Consider:
-- Safety (avoid destructive commands unless explicitly requested)
-- Best practices
-- Cross-platform compatibility (Linux/Unix)
-
-Respond in JSON format:
-{{
-  "command": "the command to run",
-  "explanation": "brief explanation",
-  "alternatives": ["alternative commands if applicable"],
-  "safety_warning": "warning if command is potentially destructive"
-}}""",
-            "stream": False,
-            "options": {
-                "temperature": 0.3,
-                "num_predict": 500
-            }
-        }
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            
-            # Parse response
-            import json
-            import re
-            response_text = result.get("response", "")
-            
-            # Try to extract JSON
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                try:
-                    parsed = json.loads(json_match.group())
-                    return CommandResponse(**parsed)
-                except:
-                    pass
-            
-            # Fallback
-            return CommandResponse(
-                command=response_text.split('\n')[0].strip(),
-                explanation=response_text[:200]
-            )
+        payload = {**COMMAND_PAYLOAD, "prompt": context}
+        
+        response_text = await single_flight(key, lambda: generate_json_answer(payload))
+        
+        # Try to extract JSON
+        parsed = extract_json(response_text)
+        if parsed is not None:
+            try:
+                suggestion = remember(key, CommandResponse.model_validate(parsed), payload["options"]["temperature"])
+                if intent_vector and payload["options"]["temperature"] <= CACHEABLE_MAX_TEMPERATURE:
+                    intent_cache.put(intent_vector, suggestion, request.current_directory or "")
+                return suggestion
+            except ValidationError:
+                pass
+        
+        # Fallback
+        return CommandResponse(
+            command=response_text.split('\n')[0].strip(),
+            explanation=response_text[:200]
+        )
     
+    except CircuitOpenError:
+        return serve_stale(key)
     except Exception as e:
         logger.error("Command suggestion failed", error=str(e), exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/explain-command")
-async def explain_command(command: str):
-    """Explain what a command does"""
+@app.post("/api/explain-command", response_model=ExplainResponse, response_model_exclude_none=True)
+async def explain_command(request: ExplainRequest, no_cache: bool = False):
+    """
+    Explain what a command does; no_cache skips the response cache
+    
+    With stream, the explanation arrives as server-sent events: one unnamed
+    event per generated piece of text, then ``done``, or ``error`` if
+    generation failed midway.
+    """
+    command = request.command
     try:
-        url = f"{OLLAMA_HOST}/api/generate"
-        payload = {
-            "model": "qwen2.5:72b",
-            "prompt": f"Explain what this command does in detail: {command}\n\nInclude:\n- What it does\n- Each flag/option\n- Common use cases\n- Safety considerations",
-            "stream": False,
-            "options": {
-                "temperature": 0.2,
-                "num_predict": 1000
-            }
-        }
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            
-            return {
-                "command": command,
-                "explanation": result.get("response", "")
-            }
+        key = cache_key("explain", MODEL, command)
+        cached = None if no_cache else response_cache.get(key)
+        if cached is not None:
+            if request.stream:
+                return StreamingResponse(
+                    iter([sse_event({"response": cached["explanation"]}), sse_event({}, "done")]),
+                    media_type="text/event-stream",
+                    headers=SSE_HEADERS
+                )
+            return cached
+        
+        payload = {**EXPLAIN_PAYLOAD, "prompt": f"Command: {command}"}
+        
+        if request.stream:
+            return StreamingResponse(
+                explain_events(key, command, {**payload, "stream": True}),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+        
+        result = await single_flight(key, lambda: generate_ollama(payload))
+        
+        return remember(key, {
+            "command": command,
+            "explanation": result.get("response", "")
+        }, payload["options"]["temperature"])
     
+    except CircuitOpenError:
+        return serve_stale(key)
     except Exception as e:
         logger.error("Command explanation failed", error=str(e), exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/fix-command")
-async def fix_command(command: str, error_message: str):
-    """Fix a command that failed"""
+async def explain_events(key: str, command: str, payload: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """Server-sent events for a streamed explanation, cached once it completes"""
+    pieces = []
     try:
-        url = f"{OLLAMA_HOST}/api/generate"
-        payload = {
-            "model": "qwen2.5:72b",
-            "prompt": f"""The user ran this command and got an error:
-
-Command: {command}
-Error: {error_message}
+        async with ollama_breaker.guard():
+            async for piece in stream_ollama(payload):
+                pieces.append(piece)
+                yield sse_event({"response": piece})
+    except CircuitOpenError:
+        stale = stale_responses.get(key)
+        if stale is None:
+            yield sse_event({"error": "Ollama is unavailable"}, "error")
+            return
+        logger.warning("Ollama circuit open, serving stale answer")
+        yield sse_event({"response": stale["explanation"]})
+        yield sse_event({}, "done")
+        return
+    except Exception as e:
+        logger.error("Command explanation failed", error=str(e), exc_info=True)
+        yield sse_event({"error": str(e)}, "error")
+        return
+    remember(key, {"command": command, "explanation": "".join(pieces)}, payload["options"]["temperature"])
+    yield sse_event({}, "done")
 
-Provide:
-1. The corrected command
-2. Explanation of what was wrong
-3. Alternative solutions if applicable
 
-Format as JSON:
-{{
-  "fixed_command": "corrected command",
-  "explanation": "what was wrong",
-  "alternatives": ["alternative solutions"]
-}}""",
-            "stream": False,
-            "options": {
-                "temperature": 0.3,
-                "num_predict": 500
-            }
-        }
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            
-            import json
-            import re
-            response_text = result.get("response", "")
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group())
-                except:
-                    pass
-            
-            return {
-                "fixed_command": response_text.split('\n')[0].strip(),
-                "explanation": response_text[:200]
-            }
+@app.post("/api/fix-command", response_model=FixResponse, response_model_exclude_none=True)
+async def fix_command(request: FixRequest, no_cache: bool = False):
+    """Fix a command that failed; no_cache skips the response cache"""
+    command, error_message = request.command, request.error_message
+    try:
+        key = cache_key("fix", MODEL, command, error_message)
+        cached = None if no_cache else response_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        payload = {**FIX_PAYLOAD, "prompt": f"Command: {command}\nError: {error_message}"}
+        
+        response_text = await single_flight(key, lambda: generate_json_answer(payload))
+        parsed = extract_json(response_text)
+        if parsed is not None:
+            try:
+                return remember(key, FixResponse.model_validate(parsed), payload["options"]["temperature"])
+            except ValidationError:
+                pass
+        
+        return FixResponse(
+            fixed_command=response_text.split('\n')[0].strip(),
+            explanation=response_text[:200]
+        )
     
+    except CircuitOpenError:
+        return serve_stale(key)
     except Exception as e:
         logger.error("Command fix failed", error=str(e), exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -229,5 +703,13 @@ Format as JSON:
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8004)
+    # uvloop and httptools ship with uvicorn[standard]; multiple workers need the import string
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8004,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
 
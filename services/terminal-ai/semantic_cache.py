@@ -0,0 +1,62 @@
+"""
+Semantic Cache - Reuses answers for requests phrased differently but meaning the same
+"""
+import time
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Answers keyed by an embedding of the request text
+
+    A lookup returns the answer stored for the most similar earlier request
+    with the same context, if their cosine similarity reaches ``threshold``.
+    Entries expire after ``ttl`` seconds; once full, the oldest slot is reused.
+    """
+
+    def __init__(self, threshold: float, maxsize: int, ttl: float):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._maxsize = maxsize
+        # Unit vectors, one row per slot; allocated once the dimension is known
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[Tuple[float, str, Any]]] = [None] * maxsize
+        self._next = 0
+
+    def get(self, vector: List[float], context: str = "") -> Optional[Any]:
+        """Return the cached answer closest to vector, or None"""
+        query = self._normalize(vector)
+        if self._vectors is None or query is None or query.shape[0] != self._vectors.shape[1]:
+            return None
+
+        scores = self._vectors @ query
+        now = time.monotonic()
+        for i in np.argsort(scores)[::-1]:
+            if scores[i] < self.threshold:
+                break
+            entry = self._entries[i]
+            if entry is not None and entry[0] > now and entry[1] == context:
+                return entry[2]
+        return None
+
+    def put(self, vector: List[float], value: Any, context: str = ""):
+        """Store an answer under vector"""
+        row = self._normalize(vector)
+        if row is None:
+            return
+        if self._vectors is None:
+            self._vectors = np.zeros((self._maxsize, row.shape[0]), dtype=np.float32)
+        elif row.shape[0] != self._vectors.shape[1]:
+            return
+
+        self._vectors[self._next] = row
+        self._entries[self._next] = (time.monotonic() + self.ttl, context, value)
+        self._next = (self._next + 1) % self._maxsize
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> Optional[np.ndarray]:
+        row = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(row)
+        return row / norm if row.ndim == 1 and norm > 0 else None
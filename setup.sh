@@ -224,6 +224,7 @@ else
     echo "Recommended models not found. Please install them:"
     echo "  ollama pull deepseek-coder:33b    # Coding model"
     echo "  ollama pull llama3.2:90b          # Reasoning model"
+    echo "  ollama pull qwen2.5-coder:7b      # Terminal assistant model"
     echo "  ollama pull nomic-embed-text      # Embedding model"
     echo ""
     echo "See MODEL_RECOMMENDATIONS.md for complete recommendations."